@@ -114,6 +114,77 @@ def cherrydoor():
             help=f"don't {description}",
         )
 
+    simulate_parser = subparsers.add_parser(
+        "simulate",
+        help="Run a simulated arduino on a pseudo-terminal and measure swipe latency",
+    )
+    simulate_parser.add_argument(
+        "--rate",
+        help="Average number of card swipes per second",
+        dest="rate",
+        type=float,
+        default=1.0,
+    )
+    simulate_parser.add_argument(
+        "--duration",
+        help="Number of seconds to swipe cards for",
+        dest="duration",
+        type=float,
+        default=60.0,
+    )
+    simulate_parser.add_argument(
+        "--cards",
+        help="Number of different cards to swipe",
+        dest="cards",
+        type=int,
+        default=100,
+    )
+    simulate_parser.add_argument(
+        "--uid-length",
+        help="UID length of generated cards (can be used multiple times)",
+        dest="uid_lengths",
+        type=int,
+        choices=[4, 7, 10],
+        action="append",
+    )
+    simulate_parser.add_argument(
+        "--card-manufacturer-code",
+        help="Manufacturer code of generated cards (can be used multiple times)",
+        dest="manufacturer_codes",
+        action="append",
+    )
+    simulate_parser.add_argument(
+        "--connect-timeout",
+        help="Number of seconds to wait for Cherrydoor to connect",
+        dest="connect_timeout",
+        type=float,
+        default=120.0,
+    )
+    simulate_parser.add_argument(
+        "--print-cards",
+        help="Print block 0 of all generated cards",
+        dest="print_cards",
+        action="store_true",
+    )
+    simulate_parser.add_argument(
+        "--framed",
+        help="Accept framed commands if Cherrydoor asks for them (interface.framed)",
+        dest="framed",
+        action="store_true",
+    )
+    simulate_parser.set_defaults(uid_lengths=None, manufacturer_codes=None)
+
+    rollups_parser = subparsers.add_parser(
+        "rollups",
+        help="Rebuild minute, hour and day entry statistics from logs (best run while the server is stopped)",
+    )
+    rollups_parser.add_argument(
+        "--since",
+        help="ISO date or timestamp - only rebuild statistics from this day on",
+        dest="since",
+        default=None,
+    )
+
     start_parser = subparsers.add_parser(
         "start",
         help="Explicitly start the server (this action is preformed if no other argument is passed too)",
@@ -141,10 +212,21 @@ def cherrydoor():
         from cherrydoor.cli.update import update
 
         update(args)
+    if args.subcommand == "simulate":
+        from cherrydoor.cli.simulate import simulate
+
+        args.uid_lengths = args.uid_lengths or [4, 7, 10]
+        args.manufacturer_codes = args.manufacturer_codes or ["18"]
+        simulate(args)
+    if args.subcommand == "rollups":
+        from cherrydoor.cli.rollups import rollups
+
+        rollups(args, config)
     # if start argument was passed or no arguments were used, start the server
     if args.subcommand in ["start", None]:
         from cherrydoor.app import setup_app
-        from cherrydoor.interface.serial import Serial
+        from cherrydoor.database import close_db
+        from cherrydoor.interface.manager import ReaderManager
 
         try:
             import uvloop
@@ -154,10 +236,14 @@ def cherrydoor():
             pass
         loop = asyncio.get_event_loop()
         app = setup_app(loop, config)
-        interface = Serial(app["db"], loop)
-        app["serial"] = interface
-        app.on_startup.append(interface.aiohttp_startup)
-        app.on_cleanup.append(interface.cleanup)
+        readers = ReaderManager(app["storage"], loop, config)
+        app["readers"] = readers
+        # primary door, used by everything that isn't door-specific
+        app["serial"] = readers.primary
+        app.on_startup.append(readers.aiohttp_startup)
+        app.on_cleanup.append(readers.cleanup)
+        # cleanup callbacks run in order - readers flush their log buffers, so storage is closed after them
+        app.on_cleanup.append(close_db)
 
         web.run_app(
             app,
@@ -41,6 +41,10 @@ openapi_overrides = {
             "name": "API",
             "description": "Endpoints related to the API itself - for example API keys",
         },
+        {
+            "name": "metrics",
+            "description": "Endpoints used to check performance of the server",
+        },
     ],
     "components": {
         "schemas": {
@@ -129,6 +133,113 @@ openapi_overrides = {
                     ],
                 },
             },
+            "SwipeMetrics": {
+                "type": "object",
+                "properties": {
+                    "Ok": {"type": "boolean", "default": True},
+                    "Error": {"nullable": True, "type": "string", "default": None},
+                    "status_code": {"type": "integer", "minimum": 200, "maximum": 307},
+                    "metrics": {
+                        "type": "object",
+                        "properties": {
+                            "total": {
+                                "$ref": "#/components/schemas/Histogram",
+                            },
+                            "stages": {
+                                "type": "object",
+                                "description": "histogram for each stage of processing a card (extract_uid, auth_required, authenticate, delay, write)",
+                                "additionalProperties": {
+                                    "$ref": "#/components/schemas/Histogram",
+                                },
+                            },
+                            "slowest": {
+                                "type": "array",
+                                "description": "slowest of the recent swipes",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "timestamp": {
+                                            "type": "string",
+                                            "format": "date-time",
+                                        },
+                                        "total": {"type": "number"},
+                                        "stages": {
+                                            "type": "object",
+                                            "additionalProperties": {"type": "number"},
+                                        },
+                                        "uid": {"type": "string"},
+                                        "auth_mode": {"type": "string"},
+                                        "success": {"type": "boolean"},
+                                    },
+                                },
+                            },
+                            "card_index": {"type": "object"},
+                            "dispatcher": {"type": "object"},
+                            "output": {"type": "object"},
+                            "terminal_log": {"type": "object"},
+                            "device_allowlist": {"type": "object"},
+                            "offline": {"type": "object"},
+                            "duplicate_swipes": {"type": "integer"},
+                            "log_buffers": {"type": "object"},
+                            "doors": {
+                                "type": "object",
+                                "description": "swipe histograms, dispatcher, output, terminal_log, offline, device_allowlist and duplicate_swipes metrics of each door, by door id",
+                                "additionalProperties": {"type": "object"},
+                            },
+                        },
+                    },
+                },
+                "readOnly": True,
+            },
+            "StatsMetrics": {
+                "type": "object",
+                "properties": {
+                    "Ok": {"type": "boolean", "default": True},
+                    "Error": {"nullable": True, "type": "string", "default": None},
+                    "status_code": {"type": "integer", "minimum": 200, "maximum": 307},
+                    "metrics": {
+                        "type": "object",
+                        "nullable": True,
+                        "properties": {
+                            "entries": {"type": "integer"},
+                            "hits": {"type": "integer"},
+                            "misses": {"type": "integer"},
+                            "coalesced": {
+                                "type": "integer",
+                                "description": "requests that waited for an identical request to finish",
+                            },
+                            "tail_refreshes": {
+                                "type": "integer",
+                                "description": "requests that only recomputed the last interval",
+                            },
+                            "invalidations": {"type": "integer"},
+                            "hit_ratio": {"type": "number", "nullable": True},
+                            "aggregation_time": {
+                                "$ref": "#/components/schemas/Histogram",
+                            },
+                        },
+                    },
+                },
+                "readOnly": True,
+            },
+            "Histogram": {
+                "type": "object",
+                "description": "latency histogram (all times in milliseconds)",
+                "properties": {
+                    "count": {"type": "integer"},
+                    "mean": {"type": "number", "nullable": True},
+                    "max": {"type": "number", "nullable": True},
+                    "p50": {"type": "number", "nullable": True},
+                    "p95": {"type": "number", "nullable": True},
+                    "p99": {"type": "number", "nullable": True},
+                    "buckets": {
+                        "type": "object",
+                        "description": "number of values in each bucket, by its upper bound",
+                        "additionalProperties": {"type": "integer"},
+                    },
+                },
+                "readOnly": True,
+            },
             "User": {
                 "type": "object",
                 "properties": {
@@ -182,6 +293,60 @@ openapi_overrides = {
                     },
                 },
             },
+            "UserList": {
+                "type": "object",
+                "properties": {
+                    "Ok": {"type": "boolean", "default": True},
+                    "Error": {"nullable": True, "type": "string", "default": None},
+                    "status_code": {"type": "integer", "minimum": 200, "maximum": 307},
+                    "users": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "_id": {
+                                    "type": "string",
+                                    "description": "The unique id of an user",
+                                },
+                                "username": {
+                                    "type": "string",
+                                    "description": "The unique username of an user",
+                                },
+                                "cards": {
+                                    "type": "array",
+                                    "description": "list of all cards associated with the user",
+                                    "items": {"type": "string", "format": "mifare uid"},
+                                },
+                                "permissions": {
+                                    "type": "array",
+                                    "description": "list of all permissions the user has",
+                                    "items": {"type": "string"},
+                                },
+                            },
+                        },
+                    },
+                    "next": {
+                        "nullable": True,
+                        "type": "string",
+                        "description": "value of the after parameter for the next page, null on the last page",
+                    },
+                },
+                "readOnly": True,
+                "example": {
+                    "Ok": True,
+                    "Error": None,
+                    "status_code": 200,
+                    "users": [
+                        {
+                            "_id": "60f1b2c3d4e5f6a7b8c9d0e1",
+                            "username": "Administrator",
+                            "cards": ["AAAAAAAA", "01234567"],
+                            "permissions": ["admin"],
+                        }
+                    ],
+                    "next": "Administrator",
+                },
+            },
             "APIKeyData": {
                 "type": "object",
                 "properties": {
@@ -1,8 +1,9 @@
+from json import dumps
 from typing import List
 
 import aiohttp_csrf
 from aiojobs.aiohttp import atomic
-from aiohttp.web import Request
+from aiohttp.web import HTTPBadRequest, Request
 from aiohttp.web_response import Response
 from aiohttp_rest_api import AioHTTPRestEndpoint
 from aiohttp_rest_api.responses import respond_with_json
@@ -38,8 +39,12 @@ class DoorEndpoint(AioHTTPRestEndpoint):
                         properties:
                             door:
                                 type: boolean
+                            door_id:
+                                type: string
+                                description: id of the door to open, the first configured door if not set
                         example:
                             door: true
+                            door_id: main
         responses:
             "200":
                 description: A JSON document indicating success
@@ -47,6 +52,12 @@ class DoorEndpoint(AioHTTPRestEndpoint):
                     application/json:
                         schema:
                             $ref: '#/components/schemas/Ok'
+            "400":
+                description: A JSON document indicating error in request (door with that id doesn't exist)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
             "401":
                 description: A JSON document indicating error in request (user not authenticated)
                 content:
@@ -63,5 +74,14 @@ class DoorEndpoint(AioHTTPRestEndpoint):
         """
         await check_api_permissions(request, ["enter"])
         data = await request.json()
-        await request.app["serial"].writeline(f"AUTH {int(data.get('door', 0))}")
+        try:
+            interface = request.app["readers"].get(data.get("door_id", None))
+        except KeyError:
+            reason = f"Unknown door: {data.get('door_id')}"
+            raise HTTPBadRequest(
+                reason=reason,
+                body=dumps({"Ok": False, "Error": reason, "status_code": 400}),
+                content_type="application/json",
+            )
+        await interface.writeline(f"AUTH {int(data.get('door', 0))}")
         return respond_with_json({"Ok": True, "Error": None, "status_code": 200})
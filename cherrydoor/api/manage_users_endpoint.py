@@ -16,6 +16,7 @@ from cherrydoor.database import (
     user_exists,
     create_user,
     delete_user,
+    list_users,
 )
 from cherrydoor.util import get_datetime
 
@@ -25,6 +26,117 @@ class ManageUsersEndpoint(AioHTTPRestEndpoint):
         """"""
         return ["/users"]
 
+    async def get(self, request: Request) -> Response:
+        """
+        ---
+        summary: List users
+        description: Get a page of users sorted by username or id. To get the next page, pass the returned next value as after
+        security:
+            - Bearer Authentication: [users_read]
+            - X-API-Key Authentication: [users_read]
+            - Session Authentication: [users_read]
+        tags:
+            - users
+        parameters:
+            - name: sort
+              in: query
+              description: The field users are sorted by
+              schema:
+                type: string
+                enum:
+                    - username
+                    - _id
+                default: username
+            - name: after
+              in: query
+              description: The next value returned with the previous page
+              schema:
+                type: string
+            - name: limit
+              in: query
+              description: The maximum number of users on a page (up to user_listing.max_page_size from config)
+              schema:
+                type: integer
+                minimum: 1
+            - name: permission
+              in: query
+              description: Only list users with this permission
+              schema:
+                type: string
+                enum:
+                    - admin
+                    - enter
+                    - logs
+                    - users_read
+                    - users_manage
+                    - cards
+                    - dashboard
+            - name: card_prefix
+              in: query
+              description: Only list users with a card starting with this prefix (case-sensitive)
+              schema:
+                type: string
+        responses:
+            "200":
+                description: A JSON document with a page of users
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/UserList'
+
+            "400":
+                description: A JSON document indicating error in request (invalid sort or limit)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+            "401":
+                description: A JSON document indicating error in request (user not authenticated)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+            "403":
+                description: A JSON document indicating error in request (user doesn't have permission to preform this action)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+
+        """
+        await check_api_permissions(request, ["users_read"])
+        listing_config = request.app["config"].get("user_listing", {})
+        try:
+            limit = int(request.query.get("limit", listing_config.get("page_size", 50)))
+            if limit < 1:
+                raise ValueError("limit has to be positive")
+            limit = min(limit, listing_config.get("max_page_size", 500))
+            users, next_after = await list_users(
+                request.app,
+                sort=request.query.get("sort", "username"),
+                after=request.query.get("after", None),
+                limit=limit,
+                permission=request.query.get("permission", None),
+                card_prefix=request.query.get("card_prefix", None),
+            )
+        except ValueError as e:
+            raise HTTPBadRequest(
+                reason=str(e),
+                body=json.dumps({"Ok": False, "Error": str(e), "status_code": 400}),
+                content_type="application/json",
+            )
+        for user in users:
+            user["_id"] = str(user["_id"])
+        return respond_with_json(
+            {
+                "Ok": True,
+                "Error": None,
+                "status_code": 200,
+                "users": users,
+                "next": next_after,
+            }
+        )
+
     @atomic
     async def put(self, request: Request) -> Response:
         """
@@ -0,0 +1,94 @@
+from typing import List
+
+from aiohttp.web import Request
+from aiohttp.web_response import Response
+from aiohttp_rest_api import AioHTTPRestEndpoint
+from aiohttp_rest_api.responses import respond_with_json
+
+from cherrydoor.auth import check_api_permissions
+
+
+class SwipeMetricsEndpoint(AioHTTPRestEndpoint):
+    def connected_routes(self) -> List[str]:
+        """"""
+        return ["/metrics/swipe"]
+
+    async def get(self, request: Request) -> Response:
+        """
+        ---
+        summary: Card swipe latency
+        description: Get per-stage latency percentiles (in milliseconds) of card swipes processed since the server started, along with the slowest recent swipes and metrics of the card index, serial command dispatcher, output queue and terminal log, offline mode and log buffers. Top-level reader metrics are of the primary door, metrics of every door are in doors
+        security:
+            - Bearer Authentication: [admin]
+            - X-API-Key Authentication: [admin]
+            - Session Authentication: [admin]
+        tags:
+            - metrics
+        responses:
+            "200":
+                description: A JSON document indicating success
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/SwipeMetrics'
+
+            "401":
+                description: A JSON document indicating error in request (user not authenticated)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+            "403":
+                description: A JSON document indicating error in request (user doesn't have permission to preform this action)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+
+        """
+        await check_api_permissions(request, ["admin"])
+        serial = request.app["serial"]
+        metrics = reader_metrics(serial)
+        metrics["card_index"] = serial.card_index.stats()
+        metrics["log_buffers"] = {
+            name: writer.stats()
+            for name, writer in [
+                ("logs", serial.entry_log),
+                ("terminal", serial.command_log),
+            ]
+            if writer is not None
+        }
+        metrics["doors"] = {
+            str(interface.door_id): reader_metrics(interface)
+            for interface in request.app["readers"]
+        }
+        return respond_with_json(
+            {"Ok": True, "Error": None, "status_code": 200, "metrics": metrics}
+        )
+
+
+def reader_metrics(interface):
+    """Collect metrics of a single reader.
+
+    Parameters
+    ----------
+    interface : cherrydoor.interface.serial.Serial
+        The reader
+    Returns
+    -------
+    metrics : dict
+        swipe latency histograms and metrics of the dispatcher, output queue, terminal log, offline mode
+        and device allowlist of the reader
+    """
+    metrics = interface.swipe_metrics.as_dict()
+    metrics["dispatcher"] = interface.dispatcher.stats()
+    metrics["output"] = interface.output.stats()
+    metrics["terminal_log"] = interface.terminal_log.stats()
+    metrics["offline"] = interface.offline_stats()
+    if interface.device_allowlist is not None:
+        metrics["device_allowlist"] = {
+            **interface.device_allowlist.stats(),
+            "decisions": interface.device_decisions,
+        }
+    metrics["duplicate_swipes"] = interface.duplicate_swipes
+    return metrics
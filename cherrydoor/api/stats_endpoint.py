@@ -8,7 +8,7 @@ from aiohttp_rest_api import AioHTTPRestEndpoint
 from aiohttp_rest_api.responses import respond_with_json
 
 from cherrydoor.auth import check_api_permissions
-from cherrydoor.database import get_grouped_logs
+from cherrydoor.database import get_grouped_logs, get_rollup_stats
 from cherrydoor.util import get_datetime
 
 
@@ -21,7 +21,7 @@ class StatsEndpoint(AioHTTPRestEndpoint):
         """
         ---
         summary: Usage statistics
-        description: Get usage statistics between specified dates - defaults to last week - and with specified granularity - defaults to a day
+        description: Get usage statistics between specified dates - defaults to last week - and with specified granularity - defaults to a day. If granularity is a multiple of a minute, statistics come from pre-aggregated rollups and the start is rounded down to the largest of a minute, an hour or a day that evenly divides granularity. Every interval is returned, including empty ones - if there would be more than the configured maximum number of data points (1000 by default), granularity is multiplied until they fit. If stats cache is enabled, the start is rounded down to a multiple of granularity and the end is rounded up to the end of its interval
         security:
             - Bearer Authentication: [logs]
             - X-API-Key Authentication: [logs]
@@ -63,7 +63,12 @@ class StatsEndpoint(AioHTTPRestEndpoint):
                     application/json:
                         schema:
                             $ref: '#/components/schemas/Stats'
-
+            "400":
+                description: A JSON document indicating error in request (invalid dates or granularity)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
             "401":
                 description: A JSON document indicating error in request (user not authenticated)
                 content:
@@ -94,9 +99,40 @@ class StatsEndpoint(AioHTTPRestEndpoint):
                 body=json.dumps({"Ok": False, "Error": str(e), "status_code": 401}),
                 content_type="application/json",
             )
-        stats = await get_grouped_logs(
-            request.app, datetime_from, datetime_to, granularity
-        )
+        if granularity <= dt.timedelta(0) or datetime_to < datetime_from:
+            reason = "granularity has to be positive and start can't be after end"
+            raise HTTPBadRequest(
+                reason=reason,
+                body=json.dumps({"Ok": False, "Error": reason, "status_code": 400}),
+                content_type="application/json",
+            )
+        stats_config = request.app["config"].get("stats", {})
+        max_buckets = stats_config.get("max_buckets", 1000)
+
+        async def compute(datetime_from, datetime_to, granularity):
+            stats = None
+            # rollups are only kept in MongoDB, check_rollups checks the rest once at startup
+            if request.app.get("rollups_backfilled", False):
+                stats = await get_rollup_stats(
+                    request.app["db"],
+                    datetime_from,
+                    datetime_to,
+                    granularity,
+                    max_buckets,
+                )
+            if stats is None:
+                stats = await get_grouped_logs(
+                    request.app, datetime_from, datetime_to, granularity, max_buckets
+                )
+            return stats
+
+        stats_cache = request.app.get("stats_cache", None)
+        if stats_cache is not None:
+            stats = await stats_cache.get(
+                datetime_from, datetime_to, granularity, compute
+            )
+        else:
+            stats = await compute(datetime_from, datetime_to, granularity)
         return respond_with_json(
             {"Ok": True, "Error": None, "status_code": 200, "stats": stats}
         )
@@ -0,0 +1,54 @@
+from typing import List
+
+from aiohttp.web import Request
+from aiohttp.web_response import Response
+from aiohttp_rest_api import AioHTTPRestEndpoint
+from aiohttp_rest_api.responses import respond_with_json
+
+from cherrydoor.auth import check_api_permissions
+
+
+class StatsMetricsEndpoint(AioHTTPRestEndpoint):
+    def connected_routes(self) -> List[str]:
+        """"""
+        return ["/metrics/stats"]
+
+    async def get(self, request: Request) -> Response:
+        """
+        ---
+        summary: Stats cache metrics
+        description: Get hit ratio of the usage statistics cache and how long computing statistics took. Metrics are null if the cache is disabled
+        security:
+            - Bearer Authentication: [admin]
+            - X-API-Key Authentication: [admin]
+            - Session Authentication: [admin]
+        tags:
+            - metrics
+        responses:
+            "200":
+                description: A JSON document indicating success
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/StatsMetrics'
+
+            "401":
+                description: A JSON document indicating error in request (user not authenticated)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+            "403":
+                description: A JSON document indicating error in request (user doesn't have permission to preform this action)
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Error'
+
+        """
+        await check_api_permissions(request, ["admin"])
+        stats_cache = request.app.get("stats_cache", None)
+        metrics = stats_cache.stats() if stats_cache is not None else None
+        return respond_with_json(
+            {"Ok": True, "Error": None, "status_code": 200, "metrics": metrics}
+        )
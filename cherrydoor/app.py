@@ -38,7 +38,13 @@ from cherrydoor.api import (
 from cherrydoor.api_tokens import ApiTokens
 from cherrydoor.auth import AuthorizationPolicy, SessionIdentityPolicy
 from cherrydoor.config import load_config
-from cherrydoor.database import init_db, setup_db
+from cherrydoor.database import (
+    StatsCache,
+    check_rollups,
+    create_storage,
+    setup_db,
+)
+from cherrydoor.database.storage.sessions import StorageSessions
 from cherrydoor.secure import set_secure_headers
 from cherrydoor.secure import setup as secure_setup
 from cherrydoor.views import routes as views
@@ -73,23 +79,38 @@ def setup_app(loop=asyncio.get_event_loop(), config=load_config()[0]):
     app = web.Application(loop=loop)
     # make config accessible through the app
     app["config"] = config
-    # setup database and add it to the app
-    db = init_db(config, loop)
-    app["db"] = db
+    # setup the storage engine and add it to the app
+    storage = create_storage(config, loop)
+    app["storage"] = storage
+    # the Motor database, for features that need MongoDB - None with other engines
+    app["db"] = storage.db
     # create a token generator/validator and add make it accessible through the app
     api_tokens = ApiTokens(app, config.get("secret_key", ""))
     app["api_tokens"] = api_tokens
 
     app.on_startup.append(setup_db)
-    # set up aiohttp-session with aiohttp-session-mongo for storage
-    setup_session(
-        app,
-        MongoStorage(
-            db["sessions"],
+    # rollups are only used for stats once they cover all logs
+    app.on_startup.append(check_rollups)
+    # share stats between dashboards polling with the same parameters
+    stats_cache_config = config.get("stats", {}).get("cache", {})
+    if stats_cache_config.get("enabled", True):
+        app["stats_cache"] = StatsCache(
+            stats_cache_config.get("size", 64), stats_cache_config.get("ttl", 60)
+        )
+    # set up aiohttp-session with aiohttp-session-mongo for storage - or the storage engine without MongoDB
+    if storage.db is not None:
+        session_storage = MongoStorage(
+            storage.db["sessions"],
             max_age=None,
             cookie_name="session_id",
-        ),
-    )
+        )
+    else:
+        session_storage = StorageSessions(
+            storage,
+            max_age=None,
+            cookie_name="session_id",
+        )
+    setup_session(app, session_storage)
     # set up aiohttp-security
     setup_security(
         app,
@@ -6,6 +6,7 @@ __author__ = "opliko"
 __license__ = "MIT"
 __version__ = "0.8.b0"
 __status__ = "Prototype"
+import asyncio
 import json
 import os
 import sys
@@ -17,6 +18,14 @@ from argon2 import PasswordHasher
 from pymongo import MongoClient
 from pymongo.errors import OperationFailure
 
+from cherrydoor.database.storage import create_storage
+
+DEFAULT_SETTINGS = {
+    "break_times": {"value": []},
+    "delay": {"value": 0},
+    "require_auth": {"value": True, "manual": False},
+}
+
 
 def step_enabled(step, args):
     return step not in args.install_steps_excluded and (
@@ -24,6 +33,35 @@ def step_enabled(step, args):
     )
 
 
+async def setup_storage(config, setup=True, user=None):
+    """Create the database schema, default settings and an administrator in the configured storage engine.
+
+    Parameters
+    ----------
+    config : dict
+        The app configuration
+    setup : bool, default=True
+        whether to create default settings that don't exist yet
+    user : dict, default=None
+        user document to create, no user is created if None
+    """
+    storage = create_storage(config, asyncio.get_event_loop())
+    await storage.setup(config)
+    try:
+        if setup:
+            existing = await storage.get_settings(DEFAULT_SETTINGS.keys())
+            for name, document in DEFAULT_SETTINGS.items():
+                if name not in existing:
+                    fields = dict(document)
+                    await storage.set_setting(
+                        name, fields.pop("value"), upsert=True, **fields
+                    )
+        if user is not None:
+            await storage.insert_users([user])
+    finally:
+        await storage.close()
+
+
 def install(args):
     if sys.platform == "linux" or 1 == 1:
 
@@ -139,10 +177,14 @@ WantedBy=multi-user.target
             salt_len=16,
             encoding="utf-8",
         )
-        db = MongoClient(
-            f"mongodb://{config['mongo']['url']}/{config['mongo']['name']}"
-        )[config["mongo"]["name"]]
-        if step_enabled("database", args):
+        database_enabled = step_enabled("database", args)
+        if (
+            database_enabled
+            and config.get("storage", {}).get("engine", "mongo") == "mongo"
+        ):
+            db = MongoClient(
+                f"mongodb://{config['mongo']['url']}/{config['mongo']['name']}"
+            )[config["mongo"]["name"]]
             try:
                 db.command(
                     "createUser",
@@ -163,11 +205,7 @@ WantedBy=multi-user.target
                 )
             except OperationFailure:
                 pass
-            user_indexes = db.users.index_information()
-            if "username_index" not in user_indexes.keys():
-                db.users.create_index("username", name="username_index", unique=True)
-            if "cards_index" not in user_indexes.keys():
-                db.users.create_index("cards", name="cards_index", sparse=True)
+        user = None
         # nosec - it's python3, not 2, Bandit...
         if step_enabled("user", args) and input(
             "Czy chcesz stworzć nowego użytkownika-administratora? [y/n]"
@@ -175,7 +213,16 @@ WantedBy=multi-user.target
             # nosec - it's python3, not 2, Bandit...
             username = input("Wprowadź nazwę użytkownika: ")
             password = hasher.hash(getpass("Hasło: "))
-            db.users.insert({"username": username, "password": password, "cards": []})
+            user = {
+                "username": username,
+                "password": password,
+                "permissions": ["admin"],
+                "cards": [],
+            }
+        if database_enabled or user is not None:
+            asyncio.get_event_loop().run_until_complete(
+                setup_storage(config, setup=database_enabled, user=user)
+            )
         print("Instalacja skończona!")
         try:
             service_call_args = ["systemctl", "--user", "enable", "cherrydoor"]
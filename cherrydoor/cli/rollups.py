@@ -0,0 +1,53 @@
+"""
+Rebuild entry statistics rollups from logs
+"""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+import asyncio
+
+from cherrydoor.database import backfill_rollups, init_db
+from cherrydoor.util import get_datetime
+
+
+async def run_backfill(args, config):
+    """Rebuild rollups and print the number of buckets written to each of them.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        command line arguments - since limits the rebuild to logs from that day on
+    config : dict
+        The app configuration
+    """
+    loop = asyncio.get_event_loop()
+    db = init_db(config, loop)
+    since = get_datetime(args.since or "", None)
+    print(
+        "Rebuilding rollups from all logs"
+        if since is None
+        else f"Rebuilding rollups from logs since {since.date().isoformat()}"
+    )
+    written = await backfill_rollups(db, since)
+    for collection, buckets in written.items():
+        print(f"  {collection}: {buckets} buckets")
+    if since is None:
+        print(
+            "Restart the server if it's running, so that it uses the rollups for stats"
+        )
+    db.client.close()
+
+
+def rollups(args, config):
+    """Run the rollups command.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        command line arguments
+    config : dict
+        The app configuration
+    """
+    asyncio.get_event_loop().run_until_complete(run_backfill(args, config))
@@ -0,0 +1,44 @@
+"""
+Run a simulated arduino and measure swipe latency
+"""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+import asyncio
+import json
+
+from cherrydoor.interface.simulator import ArduinoSimulator
+
+
+async def run_simulation(args):
+    simulator = ArduinoSimulator(
+        cards=args.cards,
+        uid_lengths=args.uid_lengths,
+        manufacturer_codes=args.manufacturer_codes,
+        framed=args.framed,
+    )
+    port = simulator.open()
+    print(f"Simulated arduino listening on {port}")
+    print(f"Start Cherrydoor with --serial-port {port}")
+    if args.print_cards:
+        print("Cards:")
+        for block0 in simulator.cards:
+            print(f"  {block0}")
+    try:
+        await asyncio.wait_for(simulator.connected.wait(), args.connect_timeout)
+    except asyncio.TimeoutError:
+        print("Cherrydoor didn't connect in time")
+        simulator.close()
+        return None
+    print(f"Connected, swiping {args.rate} cards per second for {args.duration}s")
+    report = await simulator.run(rate=args.rate, duration=args.duration)
+    simulator.close()
+    return report
+
+
+def simulate(args):
+    report = asyncio.get_event_loop().run_until_complete(run_simulation(args))
+    if report is not None:
+        print(json.dumps(report, indent=4))
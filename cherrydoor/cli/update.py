@@ -43,6 +43,8 @@ def update(args, config={}):
         database_version = db.settings.find_one({"setting": "version"})
         if database_version == None:
             database_version = previous_version
+        else:
+            database_version = parse_version(str(database_version.get("value", "")))
     config_enabled = step_enabled("config", args)
     if config_enabled:
         config_version = parse_version(str(config.get("version", "")))
@@ -58,9 +60,13 @@ def update(args, config={}):
                 update_script.update()
             except AttributeError:
                 pass
-        if database_enabled and script_version > database_version:
+        # scripts can report an interrupted database update, so that it's resumed
+        if database_enabled and (
+            script_version > database_version
+            or getattr(update_script, "database_pending", lambda db: False)(db)
+        ):
             try:
-                update_script.update_database(db)
+                update_script.update_database(db, config)
             except AttributeError:
                 pass
         if config_enabled and script_version > config_version:
@@ -68,3 +74,15 @@ def update(args, config={}):
                 update_script.update_config(config)
             except AttributeError:
                 pass
+    if database_enabled:
+        from cherrydoor.database.schema import SchemaManager
+
+        # update scripts may have changed collections, so the schema is applied after them
+        for collection, operation, arguments in SchemaManager(config).apply_sync(db):
+            print(f"{collection}: {operation} {arguments}")
+        # so that update scripts for this version aren't run again with the next update
+        db.settings.update_one(
+            {"setting": "version"},
+            {"$set": {"value": str(current_version)}},
+            upsert=True,
+        )
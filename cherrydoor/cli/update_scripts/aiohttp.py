@@ -5,7 +5,7 @@ def update():
     print("general update successful")
 
 
-def update_database(db):
+def update_database(db, config=None):
     print("database update successful")
 
 
@@ -0,0 +1,42 @@
+"""
+Backfill entry statistics rollups from logs that were logged before rollups existed
+"""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.1"
+__status__ = "Prototype"
+
+import asyncio
+
+from cherrydoor.config import load_config
+from cherrydoor.database.mongo import init_db
+from cherrydoor.database.rollups import BACKFILL_SETTING, backfill_rollups
+
+
+def update_database(db, config=None):
+    """Rebuild rollups from all logs, unless rollups are disabled or were already backfilled.
+
+    Parameters
+    ----------
+    db : pymongo.database.Database
+        The database, used to check if rollups were backfilled (backfill_rollups needs a Motor connection)
+    config : dict, default=None
+        The app configuration, loaded from the default location if None
+    """
+    if config is None:
+        config = load_config()[0]
+    if not config.get("stats", {}).get("rollups", True):
+        return
+    if db.settings.find_one({"setting": BACKFILL_SETTING}) is not None:
+        return
+    print("Building entry statistics rollups from logs")
+    loop = asyncio.new_event_loop()
+    try:
+        motor_db = init_db(config, loop)
+        written = loop.run_until_complete(backfill_rollups(motor_db))
+        motor_db.client.close()
+    finally:
+        loop.close()
+    for collection, buckets in written.items():
+        print(f"  {collection}: {buckets} buckets")
@@ -0,0 +1,109 @@
+"""
+Move entry logs to a time-series collection (if logs.timeseries.enabled is set)
+"""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.1"
+__status__ = "Prototype"
+
+from pymongo.errors import PyMongoError
+
+from cherrydoor.config import load_config
+from cherrydoor.database.schema import SchemaManager
+
+MIGRATION_SETTING = "logs_timeseries_migration"
+LEGACY_COLLECTION = "logs_legacy"
+BATCH_SIZE = 1000
+
+
+def is_timeseries(db, name):
+    info = next(db.list_collections(filter={"name": name}), None)
+    return info is not None and "timeseries" in info.get("options", {})
+
+
+def save_progress(db, state, last_id=None, copied=0):
+    db.settings.update_one(
+        {"setting": MIGRATION_SETTING},
+        {"$set": {"value": {"state": state, "last_id": last_id, "copied": copied}}},
+        upsert=True,
+    )
+
+
+def database_pending(db):
+    try:
+        progress = db.settings.find_one({"setting": MIGRATION_SETTING})
+    except PyMongoError:
+        return False
+    return progress is not None and progress["value"]["state"] != "done"
+
+
+def copy_batch(db, batch, deduplicate):
+    if deduplicate:
+        # the previous run could have been interrupted after inserting this batch, but before saving progress.
+        # Timestamp range lets MongoDB skip buckets outside of it.
+        timestamps = [document["timestamp"] for document in batch]
+        copied = {
+            document["_id"]
+            for document in db.logs.find(
+                {
+                    "timestamp": {"$gte": min(timestamps), "$lte": max(timestamps)},
+                    "_id": {"$in": [document["_id"] for document in batch]},
+                },
+                {"_id": 1},
+            )
+        }
+        batch = [document for document in batch if document["_id"] not in copied]
+    if batch:
+        db.logs.insert_many(batch, ordered=False)
+
+
+def migrate_logs(db, config, batch_size=BATCH_SIZE):
+    progress = db.settings.find_one({"setting": MIGRATION_SETTING})
+    if progress is None:
+        names = db.list_collection_names()
+        if "logs" not in names or is_timeseries(db, "logs"):
+            # nothing to copy - the schema manager creates a time-series collection
+            save_progress(db, "done")
+            return
+        if LEGACY_COLLECTION in names:
+            print(
+                f"{LEGACY_COLLECTION} collection already exists - "
+                "rename or drop it to migrate logs"
+            )
+            return
+        # time-series collections can't be renamed, so the old one is moved out of the way
+        db.logs.rename(LEGACY_COLLECTION)
+        SchemaManager(config).apply_sync(db)
+        save_progress(db, "copying")
+        progress = db.settings.find_one({"setting": MIGRATION_SETTING})
+    last_id = progress["value"].get("last_id", None)
+    copied = progress["value"].get("copied", 0)
+    deduplicate = last_id is not None
+    while True:
+        query = {"timestamp": {"$type": "date"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(db[LEGACY_COLLECTION].find(query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        copy_batch(db, batch, deduplicate)
+        deduplicate = False
+        last_id = batch[-1]["_id"]
+        copied += len(batch)
+        save_progress(db, "copying", last_id, copied)
+        print(f"copied {copied} logs", end="\r")
+    save_progress(db, "done", last_id, copied)
+    print(
+        f"copied {copied} logs to the time-series collection, "
+        f"drop {LEGACY_COLLECTION} collection once you've checked them"
+    )
+
+
+def update_database(db, config=None):
+    if config is None:
+        config = load_config()[0]
+    if not config.get("logs", {}).get("timeseries", {}).get("enabled", False):
+        return
+    print("Moving logs to a time-series collection - make sure the server is stopped")
+    migrate_logs(db, config)
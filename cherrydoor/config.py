@@ -42,10 +42,95 @@ template = {
         "username": optional(str),
         "password": optional(str),
     },
+    "storage": {
+        "engine": optional(confuse.Choice(["mongo", "memory", "sqlite"]), "mongo"),
+        "path": optional(
+            confuse.Filename(), "~/.local/share/cherrydoor/cherrydoor.sqlite"
+        ),
+    },
     "interface": {
         "port": confuse.OneOf([confuse.String(pattern="COM\\d+$"), confuse.Filename()]),
         "baudrate": int,
         "encoding": optional(str, "utf-8"),
+        "backend": optional(confuse.Choice(["aioserial", "native"]), "aioserial"),
+        "framed": optional(bool, False),
+        "ack_timeout": optional(confuse.Number(), 0.5),
+        "retries": optional(int, 3),
+        "negotiation_timeout": optional(confuse.Number(), 2),
+        "dedupe_window": optional(confuse.Number(), 0),
+        "heartbeat_interval": optional(confuse.Number(), 30),
+        "missed_pings": optional(int, 3),
+    },
+    "doors": optional(
+        confuse.Sequence(
+            {
+                "id": str,
+                "port": confuse.OneOf(
+                    [confuse.String(pattern="COM\\d+$"), confuse.Filename()]
+                ),
+                "baudrate": optional(int),
+                "backend": optional(confuse.Choice(["aioserial", "native"])),
+                "framed": optional(bool),
+                "reset_pin": optional(int),
+                "manufacturer_code": optional(confuse.StrSeq()),
+                "delay": optional(confuse.Number()),
+                "break_times": optional(confuse.Sequence({"from": str, "to": str})),
+            }
+        ),
+        [],
+    ),
+    "device_allowlist": {
+        "enabled": optional(bool, False),
+        "max_cards": optional(int, 256),
+        "ack_timeout": optional(confuse.Number(), 5),
+        "retry_interval": optional(confuse.Number(), 60),
+        "debounce": optional(confuse.Number(), 1),
+    },
+    "stats": {
+        "rollups": optional(bool, True),
+        "max_buckets": optional(int, 1000),
+        "cache": {
+            "enabled": optional(bool, True),
+            "size": optional(int, 64),
+            "ttl": optional(confuse.Number(), 60),
+        },
+    },
+    "user_listing": {
+        "batch_size": optional(int, 100),
+        "page_size": optional(int, 50),
+        "max_page_size": optional(int, 500),
+    },
+    "logs": {
+        "retention": optional(int, 0),
+        "timeseries": {
+            "enabled": optional(bool, False),
+            "granularity": optional(
+                confuse.Choice(["seconds", "minutes", "hours"]), "minutes"
+            ),
+        },
+    },
+    "log_buffer": {
+        "size": optional(int, 100),
+        "max_age": optional(confuse.Number(), 1.0),
+        "max_pending": optional(int, 10000),
+    },
+    "terminal_log": {
+        "default": optional(confuse.Choice(["db", "memory", "none"]), "db"),
+        "history": optional(int, 200),
+        "routes": optional(
+            confuse.MappingValues(confuse.Choice(["db", "memory", "none"]))
+        ),
+    },
+    "card_index": {
+        "bloom_error_rate": optional(confuse.Number(), 0.01),
+        "max_staleness": optional(confuse.Number(), 300),
+    },
+    "offline": {
+        "enabled": optional(bool, False),
+        "directory": optional(confuse.Filename()),
+        "db_timeout": optional(confuse.Number(), 1),
+        "retry_interval": optional(confuse.Number(), 30),
+        "snapshot_interval": optional(confuse.Number(), 60),
     },
     "manufacturer_code": confuse.StrSeq(),
     "secret_key": optional(str),
@@ -112,6 +197,16 @@ def add_args(parser):
             "help": "baudrate of the arduino",
             "dest": "interface.baudrate",
         },
+        "serial-backend": {
+            "type": str,
+            "help": "serial backend - aioserial (default) or native (non-blocking, POSIX only)",
+            "dest": "interface.backend",
+        },
+        "dedupe-window": {
+            "type": int,
+            "help": "milliseconds during which repeated reads of the same card reuse the previous decision (0 disables)",
+            "dest": "interface.dedupe_window",
+        },
         "serial-encoding": {
             "type": str,
             "help": "encoding used by arduino (default utf-8 is probably the best idea)",
@@ -1 +1,10 @@
 from .mongo import *
+from .buffer import BufferedWriter
+from .rollups import (
+    backfill_rollups,
+    check_rollups,
+    get_rollup_stats,
+    update_rollups,
+)
+from .cache import StatsCache
+from .storage import Storage, StorageError, create_storage
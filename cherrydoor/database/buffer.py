@@ -0,0 +1,267 @@
+"""Write-behind buffer for collections with a lot of small inserts."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+from collections import deque
+from time import monotonic
+
+from pymongo.errors import BulkWriteError
+
+
+class BufferedWriter:
+    """Buffer documents and insert them in batches with insert_many.
+
+    A batch is written when it reaches max_size documents or when the oldest buffered document is max_age seconds old.
+    If more than max_pending documents are waiting, add() blocks until the buffer is flushed.
+    If a spool is set, batches that can't be written are spooled to disk instead of being retried,
+    and replayed after the next successful write.
+    If on_write is set, it's called with every batch of documents that was inserted (including replayed ones).
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_size=100,
+        max_age=1.0,
+        max_pending=10000,
+        name=None,
+        spool=None,
+        on_write=None,
+    ):
+        """Initialize the buffer.
+
+        Parameters
+        ----------
+        collection : motor.motor_asyncio.AsyncIOMotorCollection
+            collection documents will be inserted into
+        max_size : int, default=100
+            number of documents that triggers a flush
+        max_age : float, default=1.0
+            maximum number of seconds a document can wait in the buffer
+        max_pending : int, default=10000
+            number of buffered documents after which add() starts waiting for a flush
+        name : str, default=None
+            name used in logs, defaults to the collection name
+        spool : cherrydoor.database.spool.Spool, default=None
+            spool for documents that couldn't be written
+        on_write : coroutine function, default=None
+            called with a list of documents after they were inserted
+        """
+        self.collection = collection
+        self.max_size = max(1, max_size)
+        self.max_age = max_age
+        self.max_pending = max(self.max_size, max_pending)
+        self.name = name or getattr(collection, "name", "buffer")
+        self.logger = logging.getLogger(f"BUFFER:{self.name}")
+        self.queue = deque()
+        self.oldest = None
+        self.flush_event = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_time = 0.0
+        self.spool = spool
+        self.on_write = on_write
+        self.replay_task = None
+
+    def __len__(self):
+        """Return the number of documents waiting in the buffer."""
+        return len(self.queue)
+
+    async def add(self, document):
+        """Add a document to the buffer, waiting if the buffer is full.
+
+        Parameters
+        ----------
+        document : dict
+            document to be inserted
+        """
+        while len(self.queue) >= self.max_pending:
+            self.not_full.clear()
+            await self.not_full.wait()
+        if not self.queue:
+            self.oldest = monotonic()
+            # wake up the flushing task so it can schedule a flush by age
+            self.flush_event.set()
+        self.queue.append(document)
+        if len(self.queue) >= self.max_size:
+            self.flush_event.set()
+
+    def start(self, loop=None):
+        """Start the background flushing task.
+
+        Parameters
+        ----------
+        loop : asyncio.AbstractEventLoop, default=None
+            event loop to run the task in, current event loop if None
+        Returns
+        -------
+        task : asyncio.Task
+            the flushing task
+        """
+        if self.task is None or self.task.done():
+            self.task = (loop or asyncio.get_event_loop()).create_task(self.run())
+        return self.task
+
+    async def run(self):
+        """Flush the buffer whenever it's full or too old."""
+        while True:
+            timeout = None
+            if self.queue:
+                timeout = max(0, self.oldest + self.max_age - monotonic())
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            if self.queue and (
+                len(self.queue) >= self.max_size
+                or monotonic() - self.oldest >= self.max_age
+            ):
+                await self.flush(self.max_size)
+
+    async def flush(self, limit=None):
+        """Insert buffered documents into the collection.
+
+        Parameters
+        ----------
+        limit : int, default=None
+            maximum number of documents to insert, all of them if None
+        """
+        async with self.lock:
+            count = len(self.queue) if limit is None else min(limit, len(self.queue))
+            if count == 0:
+                return
+            batch = [self.queue.popleft() for _ in range(count)]
+            self.oldest = monotonic() if self.queue else None
+            start = monotonic()
+            written = batch
+            try:
+                result = await self.collection.insert_many(batch, ordered=False)
+                self.written += len(result.inserted_ids)
+            except BulkWriteError as e:
+                inserted = e.details.get("nInserted", 0)
+                self.written += inserted
+                self.failed += len(batch) - inserted
+                self.logger.error(
+                    "%s documents couldn't be inserted. Errors: %s",
+                    len(batch) - inserted,
+                    e.details.get("writeErrors", []),
+                )
+                failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                written = [
+                    document
+                    for index, document in enumerate(batch)
+                    if index not in failed
+                ]
+            except asyncio.CancelledError:
+                # the write may or may not have finished - keep the batch rather than lose it
+                self.queue.extendleft(reversed(batch))
+                self.oldest = start
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                # not only PyMongoError - other engines and a closed client raise their own errors,
+                # and the batch was already taken out of the queue
+                if self.spool is not None:
+                    await self.spool.append(batch)
+                    self.logger.warning(
+                        "unable to write %s documents, spooled them to disk. Exception: %s",
+                        len(batch),
+                        str(e),
+                    )
+                    return
+                # put the batch back so it's retried with the next flush
+                self.queue.extendleft(reversed(batch))
+                self.oldest = start
+                self.logger.warning(
+                    "unable to write %s documents, retrying later. Exception: %s",
+                    len(batch),
+                    str(e),
+                )
+                await asyncio.sleep(self.max_age)
+                return
+            finally:
+                self.last_flush_time = monotonic() - start
+                if len(self.queue) < self.max_pending:
+                    self.not_full.set()
+            self.flushes += 1
+            if self.on_write is not None and written:
+                try:
+                    await self.on_write(written)
+                except Exception as e:  # pylint: disable=broad-except
+                    # the documents are already written, so there is nothing to retry
+                    self.logger.error(
+                        "on_write callback failed for %s documents. Exception: %s",
+                        len(written),
+                        str(e),
+                    )
+            if len(self.queue) >= self.max_size:
+                self.flush_event.set()
+            if (
+                self.spool is not None
+                and (self.replay_task is None or self.replay_task.done())
+                and self.spool.pending()
+            ):
+                self.replay_task = asyncio.get_event_loop().create_task(
+                    self.spool.replay(self.collection, on_write=self.on_write)
+                )
+
+    async def close(self, retries=3):
+        """Stop the flushing task and write everything that's left in the buffer.
+
+        Parameters
+        ----------
+        retries : int, default=3
+            number of attempts to write the remaining documents
+        """
+        if self.replay_task is not None and not self.replay_task.done():
+            await self.replay_task
+        if self.task is not None:
+            # wait for a flush that's in progress, so that its batch isn't lost when the task is cancelled
+            async with self.lock:
+                self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for _ in range(retries):
+            if not self.queue:
+                break
+            await self.flush()
+        if self.queue and self.spool is not None:
+            await self.spool.append(list(self.queue))
+            self.queue.clear()
+        if self.queue:
+            self.logger.error(
+                "%s documents were lost while closing the buffer", len(self.queue)
+            )
+
+    def stats(self):
+        """Return buffer metrics.
+
+        Returns
+        -------
+        stats : dict
+            dictionary with queue depth, number of written and failed documents,
+            number of flushes and duration of the last flush
+        """
+        stats = {
+            "queued": len(self.queue),
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_time": self.last_flush_time,
+        }
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+        return stats
@@ -0,0 +1,234 @@
+"""Cache of entry statistics shared by all requests with the same parameters."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import datetime as dt
+import logging
+from collections import OrderedDict
+from math import ceil
+from time import monotonic
+
+from cherrydoor.interface.metrics import Histogram
+
+
+def align(datetime_from, datetime_to, granularity):
+    """Align a range to whole buckets, so that similar requests share a cache entry.
+
+    Parameters
+    ----------
+    datetime_from : datetime.datetime
+        start of the range, rounded down to a multiple of granularity
+    datetime_to : datetime.datetime
+        end of the range, rounded up to the end of the bucket it's in
+    granularity : datetime.timedelta
+        size of each bucket
+    Returns
+    -------
+    key : tuple
+        aligned start, aligned end and granularity
+    """
+    start = (
+        dt.datetime.min + (datetime_from - dt.datetime.min) // granularity * granularity
+    )
+    buckets = max(1, ceil((datetime_to - start) / granularity))
+    return start, start + buckets * granularity, granularity
+
+
+class StatsCache:
+    """LRU cache of stats lists keyed by bucket-aligned (start, end, granularity).
+
+    Buckets that ended before the stats were computed never change, so only the trailing bucket of a range that
+    wasn't over yet is recomputed - after ttl seconds, or as soon as a new entry falls into it.
+    New entries are reported with invalidate() by the entry log writer, after their rollups were updated.
+    Concurrent requests for the same key wait for a single computation.
+    """
+
+    def __init__(self, max_entries=64, ttl=60):
+        """Initialize an empty cache.
+
+        Parameters
+        ----------
+        max_entries : int, default=64
+            number of ranges to keep, least recently used ones are evicted first
+        ttl : float, default=60
+            seconds after which an open trailing bucket is recomputed even if no change was seen
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.logger = logging.getLogger("STATS_CACHE")
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.tail_refreshes = 0
+        self.invalidations = 0
+        self.aggregation_time = Histogram()
+
+    async def get(self, datetime_from, datetime_to, granularity, compute):
+        """Get stats for a range, computing them if needed.
+
+        Parameters
+        ----------
+        datetime_from : datetime.datetime
+            The start datetime
+        datetime_to : datetime.datetime
+            The end datetime
+        granularity : datetime.timedelta
+            The granularity of the stats
+        compute : coroutine function
+            called with start, end and granularity of the (aligned) range that has to be computed,
+            returns a list in the get_grouped_logs format
+        Returns
+        -------
+        stats : list
+            stats for the aligned range
+        """
+        key = align(datetime_from, datetime_to, granularity)
+        if key in self.pending:
+            self.coalesced += 1
+            return await asyncio.shield(self.pending[key])
+        entry = self.entries.get(key, None)
+        if entry is not None and not self.tail_stale(entry):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["stats"]
+        future = asyncio.get_event_loop().create_future()
+        self.pending[key] = future
+        try:
+            if entry is None:
+                self.misses += 1
+                stats = await self.measure(compute, *key)
+            else:
+                self.tail_refreshes += 1
+                stats = await self.refresh_tail(entry, key[1], compute)
+            self.store(key, stats)
+            future.set_result(stats)
+            return stats
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # nobody else may be waiting for it
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
+
+    def tail_stale(self, entry):
+        """Check if the trailing bucket of an entry has to be recomputed.
+
+        Parameters
+        ----------
+        entry : dict
+            cache entry
+        Returns
+        -------
+        bool
+            True if the trailing bucket was still open when computed and it was invalidated or is older than ttl
+        """
+        if entry["open_until"] is None:
+            return False
+        return entry["tail_invalid"] or monotonic() - entry["computed_at"] > self.ttl
+
+    async def refresh_tail(self, entry, datetime_to, compute):
+        """Recompute only the trailing bucket of an entry.
+
+        Parameters
+        ----------
+        entry : dict
+            cache entry
+        datetime_to : datetime.datetime
+            aligned end of the range
+        compute : coroutine function
+            see get()
+        Returns
+        -------
+        stats : list
+            cached stats with the trailing bucket replaced
+        """
+        stats = entry["stats"]
+        if not stats:
+            return stats
+        tail_from = dt.datetime.fromisoformat(stats[-1]["date_from"])
+        tail_granularity = dt.datetime.fromisoformat(stats[-1]["date_to"]) - tail_from
+        tail = await self.measure(compute, tail_from, datetime_to, tail_granularity)
+        return stats[:-1] + tail[:1]
+
+    async def measure(self, compute, datetime_from, datetime_to, granularity):
+        """Run compute and record how long it took."""
+        start = monotonic()
+        try:
+            return await compute(datetime_from, datetime_to, granularity)
+        finally:
+            self.aggregation_time.record((monotonic() - start) * 1000)
+
+    def store(self, key, stats):
+        """Add stats to the cache, evicting the least recently used entries."""
+        now = dt.datetime.now()
+        self.entries[key] = {
+            "stats": stats,
+            "computed_at": monotonic(),
+            # the end is the end of the trailing bucket, so the range is still open if it's in the future
+            "open_until": key[1] if key[1] > now else None,
+            "tail_from": dt.datetime.fromisoformat(stats[-1]["date_from"])
+            if stats
+            else key[0],
+            "tail_invalid": False,
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, timestamp):
+        """Handle a new entry log.
+
+        Trailing buckets the timestamp falls into are marked for recomputation,
+        entries that it falls into before their trailing bucket (a backdated log) are dropped.
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime
+            timestamp of the new entry
+        """
+        if not isinstance(timestamp, dt.datetime):
+            return
+        for key in list(self.entries):
+            entry = self.entries[key]
+            if not key[0] <= timestamp <= key[1]:
+                continue
+            self.invalidations += 1
+            if timestamp >= entry["tail_from"] and entry["open_until"] is not None:
+                entry["tail_invalid"] = True
+            else:
+                del self.entries[key]
+
+    def clear(self):
+        """Drop all cached stats."""
+        self.entries.clear()
+
+    def stats(self):
+        """Return cache metrics.
+
+        Returns
+        -------
+        stats : dict
+            number of entries, hits, misses, coalesced requests, trailing bucket refreshes, invalidations,
+            hit ratio and aggregation time histogram
+        """
+        requests = self.hits + self.misses + self.coalesced + self.tail_refreshes
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "tail_refreshes": self.tail_refreshes,
+            "invalidations": self.invalidations,
+            "hit_ratio": (self.hits + self.coalesced) / requests if requests else None,
+            "aggregation_time": self.aggregation_time.as_dict(),
+        }
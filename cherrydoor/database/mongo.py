@@ -1,11 +1,16 @@
 """Functions to simplify interacting with database."""
 import datetime as dt
+import logging
+import re
 from math import ceil
 
-from bson.objectid import ObjectId
-from bson import SON
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import WriteConcern, IndexModel, ASCENDING, ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger("DATABASE")
+
+# fields users can be sorted and paginated by - both are unique
+SORT_FIELDS = ["_id", "username"]
 
 
 def init_db(config, loop):
@@ -32,41 +37,64 @@ def init_db(config, loop):
 
 
 async def setup_db(app):
-    """Set up database indexes and collections.
+    """Set up database indexes and collections (or tables) of the storage engine.
+
+    For MongoDB, only differences between the desired schema and the database are applied.
 
     Parameters
     ----------
     app : aiohttp.web.Application
         The aiohttp application instance
     """
-    user_indexes = [
-        IndexModel([("username", ASCENDING)], name="username_index", unique=True),
-        IndexModel([("cards", ASCENDING)], name="cards_index", sparse=True),
-        IndexModel([("tokens.token", ASCENDING)], name="token_index", sparse=True),
-    ]
-    command_log_options = await app["db"].terminal.options()
-    if (
-        "capped" not in command_log_options
-        or not command_log_options["capped"]
-        or "timeseries" not in command_log_options
-        or command_log_options["timeseries"]["timeField"] != "timestamp"
-    ):
-        await app["db"].drop_collection("terminal")
-        await app["db"].create_collection(
-            "terminal",
-            size=app["config"].get("command_log_size", 100000000),
-            capped=True,
-            max=10000,
-#             timeseries={
-#                 "timeField": "timestamp",
-#                 "metaField": "command",
-#                 "granularity": "seconds",
-#             },
-#             expireAfterSeconds=app["config"].get(
-#                 "command_log_expire_after", 604800
-#             ),
+    await app["storage"].setup(app["config"])
+
+
+async def report_collection_sizes(db, collections):
+    """Log the number of documents and sizes of collections and their indexes.
+
+    Parameters
+    ----------
+    db : motor.motor_asyncio.AsyncIOMotorDatabase
+        The database
+    collections : list
+        names of collections to report
+    Returns
+    -------
+    sizes : dict
+        collection name -> count, size, storage_size, total_index_size, index_sizes and max_size if capped (in bytes)
+    """
+    sizes = {}
+    for collection in collections:
+        try:
+            stats = await db.command("collStats", collection)
+        except PyMongoError as e:
+            logger.warning("unable to get %s size. Exception: %s", collection, str(e))
+            continue
+        sizes[collection] = {
+            "count": stats.get("count", 0),
+            "size": stats.get("size", 0),
+            "storage_size": stats.get("storageSize", 0),
+            "total_index_size": stats.get("totalIndexSize", 0),
+            "index_sizes": dict(stats.get("indexSizes", {})),
+        }
+        if stats.get("capped", False):
+            sizes[collection]["max_size"] = stats.get("maxSize", None)
+        logger.info(
+            "%s: %s documents, %s bytes (%s on disk%s), indexes: %s",
+            collection,
+            sizes[collection]["count"],
+            sizes[collection]["size"],
+            sizes[collection]["storage_size"],
+            f", capped at {sizes[collection]['max_size']}"
+            if "max_size" in sizes[collection]
+            else "",
+            ", ".join(
+                f"{name} {size} bytes"
+                for name, size in sizes[collection]["index_sizes"].items()
+            )
+            or "none",
         )
-    await app["db"].users.create_indexes(user_indexes)
+    return sizes
 
 
 async def close_db(app):
@@ -77,7 +105,7 @@ async def close_db(app):
     app : aiohttp.web.Application
         The aiohttp application instance
     """
-    app["db"].close()
+    await app["storage"].close()
 
 
 async def list_permissions(app, username):
@@ -94,9 +122,7 @@ async def list_permissions(app, username):
     permissions : list
         The list of permissions user has
     """
-    user = await app["db"].users.find_one(
-        {"username": username}, {"permissions": 1, "_id": 0}
-    )
+    user = await app["storage"].find_user({"username": username}, ["permissions"])
     if user is not None:
         return user.get("permissions", [])
     return []
@@ -116,7 +142,7 @@ async def user_exists(app, username):
     exists : bool
         True if the user exists, False otherwise
     """
-    count = app["db"].users.count_documents({"username": username})
+    count = await app["storage"].count_users({"username": username})
     return count > 0
 
 
@@ -144,19 +170,17 @@ async def create_user(
     """
     permissions = permissions if permissions else []
     cards = cards if cards else []
-    result = (
-        await app["db"]
-        .users.with_options(write_concern=WriteConcern(w="majority"))
-        .insert_one(
+    ids = await app["storage"].insert_users(
+        [
             {
                 "username": username,
                 "password": hashed_password,
                 "permissions": permissions,
                 "cards": cards,
             }
-        )
+        ]
     )
-    return str(result.inserted_id)
+    return str(ids[0])
 
 
 async def change_user_password(app, identity, new_password_hash):
@@ -171,8 +195,8 @@ async def change_user_password(app, identity, new_password_hash):
     new_password_hash : str
         The new argon2id hashed password
     """
-    await app["db"].users.update_one(
-        {"_id": ObjectId(identity)}, {"$set": {"password": new_password_hash}}
+    await app["storage"].update_user(
+        {"_id": identity}, set={"password": new_password_hash}
     )
 
 
@@ -190,10 +214,7 @@ async def add_token_to_user(app, identity, token_name, token):
     token : str
         The branca token to be assigned
     """
-    await app["db"].users.update_one(
-        {"_id": ObjectId(identity)},
-        {"$addToSet": {"tokens": {"name": token_name, "token": token}}},
-    )
+    await app["storage"].add_token(identity, token_name, token)
 
 
 async def find_user_by_uid(app, identity, fields=["username"]):
@@ -212,7 +233,7 @@ async def find_user_by_uid(app, identity, fields=["username"]):
     user : dict
         The user document
     """
-    return await find_user_by(app, "_id", ObjectId(identity), fields)
+    return await find_user_by(app, "_id", str(identity), fields)
 
 
 async def find_user_by_username(app, username, fields=["_id"]):
@@ -271,12 +292,7 @@ async def find_user_by_cards(app, cards, fields=["username"]):
     """
     if not isinstance(cards, list):
         cards = [cards]
-    projection = {}
-    for field in fields:
-        projection[field] = 1
-    if "_id" not in fields:
-        projection["_id"] = 0
-    return await app["db"].users.find_one({"cards": cards}, projection)
+    return await app["storage"].find_user({"cards": cards}, fields)
 
 
 async def find_user_by(app, search_fields, values, return_fields):
@@ -303,82 +319,120 @@ async def find_user_by(app, search_fields, values, return_fields):
         values = [values]
     if "api_key" in search_fields:
         search_fields[search_fields.index("api_key")] = "tokens.token"
-    projection = {}
-    for field in return_fields:
-        projection[field] = 1
-    if "_id" not in return_fields:
-        projection["_id"] = 0
-    user = await app["db"].users.find_one(
-        SON(dict(zip(search_fields, values))), projection=projection
+    return await app["storage"].find_user(
+        dict(zip(search_fields, values)), return_fields
     )
-    return user
 
 
-#
-async def get_grouped_logs(app, datetime_from, datetime_to, granularity):
-    """Get logs between two datetimes.
+# maximum number of data points returned by get_grouped_logs
+MAX_BUCKETS = 1000
+
+
+def downsample(datetime_from, datetime_to, granularity, max_buckets=MAX_BUCKETS):
+    """Increase granularity so that there are at most max_buckets buckets between two datetimes.
 
     Parameters
     ----------
-    app : aiohttp.web.Application
-        The aiohttp application instance
     datetime_from : datetime.datetime
         The start datetime
     datetime_to : datetime.datetime
         The end datetime
-    granularity : str
-        The granularity of the logs to be returned
+    granularity : datetime.timedelta or int
+        The requested granularity (seconds if int)
+    max_buckets : int, default=MAX_BUCKETS
+        The maximum number of buckets
     Returns
     -------
-    logs : list
-        The list of logs between the two datetimes with a given granularity
+    granularity : datetime.timedelta
+        The requested granularity, or its smallest multiple that results in at most max_buckets buckets
+    buckets : int
+        The number of buckets
     """
     if not isinstance(granularity, dt.timedelta):
         granularity = dt.timedelta(seconds=granularity)
-    boundries = [
-        datetime_from + granularity * i
-        for i in range(ceil((datetime_to - datetime_from) / granularity))
-    ]
-    boundries[-1] = datetime_to + dt.timedelta(seconds=1)
-    pipeline = [
-        {"$match": {"timestamp": {"$gte": datetime_from, "$lte": datetime_to}}},
-        {
-            "$project": {
-                "timestamp": 1,
-                "successful": {"$toInt": "$success"},
-                "during_break": {
-                    "$toInt": {"$eq": ["$auth_mode", "Manufacturer code"]}
-                },
-            }
-        },
-        {
-            "$bucket": {
-                "groupBy": "$timestamp",
-                "boundaries": boundries,
-                "default": "no_match",
-                "output": {
-                    "count": {"$sum": 1},
-                    "successful": {"$sum": "$successful"},
-                    "during_break": {"$sum": "$during_break"},
-                },
-            }
-        },
-    ]
+    if granularity <= dt.timedelta(0):
+        raise ValueError("granularity has to be positive")
+    buckets = max(1, ceil((datetime_to - datetime_from) / granularity))
+    if buckets > max_buckets:
+        granularity *= ceil(buckets / max_buckets)
+        buckets = max(1, ceil((datetime_to - datetime_from) / granularity))
+    return granularity, buckets
+
+
+async def fill_buckets(documents, datetime_from, buckets, granularity):
+    """Merge a stream of non-empty buckets with empty ones.
+
+    Parameters
+    ----------
+    documents : async iterable
+        documents sorted by bucket index (_id) with count, successful and during_break keys
+    datetime_from : datetime.datetime
+        The start of the first bucket
+    buckets : int
+        The number of buckets
+    granularity : datetime.timedelta
+        The size of each bucket
+    Returns
+    -------
+    logs : list
+        The list of all buckets, including empty ones
+    """
     logs = []
-    async for doc in app["db"].logs.aggregate(pipeline):
+
+    def append(index, doc):
         logs.append(
             {
-                "date_from": doc["_id"].isoformat(),
-                "date_to": (doc["_id"] + granularity).isoformat(),
-                "count": doc["count"],
-                "successful": doc["successful"],
-                "during_break": doc["during_break"],
+                "date_from": (datetime_from + granularity * index).isoformat(),
+                "date_to": (datetime_from + granularity * (index + 1)).isoformat(),
+                "count": doc.get("count", 0),
+                "successful": doc.get("successful", 0),
+                "during_break": doc.get("during_break", 0),
             }
         )
 
+    index = 0
+    async for doc in documents:
+        while index < int(doc["_id"]):
+            append(index, {})
+            index += 1
+        append(index, doc)
+        index += 1
+    while index < buckets:
+        append(index, {})
+        index += 1
     return logs
 
 
+async def get_grouped_logs(
+    app, datetime_from, datetime_to, granularity, max_buckets=MAX_BUCKETS
+):
+    """Get logs between two datetimes.
+
+    Logs are grouped by the storage engine using the time since datetime_from,
+    so the size of the query doesn't depend on the number of buckets.
+
+    Parameters
+    ----------
+    app : aiohttp.web.Application
+        The aiohttp application instance
+    datetime_from : datetime.datetime
+        The start datetime
+    datetime_to : datetime.datetime
+        The end datetime
+    granularity : datetime.timedelta or int
+        The granularity of the logs to be returned (seconds if int)
+    max_buckets : int, default=MAX_BUCKETS
+        The maximum number of buckets - granularity is increased if there would be more
+    Returns
+    -------
+    logs : list
+        The list of logs between the two datetimes with a given granularity, including empty buckets
+    """
+    return await app["storage"].grouped_logs(
+        datetime_from, datetime_to, granularity, max_buckets
+    )
+
+
 async def modify_user(app, uid=None, current_username=None, **kwargs):
     """Change user's properties.
 
@@ -403,43 +457,21 @@ async def modify_user(app, uid=None, current_username=None, **kwargs):
         The user document
     """
     overwrite_keys = ["username", "cards", "permissions"]
-    append_keys = ["card", "permission"]
-    pipeline = []
-    if bool(set(overwrite_keys) & set(kwargs.keys())):
-        pipeline.append(
-            {
-                "$set": {
-                    key: value
-                    for key, value in kwargs.items()
-                    if key in overwrite_keys and len(value) > 0
-                }
-            }
-        )
-    if bool(set(append_keys) & set(kwargs.keys())):
-        pipeline.append(
-            {
-                "$set": {
-                    key: {"$concatArrays": [f"${key}", [value]]}
-                    for key, value in kwargs.items()
-                    if key in append_keys and len(value) > 0
-                }
-            }
-        )
-    if len(pipeline) <= 0:
-        return None
-    user = await app["db"].users.find_one_and_update(
-        {
-            "_id"
-            if uid is not None
-            else "username": uid
-            if uid is not None
-            else current_username
+    append_keys = {"card": "cards", "permission": "permissions"}
+    return await app["storage"].update_user(
+        {"_id": uid} if uid is not None else {"username": current_username},
+        set={
+            key: value
+            for key, value in kwargs.items()
+            if key in overwrite_keys and len(value) > 0
+        },
+        append={
+            append_keys[key]: value
+            for key, value in kwargs.items()
+            if key in append_keys and len(value) > 0
         },
-        pipeline,
-        projection={"_id": 0, "username": 1, "permissions": 1, "cards": 1},
-        return_document=ReturnDocument.AFTER,
+        fields=["username", "permissions", "cards"],
     )
-    return user
 
 
 # async def add_api_open_to_logs(app, )
@@ -459,7 +491,7 @@ async def user_exists(app, **kwargs):
     exists : bool
         True if the user exists, False otherwise
     """
-    return app["db"].users.count_documents(kwargs) > 0
+    return await app["storage"].count_users(kwargs) > 0
 
 
 async def delete_user(app, uid=None, username=None):
@@ -480,10 +512,10 @@ async def delete_user(app, uid=None, username=None):
         True if the user was deleted, False otherwise
     """
     if uid:
-        return await app["db"].users.delete_one({"_id": uid})
+        return await app["storage"].delete_user({"_id": uid})
 
     if username:
-        return await app["db"].users.delete_one({"username": username})
+        return await app["storage"].delete_user({"username": username})
     return False
 
 
@@ -503,13 +535,11 @@ async def add_cards_to_user(app, uid, cards):
     user : dict
         The modified user document
     """
-    user = await app["db"].find_one_and_update(
+    return await app["storage"].update_user(
         {"_id": uid},
-        {"$addToSet": {"cards": {"$each": cards}}},
-        projection={"_id": 0, "username": 1, "permissions": 1, "cards": 1},
-        return_document=ReturnDocument.AFTER,
+        add={"cards": cards},
+        fields=["username", "permissions", "cards"],
     )
-    return user
 
 
 async def delete_cards_from_user(app, uid, cards):
@@ -530,13 +560,11 @@ async def delete_cards_from_user(app, uid, cards):
     """
     if not isinstance(cards, list):
         cards = [cards]
-    user = await app["db"].users.find_one_and_update(
+    return await app["storage"].update_user(
         {"_id": uid},
-        {"$pullAll": {"cards": cards}},
-        projection={"_id": 0, "username": 1, "permissions": 1, "cards": 1},
-        return_document=ReturnDocument.AFTER,
+        remove={"cards": cards},
+        fields=["username", "permissions", "cards"],
     )
-    return user
 
 
 async def create_users(app, users):
@@ -548,25 +576,27 @@ async def create_users(app, users):
         The aiohttp application instance
     users : list
         A list of dictionaries with user data to be created
+    Returns
+    -------
+    uids : list
+        The uids of created users
     """
-    return (
-        await app["db"]
-        .users.with_options(write_concern=WriteConcern(w="majority"))
-        .insert_many(
-            [
-                {
-                    "username": user.get("username"),
-                    "password": user.get("password", None),
-                    "permissions": user.get("permissions", []),
-                    "cards": user.get("cards", []),
-                }
-                for user in users
-            ]
-        )
+    return await app["storage"].insert_users(
+        [
+            {
+                "username": user.get("username"),
+                "password": user.get("password", None),
+                "permissions": user.get("permissions", []),
+                "cards": user.get("cards", []),
+            }
+            for user in users
+        ]
     )
 
 
-async def get_users(app, return_fields=["username", "permissions", "cards"]):
+async def get_users(
+    app, return_fields=["username", "permissions", "cards"], batch_size=None
+):
     """Retrieve all users from the database.
 
     Parameters
@@ -575,17 +605,73 @@ async def get_users(app, return_fields=["username", "permissions", "cards"]):
         The aiohttp application instance
     return_fields : list, default=["username", "permissions", "cards"]
         The fields to be returned for each user.
+    batch_size : int, default=None
+        The number of users fetched from the database at once
+    Returns
+    -------
+    users : async iterator
+        User documents
+    """
+    return app["storage"].find_users({}, return_fields, batch_size=batch_size)
+
+
+async def list_users(
+    app,
+    sort="username",
+    after=None,
+    limit=50,
+    permission=None,
+    card_prefix=None,
+    return_fields=["_id", "username", "permissions", "cards"],
+):
+    """Retrieve a page of users, using keyset pagination.
+
+    Parameters
+    ----------
+    app : aiohttp.web.Application
+        The aiohttp application instance
+    sort : str, default="username"
+        The field users are sorted by - "_id" or "username"
+    after : str, default=None
+        The value of the sort field of the last user on the previous page, None for the first page
+    limit : int, default=50
+        The maximum number of users returned
+    permission : str, default=None
+        Only return users with this permission
+    card_prefix : str, default=None
+        Only return users with a card starting with this prefix (case-sensitive)
+    return_fields : list, default=["_id", "username", "permissions", "cards"]
+        The fields to be returned for each user, the sort field is always returned
     Returns
     -------
     users : list
-        A list of user documents
+        User documents
+    after : str or None
+        The value to pass as after to get the next page, None if this is the last page
+    Raises
+    ------
+    ValueError
+        if users can't be sorted by the field
     """
-    projection = {}
-    for field in return_fields:
-        projection[field] = 1
-    if "_id" not in return_fields:
-        projection["_id"] = 0
-    return app["db"].users.find({}, projection=projection)
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"users can only be sorted by {' or '.join(SORT_FIELDS)}")
+    query = {}
+    if permission:
+        query["permissions"] = permission
+    if card_prefix:
+        query["cards"] = {"$regex": f"^{re.escape(card_prefix)}"}
+    if after is not None:
+        query[sort] = {"$gt": after}
+    fields = list(return_fields) + ([sort] if sort not in return_fields else [])
+    # one more user than requested shows if there is a next page
+    users = [
+        user
+        async for user in app["storage"].find_users(
+            query, fields, sort=sort, limit=limit + 1
+        )
+    ]
+    next_after = str(users[limit - 1][sort]) if len(users) > limit else None
+    return users[:limit], next_after
 
 
 async def set_default_permissions(app, username):
@@ -602,13 +688,11 @@ async def set_default_permissions(app, username):
     user : dict
         The modified user document with usernae, permissions and cards fields
     """
-    user = await app["db"].users.find_one_and_update(
+    return await app["storage"].update_user(
         {"username": username},
-        {"$set": {"permissions": ["enter"]}},
-        projection={"_id": 0, "username": 1, "permissions": 1, "cards": 1},
-        return_document=ReturnDocument.AFTER,
+        set={"permissions": ["enter"]},
+        fields=["username", "permissions", "cards"],
     )
-    return user
 
 
 async def get_settings(app):
@@ -623,9 +707,8 @@ async def get_settings(app):
     breaks : dict
         A dictionary with the breaks settings
     """
-    breaks = (await app["db"].settings.find_one({"setting": "break_times"})).get(
-        "value", []
-    )
+    settings = await app["storage"].get_settings(["break_times"])
+    breaks = settings.get("break_times", {}).get("value", [])
     return {"breaks": breaks}
 
 
@@ -639,8 +722,5 @@ async def save_settings(app, settings):
     settings : dict
         A dictionary with all settings to set
     """
-    # TODO optimize into a single query
     for setting, value in settings.items():
-        await app["db"].settings.find_one_and_update(
-            {"setting": setting}, {"$set": {"value": value}}
-        )
+        await app["storage"].set_setting(setting, value, upsert=True)
@@ -0,0 +1,314 @@
+"""Pre-aggregated entry statistics, kept up to date as entries are logged."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import datetime as dt
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from cherrydoor.database.mongo import MAX_BUCKETS, downsample, fill_buckets
+
+# from the coarsest to the finest
+ROLLUPS = [
+    ("logs_rollup_day", dt.timedelta(days=1)),
+    ("logs_rollup_hour", dt.timedelta(hours=1)),
+    ("logs_rollup_minute", dt.timedelta(minutes=1)),
+]
+COUNTERS = ["count", "successful", "during_break"]
+# settings document recording that rollups cover all logs
+BACKFILL_SETTING = "rollups_backfilled"
+
+logger = logging.getLogger("ROLLUPS")
+
+
+def bucket_start(timestamp, size):
+    """Round a datetime down to the start of a rollup bucket.
+
+    Parameters
+    ----------
+    timestamp : datetime.datetime
+        time to round
+    size : datetime.timedelta
+        size of the bucket (a minute, an hour or a day)
+    Returns
+    -------
+    start : datetime.datetime
+        start of the bucket the timestamp is in
+    """
+    return dt.datetime.min + (timestamp - dt.datetime.min) // size * size
+
+
+def entry_counters(entry):
+    """Get counter increments for a single entry log document.
+
+    Parameters
+    ----------
+    entry : dict
+        entry log document
+    Returns
+    -------
+    counters : dict
+        count, successful and during_break increments
+    """
+    return {
+        "count": 1,
+        "successful": int(bool(entry.get("success", False))),
+        "during_break": int(entry.get("auth_mode", None) == "Manufacturer code"),
+    }
+
+
+def aggregate(entries, size):
+    """Sum counters of entries in each bucket.
+
+    Parameters
+    ----------
+    entries : iterable
+        documents with timestamp and either counters or entry log fields
+    size : datetime.timedelta
+        size of buckets
+    Returns
+    -------
+    buckets : dict
+        bucket start -> counters
+    """
+    buckets = {}
+    for entry in entries:
+        timestamp = entry.get("timestamp", None)
+        if not isinstance(timestamp, dt.datetime):
+            continue
+        counters = buckets.setdefault(
+            bucket_start(timestamp, size), dict.fromkeys(COUNTERS, 0)
+        )
+        increments = entry if "count" in entry else entry_counters(entry)
+        for counter in COUNTERS:
+            counters[counter] += increments.get(counter, 0)
+    return buckets
+
+
+async def update_rollups(db, entries):
+    """Add newly logged entries to all rollups.
+
+    Entries are summed per bucket first, so a batch of entries results in one $inc upsert per bucket.
+
+    Parameters
+    ----------
+    db : motor.motor_asyncio.AsyncIOMotorDatabase
+        database with the rollup collections
+    entries : list
+        entry log documents that were inserted
+    """
+    for collection, size in ROLLUPS:
+        updates = [
+            UpdateOne({"_id": start}, {"$inc": counters}, upsert=True)
+            for start, counters in aggregate(entries, size).items()
+        ]
+        if not updates:
+            continue
+        try:
+            await db[collection].bulk_write(updates, ordered=False)
+        except PyMongoError as e:
+            logger.warning(
+                "unable to update %s, run cherrydoor rollups to fix it. Exception: %s",
+                collection,
+                str(e),
+            )
+
+
+async def backfill_rollups(db, since=None):
+    """Rebuild rollups from the logs collection.
+
+    Buckets are overwritten (not incremented), so running it again is safe.
+    Entries logged while it's running may be counted twice, so it's best to run it while the server is stopped.
+    A full rebuild is recorded in the settings collection, so that the server starts using rollups.
+
+    Parameters
+    ----------
+    db : motor.motor_asyncio.AsyncIOMotorDatabase
+        database with logs and the rollup collections
+    since : datetime.datetime, default=None
+        only rebuild buckets from this day on, all logs are used if None
+    Returns
+    -------
+    buckets : dict
+        rollup collection name -> number of buckets written
+    """
+    match = {"timestamp": {"$type": "date"}}
+    if since is not None:
+        # whole days, so that no bucket is only partially rebuilt
+        match["timestamp"]["$gte"] = bucket_start(since, dt.timedelta(days=1))
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {
+                    "$dateFromParts": {
+                        part: {f"${part}": "$timestamp"}
+                        for part in ["year", "month", "day", "hour", "minute"]
+                    }
+                },
+                "count": {"$sum": 1},
+                "successful": {"$sum": {"$toInt": "$success"}},
+                "during_break": {
+                    "$sum": {"$toInt": {"$eq": ["$auth_mode", "Manufacturer code"]}}
+                },
+            }
+        },
+    ]
+    minutes = [
+        {"timestamp": document.pop("_id"), **document}
+        async for document in db.logs.aggregate(pipeline, allowDiskUse=True)
+    ]
+    written = {}
+    for collection, size in ROLLUPS:
+        buckets = aggregate(minutes, size)
+        updates = [
+            UpdateOne({"_id": start}, {"$set": counters}, upsert=True)
+            for start, counters in buckets.items()
+        ]
+        for offset in range(0, len(updates), 1000):
+            await db[collection].bulk_write(
+                updates[offset : offset + 1000], ordered=False
+            )
+        written[collection] = len(updates)
+    if since is None:
+        await record_backfill(db)
+    return written
+
+
+async def rollups_backfilled(db):
+    """Check if rollups cover all entry logs.
+
+    They don't after upgrading from a version without rollups, until `cherrydoor update --database`
+    or `cherrydoor rollups` backfills them, which is recorded in the settings collection.
+    A database without any logs is recorded as backfilled right away.
+
+    Parameters
+    ----------
+    db : motor.motor_asyncio.AsyncIOMotorDatabase
+        database with logs and settings
+    Returns
+    -------
+    bool
+        True if rollups were backfilled or there was nothing to backfill
+    """
+    if await db.settings.find_one({"setting": BACKFILL_SETTING}) is not None:
+        return True
+    if await db.logs.find_one({"timestamp": {"$type": "date"}}, {"_id": 1}) is None:
+        await record_backfill(db)
+        return True
+    return False
+
+
+async def record_backfill(db):
+    """Record that rollups cover all entry logs.
+
+    Parameters
+    ----------
+    db : motor.motor_asyncio.AsyncIOMotorDatabase
+        database with the settings collection
+    """
+    await db.settings.update_one(
+        {"setting": BACKFILL_SETTING},
+        {"$set": {"value": dt.datetime.now()}},
+        upsert=True,
+    )
+
+
+async def check_rollups(app):
+    """Check once if rollups can be used for /stats.
+
+    Parameters
+    ----------
+    app : aiohttp.web.Application
+        The aiohttp application instance
+    """
+    app["rollups_backfilled"] = False
+    if app["db"] is None or not app["config"].get("stats", {}).get("rollups", True):
+        return
+    try:
+        app["rollups_backfilled"] = await rollups_backfilled(app["db"])
+    except PyMongoError as e:
+        logger.warning(
+            "unable to check if rollups were backfilled, using logs for stats. Exception: %s",
+            str(e),
+        )
+        return
+    if not app["rollups_backfilled"]:
+        logger.warning(
+            "rollups don't cover all logs, run cherrydoor rollups and restart the server to use them for stats"
+        )
+
+
+def choose_rollup(granularity):
+    """Choose the coarsest rollup whose buckets evenly divide the requested granularity.
+
+    Parameters
+    ----------
+    granularity : datetime.timedelta
+        requested interval of each data point
+    Returns
+    -------
+    rollup : tuple or None
+        collection name and bucket size, None if even minutes don't fit
+    """
+    for collection, size in ROLLUPS:
+        if granularity >= size and granularity % size == dt.timedelta(0):
+            return collection, size
+    return None
+
+
+async def get_rollup_stats(
+    db, datetime_from, datetime_to, granularity, max_buckets=MAX_BUCKETS
+):
+    """Get entry statistics between two datetimes from the rollups.
+
+    Returns the same format as get_grouped_logs, but the start is rounded down to the rollup bucket size.
+
+    Parameters
+    ----------
+    db : motor.motor_asyncio.AsyncIOMotorDatabase
+        database with the rollup collections
+    datetime_from : datetime.datetime
+        The start datetime
+    datetime_to : datetime.datetime
+        The end datetime
+    granularity : datetime.timedelta
+        The granularity of the logs to be returned
+    max_buckets : int, default=MAX_BUCKETS
+        The maximum number of buckets - granularity is increased if there would be more
+    Returns
+    -------
+    logs : list or None
+        The list of all data points, None if no rollup fits the granularity
+    """
+    rollup = choose_rollup(granularity)
+    if rollup is None:
+        return None
+    collection, size = rollup
+    datetime_from = bucket_start(datetime_from, size)
+    granularity, buckets = downsample(
+        datetime_from, datetime_to, granularity, max_buckets
+    )
+
+    async def points():
+        point = None
+        async for document in db[collection].find(
+            {"_id": {"$gte": datetime_from, "$lte": datetime_to}}, sort=[("_id", 1)]
+        ):
+            index = min((document["_id"] - datetime_from) // granularity, buckets - 1)
+            if point is not None and point["_id"] != index:
+                yield point
+                point = None
+            if point is None:
+                point = {"_id": index, **dict.fromkeys(COUNTERS, 0)}
+            for counter in COUNTERS:
+                point[counter] += document.get(counter, 0)
+        if point is not None:
+            yield point
+
+    return await fill_buckets(points(), datetime_from, buckets, granularity)
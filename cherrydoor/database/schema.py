@@ -0,0 +1,390 @@
+"""Declarative collection options and indexes, applied by diffing them against the database."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import datetime as dt
+import inspect
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+# increase when collections or indexes change
+SCHEMA_VERSION = 2
+
+logger = logging.getLogger("SCHEMA")
+
+
+async def resolve(value):
+    """Await a value returned by Motor, return one returned by pymongo as is."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def logs_indexes(retention=0):
+    """Get indexes of the logs collection.
+
+    Parameters
+    ----------
+    retention : int, default=0
+        number of seconds after which logs are removed, 0 to keep them forever
+    Returns
+    -------
+    indexes : list
+        list of pymongo.IndexModel
+    """
+    ttl = {"expireAfterSeconds": int(retention)} if retention else {}
+    return [
+        # range queries for stats - and the TTL index removing old logs
+        IndexModel([("timestamp", ASCENDING)], name="timestamp_index", **ttl),
+        # history of a single card
+        IndexModel(
+            [("card", ASCENDING), ("timestamp", DESCENDING)],
+            name="card_timestamp_index",
+        ),
+    ]
+
+
+def desired_schema(config):
+    """Get collections Cherrydoor needs, with their options and indexes.
+
+    Parameters
+    ----------
+    config : dict
+        The app configuration
+    Returns
+    -------
+    schema : dict
+        collection name -> {"capped": {"size": int, "max": int} or None,
+        "timeseries": time-series options or None, "indexes": list of pymongo.IndexModel}
+    """
+    logs_timeseries = config.get("logs", {}).get("timeseries", {})
+    return {
+        "users": {
+            "capped": None,
+            "indexes": [
+                IndexModel(
+                    [("username", ASCENDING)], name="username_index", unique=True
+                ),
+                IndexModel([("cards", ASCENDING)], name="cards_index", sparse=True),
+                IndexModel(
+                    [("tokens.token", ASCENDING)], name="token_index", sparse=True
+                ),
+            ],
+        },
+        "settings": {"capped": None, "indexes": []},
+        "logs": {
+            "capped": None,
+            "timeseries": (
+                {
+                    "timeField": "timestamp",
+                    # dense buckets - a door sees a lot of different cards
+                    "metaField": "door",
+                    "granularity": logs_timeseries.get("granularity", "minutes"),
+                }
+                if logs_timeseries.get("enabled", False)
+                else None
+            ),
+            "indexes": logs_indexes(config.get("logs", {}).get("retention", 0)),
+        },
+        "terminal": {
+            "capped": {
+                "size": config.get("command_log_size", 100000000),
+                "max": 10000,
+            },
+            "indexes": [],
+        },
+    }
+
+
+def capped_size(size):
+    """Round size of a capped collection up to a multiple of 256 bytes, like MongoDB does."""
+    return -(-int(size) // 256) * 256
+
+
+def index_spec(key, options):
+    """Normalize an index to the parts that matter when comparing it.
+
+    Parameters
+    ----------
+    key : list
+        list of (field, direction) tuples
+    options : dict
+        index options
+    Returns
+    -------
+    spec : dict
+        key, unique, sparse and expireAfterSeconds of the index
+    """
+    return {
+        "key": [
+            (field, int(direction) if isinstance(direction, float) else direction)
+            for field, direction in key
+        ],
+        "unique": bool(options.get("unique", False)),
+        "sparse": bool(options.get("sparse", False)),
+        "expireAfterSeconds": options.get("expireAfterSeconds", None),
+    }
+
+
+def plan_collection(name, spec, exists, options, indexes):
+    """Find operations that bring a collection to the desired state.
+
+    Parameters
+    ----------
+    name : str
+        collection name
+    spec : dict
+        desired state, from desired_schema
+    exists : bool
+        True if the collection exists
+    options : dict
+        current collection options
+    indexes : dict
+        current indexes, in the index_information() format
+    Returns
+    -------
+    operations : list
+        list of (operation, arguments) tuples, in the order they have to be run
+    """
+    operations = []
+    capped = spec.get("capped", None)
+    timeseries = spec.get("timeseries", None)
+    # time-series collections expire documents with a collection option instead of a TTL index
+    expire_after = next(
+        (
+            model.document["expireAfterSeconds"]
+            for model in spec.get("indexes", [])
+            if "expireAfterSeconds" in model.document
+        ),
+        None,
+    )
+    if not exists:
+        if capped is not None:
+            operations.append(
+                (
+                    "create_collection",
+                    {"capped": True, "size": capped["size"], "max": capped["max"]},
+                )
+            )
+        elif timeseries is not None:
+            arguments = {"timeseries": dict(timeseries)}
+            if expire_after is not None:
+                arguments["expireAfterSeconds"] = expire_after
+            operations.append(("create_collection", arguments))
+        else:
+            operations.append(("create_collection", {}))
+    elif capped is not None and not options.get("capped", False):
+        # keeps the documents, but max can only be set with collMod
+        operations.append(("convertToCapped", {"size": capped["size"]}))
+        operations.append(("collMod", {"cappedMax": capped["max"]}))
+    elif capped is not None:
+        changes = {}
+        if capped_size(options.get("size", 0)) != capped_size(capped["size"]):
+            changes["cappedSize"] = capped_size(capped["size"])
+        if options.get("max", None) != capped["max"]:
+            changes["cappedMax"] = capped["max"]
+        if changes:
+            operations.append(("collMod", changes))
+    elif timeseries is not None and "timeseries" not in options:
+        logger.warning(
+            "%s isn't a time-series collection yet - run `cherrydoor update --database` to migrate it",
+            name,
+        )
+    elif timeseries is not None:
+        current_granularity = options["timeseries"].get("granularity", "seconds")
+        if current_granularity != timeseries.get("granularity", "seconds"):
+            # MongoDB only allows making granularity coarser
+            operations.append(
+                ("collMod", {"timeseries": {"granularity": timeseries["granularity"]}})
+            )
+        if options.get("expireAfterSeconds", None) != expire_after:
+            operations.append(
+                (
+                    "collMod",
+                    {
+                        "expireAfterSeconds": (
+                            expire_after if expire_after is not None else "off"
+                        )
+                    },
+                )
+            )
+    is_capped = capped is not None or options.get("capped", False)
+    is_timeseries = "timeseries" in options or (timeseries is not None and not exists)
+    missing = []
+    for model in spec.get("indexes", []):
+        document = dict(model.document)
+        index_name = document.pop("name")
+        key = list(document.pop("key").items())
+        if (is_capped or is_timeseries) and "expireAfterSeconds" in document:
+            if is_capped:
+                logger.warning(
+                    "%s collection is capped, so it can't have a TTL index - %s is created without it",
+                    name,
+                    index_name,
+                )
+            document.pop("expireAfterSeconds")
+            model = IndexModel(key, name=index_name, **document)
+        desired = index_spec(key, document)
+        if index_name not in indexes:
+            missing.append(model)
+            continue
+        current_options = dict(indexes[index_name])
+        current = index_spec(current_options.pop("key"), current_options)
+        if current == desired:
+            continue
+        ttl_changed_only = (
+            current["expireAfterSeconds"] is not None
+            and desired["expireAfterSeconds"] is not None
+            and {**current, "expireAfterSeconds": None}
+            == {**desired, "expireAfterSeconds": None}
+        )
+        if ttl_changed_only:
+            operations.append(
+                (
+                    "collMod",
+                    {
+                        "index": {
+                            "name": index_name,
+                            "expireAfterSeconds": desired["expireAfterSeconds"],
+                        }
+                    },
+                )
+            )
+        else:
+            operations.append(("drop_index", {"name": index_name}))
+            missing.append(model)
+    if missing:
+        operations.append(("create_indexes", {"indexes": missing}))
+    return operations
+
+
+class SchemaManager:
+    """Apply the desired schema to a database, changing only what's different.
+
+    Works with both a Motor and a pymongo database, so it can be used by the server and by update scripts.
+    """
+
+    def __init__(self, config, schema=None):
+        """Prepare the desired schema.
+
+        Parameters
+        ----------
+        config : dict
+            The app configuration
+        schema : dict, default=None
+            collection name -> desired state (see desired_schema), desired_schema(config) if None
+        """
+        self.schema = schema if schema is not None else desired_schema(config)
+
+    async def plan(self, db):
+        """Compare the desired schema with the database.
+
+        Parameters
+        ----------
+        db : motor.motor_asyncio.AsyncIOMotorDatabase or pymongo.database.Database
+            The database
+        Returns
+        -------
+        operations : list
+            list of (collection, operation, arguments) tuples
+        """
+        existing = set(await resolve(db.list_collection_names()))
+        operations = []
+        for name, spec in self.schema.items():
+            exists = name in existing
+            options = await resolve(db[name].options()) if exists else {}
+            indexes = await resolve(db[name].index_information()) if exists else {}
+            operations += [
+                (name, operation, arguments)
+                for operation, arguments in plan_collection(
+                    name, spec, exists, options, indexes
+                )
+            ]
+        return operations
+
+    async def run(self, db, collection, operation, arguments):
+        """Run a single operation from plan().
+
+        Parameters
+        ----------
+        db : motor.motor_asyncio.AsyncIOMotorDatabase or pymongo.database.Database
+            The database
+        collection : str
+            collection name
+        operation : str
+            operation name
+        arguments : dict
+            operation arguments
+        """
+        if operation == "create_collection":
+            await resolve(db.create_collection(collection, **arguments))
+        elif operation == "drop_index":
+            await resolve(db[collection].drop_index(arguments["name"]))
+        elif operation == "create_indexes":
+            await resolve(db[collection].create_indexes(arguments["indexes"]))
+        else:
+            await resolve(db.command(operation, collection, **arguments))
+
+    async def apply(self, db):
+        """Apply differences between the desired schema and the database and record the schema version.
+
+        Parameters
+        ----------
+        db : motor.motor_asyncio.AsyncIOMotorDatabase or pymongo.database.Database
+            The database
+        Returns
+        -------
+        operations : list
+            operations that were run successfully, see plan()
+        """
+        operations = await self.plan(db)
+        applied = []
+        for collection, operation, arguments in operations:
+            logger.info("%s: %s %s", collection, operation, arguments)
+            try:
+                await self.run(db, collection, operation, arguments)
+                applied.append((collection, operation, arguments))
+            except PyMongoError as e:
+                # e.g. changing capped size requires MongoDB 6.0 - the rest can still be applied
+                logger.warning(
+                    "unable to %s on %s. Exception: %s", operation, collection, str(e)
+                )
+        version = await resolve(db.settings.find_one({"setting": "schema_version"}))
+        if applied or version is None or version.get("value", None) != SCHEMA_VERSION:
+            await resolve(
+                db.settings.update_one(
+                    {"setting": "schema_version"},
+                    {
+                        "$set": {
+                            "value": SCHEMA_VERSION,
+                            "updated": dt.datetime.now(),
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+        return applied
+
+    def apply_sync(self, db):
+        """Apply the schema to a pymongo database outside of the event loop (for update scripts).
+
+        Parameters
+        ----------
+        db : pymongo.database.Database
+            The database
+        Returns
+        -------
+        operations : list
+            operations that were run, see plan()
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.apply(db))
+        finally:
+            loop.close()
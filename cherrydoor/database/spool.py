@@ -0,0 +1,225 @@
+"""Local append-only spool for documents that couldn't be written to the database."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+import os
+from time import monotonic
+
+from bson import json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+
+class Spool:
+    """JSON lines file documents are appended to while the database is unreachable.
+
+    Spooled documents are replayed in bulk once the database is back. Replaying moves the spool aside first,
+    so new documents can be appended while the old ones are being inserted.
+    """
+
+    def __init__(self, path, batch_size=1000):
+        """Initialize the spool.
+
+        Parameters
+        ----------
+        path : str
+            path of the spool file
+        batch_size : int, default=1000
+            number of documents inserted at once while replaying
+        """
+        self.path = path
+        self.replay_path = f"{path}.replay"
+        self.batch_size = batch_size
+        self.logger = logging.getLogger("SPOOL")
+        self.lock = asyncio.Lock()
+        # held while the spool file is appended to or moved aside for a replay
+        self.file_lock = asyncio.Lock()
+        self.spooled = 0
+        self.replayed = 0
+        self.last_replay_throughput = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def size(self):
+        """Return the size of spooled data.
+
+        Returns
+        -------
+        size : int
+            size of the spool files in bytes
+        """
+        size = 0
+        for path in (self.path, self.replay_path):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def pending(self):
+        """Check if there are documents waiting to be replayed.
+
+        Returns
+        -------
+        bool
+            True if the spool isn't empty
+        """
+        return self.size() > 0
+
+    async def append(self, documents):
+        """Append documents to the spool.
+
+        The file is written and synced in an executor, so a slow disk doesn't block the event loop.
+
+        Parameters
+        ----------
+        documents : list
+            documents to spool
+        """
+        lines = "".join(f"{json_util.dumps(document)}\n" for document in documents)
+        async with self.file_lock:
+            await asyncio.get_event_loop().run_in_executor(None, self.write, lines)
+        self.spooled += len(documents)
+
+    def write(self, lines):
+        """Append lines to the spool file and sync it to disk.
+
+        Parameters
+        ----------
+        lines : str
+            JSON lines to append
+        """
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def move_aside(self):
+        """Move the spool file aside for a replay.
+
+        Returns
+        -------
+        bool
+            True if there was a spool file to move
+        """
+        if not os.path.exists(self.path):
+            return False
+        os.replace(self.path, self.replay_path)
+        return True
+
+    def read_replay(self):
+        """Read lines of the spool file that's being replayed.
+
+        Returns
+        -------
+        lines : list
+            JSON lines
+        """
+        with open(self.replay_path, "r", encoding="utf-8") as f:
+            return f.readlines()
+
+    def rewrite_replay(self, lines):
+        """Replace the spool file that's being replayed with lines that are left.
+
+        Parameters
+        ----------
+        lines : list
+            JSON lines that weren't replayed
+        """
+        with open(self.replay_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def replay(self, collection, on_write=None):
+        """Insert all spooled documents into a collection.
+
+        File operations run in an executor, like in append().
+
+        Parameters
+        ----------
+        collection : motor.motor_asyncio.AsyncIOMotorCollection
+            collection to insert documents into
+        on_write : coroutine function, default=None
+            called with every batch of documents after it was inserted
+        Returns
+        -------
+        replayed : int
+            number of documents inserted
+        """
+        loop = asyncio.get_event_loop()
+        async with self.lock:
+            if not await loop.run_in_executor(None, os.path.exists, self.replay_path):
+                async with self.file_lock:
+                    if not await loop.run_in_executor(None, self.move_aside):
+                        return 0
+            start = monotonic()
+            replayed = 0
+            lines = await loop.run_in_executor(None, self.read_replay)
+            for offset in range(0, len(lines), self.batch_size):
+                batch = [
+                    json_util.loads(line)
+                    for line in lines[offset : offset + self.batch_size]
+                    if line.strip()
+                ]
+                written = batch
+                try:
+                    await collection.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    self.logger.error(
+                        "%s spooled documents couldn't be inserted. Errors: %s",
+                        len(batch) - e.details.get("nInserted", 0),
+                        e.details.get("writeErrors", []),
+                    )
+                    failed = {
+                        error["index"] for error in e.details.get("writeErrors", [])
+                    }
+                    written = [
+                        document
+                        for index, document in enumerate(batch)
+                        if index not in failed
+                    ]
+                except PyMongoError as e:
+                    # keep what's left for the next replay
+                    await loop.run_in_executor(
+                        None, self.rewrite_replay, lines[offset:]
+                    )
+                    self.logger.warning(
+                        "replay stopped after %s documents. Exception: %s",
+                        replayed,
+                        str(e),
+                    )
+                    self.replayed += replayed
+                    return replayed
+                replayed += len(batch)
+                if on_write is not None and written:
+                    await on_write(written)
+            await loop.run_in_executor(None, os.remove, self.replay_path)
+            duration = monotonic() - start
+            self.replayed += replayed
+            self.last_replay_throughput = replayed / duration if duration else None
+            self.logger.info(
+                "replayed %s spooled documents in %.2fs", replayed, duration
+            )
+        # documents could have been spooled while replaying
+        if await loop.run_in_executor(None, os.path.exists, self.path):
+            replayed += await self.replay(collection, on_write)
+        return replayed
+
+    def stats(self):
+        """Return spool metrics.
+
+        Returns
+        -------
+        stats : dict
+            size in bytes, number of spooled and replayed documents and throughput of the last replay (documents/s)
+        """
+        return {
+            "size": self.size(),
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "last_replay_throughput": self.last_replay_throughput,
+        }
@@ -0,0 +1,49 @@
+"""Storage engines - MongoDB, in-memory and SQLite - behind a common repository interface."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+from cherrydoor.database.mongo import init_db
+from cherrydoor.database.storage.base import Storage, StorageError
+from cherrydoor.database.storage.memory import MemoryStorage
+from cherrydoor.database.storage.mongo import MotorStorage
+from cherrydoor.database.storage.sqlite import SqliteStorage
+
+ENGINES = ["mongo", "memory", "sqlite"]
+
+
+def create_storage(config, loop=None, db=None):
+    """Create the storage engine selected in config.
+
+    Parameters
+    ----------
+    config : dict
+        The app configuration - storage.engine selects the engine, storage.path is the SQLite database file
+    loop : asyncio.AbstractEventLoop, default=None
+        The event loop used for the MongoDB connection
+    db : motor.motor_asyncio.AsyncIOMotorDatabase, default=None
+        MongoDB database to use instead of connecting to the one from config
+    Returns
+    -------
+    storage : Storage
+        The storage engine - call setup() before using it
+    Raises
+    ------
+    ValueError
+        if the engine isn't supported
+    """
+    options = config.get("storage", {})
+    engine = options.get("engine", "mongo")
+    if engine == "mongo":
+        return MotorStorage(db if db is not None else init_db(config, loop))
+    if engine == "memory":
+        return MemoryStorage()
+    if engine == "sqlite":
+        return SqliteStorage(
+            options.get("path", "~/.local/share/cherrydoor/cherrydoor.sqlite")
+        )
+    raise ValueError(
+        f"unsupported storage engine {engine}, use one of: {', '.join(ENGINES)}"
+    )
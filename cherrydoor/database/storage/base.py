@@ -0,0 +1,544 @@
+"""Repository interface every storage engine implements."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+import re
+from abc import ABC, abstractmethod
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from pymongo.results import InsertManyResult
+
+USERS_FIELDS = ["username", "permissions", "cards"]
+ALL_OPERATIONS = ["insert", "update", "replace", "delete"]
+
+
+class StorageError(PyMongoError):
+    """Error raised by engines other than MongoDB.
+
+    It's a PyMongoError, so code handling database errors doesn't have to know which engine is used.
+    """
+
+
+def new_id():
+    """Generate a document id in the same format MongoDB uses.
+
+    Returns
+    -------
+    id : str
+        24 hexadecimal digits
+    """
+    return str(ObjectId())
+
+
+def project(document, fields=None):
+    """Return only selected fields of a document.
+
+    Parameters
+    ----------
+    document : dict or None
+        the full document
+    fields : list, default=None
+        fields to return, _id is only returned if it's on the list. All fields are returned if None
+    Returns
+    -------
+    document : dict or None
+        a copy of the document with only selected fields
+    """
+    if document is None:
+        return None
+    if fields is None:
+        return dict(document)
+    return {field: document[field] for field in fields if field in document}
+
+
+def matches_operators(candidates, condition):
+    """Check if any of the values matches all operators of a condition.
+
+    Parameters
+    ----------
+    candidates : list
+        values of the field (array elements, or a single value)
+    condition : dict
+        operator -> argument, supported operators are $in, $gt and $regex
+    Returns
+    -------
+    bool
+        True if the condition is met
+    """
+    for operator, argument in condition.items():
+        if operator == "$in":
+            matched = bool(set(argument) & set(map(str, candidates)))
+        elif operator == "$gt":
+            matched = any(
+                value is not None and str(value) > str(argument) for value in candidates
+            )
+        elif operator == "$regex":
+            matched = any(
+                value is not None and re.search(argument, str(value))
+                for value in candidates
+            )
+        else:
+            raise StorageError(f"unsupported query operator {operator}")
+        if not matched:
+            return False
+    return True
+
+
+def matches(document, query):
+    """Check if a user document matches a query, like MongoDB would.
+
+    Supported conditions are equality, membership for array fields (a single card or permission),
+    "tokens.token" and operators supported by matches_operators().
+
+    Parameters
+    ----------
+    document : dict
+        user document
+    query : dict
+        field -> condition
+    Returns
+    -------
+    bool
+        True if all conditions match
+    """
+    for field, condition in query.items():
+        if field == "tokens.token":
+            values = [token.get("token", None) for token in document.get("tokens", [])]
+        else:
+            values = document.get(field, None)
+        candidates = values if isinstance(values, list) else [values]
+        if isinstance(condition, dict):
+            if not matches_operators(candidates, condition):
+                return False
+        elif isinstance(condition, list):
+            if values != condition:
+                return False
+        elif condition not in candidates and values != condition:
+            return False
+    return True
+
+
+def apply_update(document, set=None, add=None, remove=None, append=None):
+    """Modify a document in place.
+
+    Parameters
+    ----------
+    document : dict
+        document to modify
+    set : dict, default=None
+        field -> new value
+    add : dict, default=None
+        field -> list of values added to an array if they aren't already there
+    remove : dict, default=None
+        field -> list of values removed from an array
+    append : dict, default=None
+        field -> value appended to an array
+    """
+    for field, value in (set or {}).items():
+        document[field] = value
+    for field, values in (add or {}).items():
+        current = document.setdefault(field, [])
+        for value in values:
+            if value not in current:
+                current.append(value)
+    for field, values in (remove or {}).items():
+        document[field] = [
+            value for value in document.get(field, []) if value not in values
+        ]
+    for field, value in (append or {}).items():
+        document[field] = document.get(field, []) + [value]
+
+
+class Subscription:
+    """Stream of change events, used like a Motor change stream."""
+
+    def __init__(self, notifier, collection, operations):
+        """Subscribe to changes.
+
+        Parameters
+        ----------
+        notifier : ChangeNotifier
+            the engine the changes come from
+        collection : str
+            collection to watch
+        operations : list
+            operation types to receive
+        """
+        self.notifier = notifier
+        self.collection = collection
+        self.operations = set(operations)
+        self.queue = asyncio.Queue()
+        self.notifier.subscribers.setdefault(collection, set()).add(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+    async def close(self):
+        """Stop receiving changes."""
+        self.notifier.subscribers.get(self.collection, set()).discard(self)
+
+
+class ChangeNotifier:
+    """Change notifications for engines without change streams."""
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def watch(self, collection, operations=None):
+        """Watch a collection for changes.
+
+        Parameters
+        ----------
+        collection : str
+            collection to watch
+        operations : list, default=None
+            operation types to receive, all of them if None
+        Returns
+        -------
+        subscription : Subscription
+            async context manager and iterator of change events in the MongoDB change stream format
+        """
+        return Subscription(self, collection, operations or ALL_OPERATIONS)
+
+    def notify(self, collection, operation, key, document=None):
+        """Send a change event to subscribers.
+
+        Parameters
+        ----------
+        collection : str
+            changed collection
+        operation : str
+            "insert", "update", "replace" or "delete"
+        key : str
+            _id of the changed document
+        document : dict, default=None
+            the document after the change
+        """
+        change = {"operationType": operation, "documentKey": {"_id": key}}
+        if document is not None:
+            change["fullDocument"] = dict(document)
+        for subscription in list(self.subscribers.get(collection, ())):
+            if operation in subscription.operations:
+                subscription.queue.put_nowait(change)
+
+
+class CollectionWriter:
+    """Object with insert_many, so BufferedWriter and Spool can write to any engine."""
+
+    def __init__(self, storage, name):
+        """Initialize the writer.
+
+        Parameters
+        ----------
+        storage : Storage
+            engine to write to
+        name : str
+            "logs" or "terminal"
+        """
+        self.storage = storage
+        self.name = name
+
+    async def insert_many(self, documents, ordered=False):
+        """Insert documents.
+
+        Parameters
+        ----------
+        documents : list
+            documents to insert
+        ordered : bool, default=False
+            unused, documents are always inserted in order
+        Returns
+        -------
+        result : pymongo.results.InsertManyResult
+            result with ids of inserted documents
+        """
+        ids = await self.storage.insert(self.name, documents)
+        return InsertManyResult(ids, True)
+
+
+class Storage(ABC):
+    """Repository of users, tokens, settings, entry logs, terminal logs and sessions.
+
+    Queries use the subset of MongoDB syntax supported by matches().
+    """
+
+    # engine name used in config
+    name = None
+    # underlying Motor database if the engine is MongoDB, used by MongoDB-only features (rollups, schema)
+    db = None
+
+    def __init__(self):
+        self.logger = logging.getLogger(f"STORAGE:{self.name}")
+
+    async def setup(self, config):
+        """Create tables/collections and indexes.
+
+        Parameters
+        ----------
+        config : dict
+            The app configuration
+        """
+
+    async def close(self):
+        """Close the connection."""
+
+    def writer(self, collection):
+        """Get an object documents can be inserted into with insert_many.
+
+        Parameters
+        ----------
+        collection : str
+            "logs" or "terminal"
+        Returns
+        -------
+        collection : object
+            object with an insert_many coroutine
+        """
+        return CollectionWriter(self, collection)
+
+    @abstractmethod
+    def watch(self, collection, operations=None):
+        """Watch a collection for changes.
+
+        Parameters
+        ----------
+        collection : str
+            "users", "settings" or "logs"
+        operations : list, default=None
+            operation types to receive, all of them if None
+        Returns
+        -------
+        stream : async context manager and iterator
+            change events with operationType, documentKey and fullDocument (for inserts and updates)
+        """
+
+    @abstractmethod
+    async def find_user(self, query, fields=None):
+        """Find a single user.
+
+        Parameters
+        ----------
+        query : dict
+            conditions the user has to match
+        fields : list, default=None
+            fields to return, see project()
+        Returns
+        -------
+        user : dict or None
+            the user document, None if no user matches
+        """
+
+    @abstractmethod
+    def find_users(
+        self, query=None, fields=None, sort=None, limit=None, batch_size=None
+    ):
+        """Iterate over users.
+
+        Parameters
+        ----------
+        query : dict, default=None
+            conditions users have to match, all users if None
+        fields : list, default=None
+            fields to return, see project()
+        sort : str, default=None
+            "_id" or "username" to return users in ascending order of that field, unordered if None
+        limit : int, default=None
+            maximum number of users to return, all of them if None
+        batch_size : int, default=None
+            number of users fetched from the database at once, if the engine fetches them in batches
+        Returns
+        -------
+        users : async iterator
+            user documents
+        """
+
+    @abstractmethod
+    async def count_users(self, query):
+        """Count users matching a query.
+
+        Parameters
+        ----------
+        query : dict
+            conditions users have to match
+        Returns
+        -------
+        count : int
+            number of matching users
+        """
+
+    @abstractmethod
+    async def insert_users(self, users):
+        """Create users.
+
+        Parameters
+        ----------
+        users : list
+            user documents (without _id)
+        Returns
+        -------
+        ids : list
+            ids of created users
+        Raises
+        ------
+        pymongo.errors.DuplicateKeyError
+            if a username is already taken
+        """
+
+    @abstractmethod
+    async def update_user(
+        self, query, set=None, add=None, remove=None, append=None, fields=None
+    ):
+        """Modify a single user.
+
+        Parameters
+        ----------
+        query : dict
+            conditions the user has to match
+        set, add, remove, append : dict, default=None
+            changes, see apply_update()
+        fields : list, default=None
+            fields of the modified user to return
+        Returns
+        -------
+        user : dict or None
+            the user after modification, None if no user matches
+        """
+
+    @abstractmethod
+    async def delete_user(self, query):
+        """Delete a single user.
+
+        Parameters
+        ----------
+        query : dict
+            conditions the user has to match
+        Returns
+        -------
+        deleted : bool
+            True if a user was deleted
+        """
+
+    async def add_token(self, identity, name, token):
+        """Assign an API token to a user.
+
+        Parameters
+        ----------
+        identity : str
+            id of the user
+        name : str
+            frontend name of the token
+        token : str
+            the token
+        """
+        await self.update_user(
+            {"_id": identity}, add={"tokens": [{"name": name, "token": token}]}
+        )
+
+    @abstractmethod
+    async def get_settings(self, names=None):
+        """Get settings.
+
+        Parameters
+        ----------
+        names : list, default=None
+            names of settings to get, all of them if None
+        Returns
+        -------
+        settings : dict
+            name -> setting document (with setting, value and any other fields)
+        """
+
+    @abstractmethod
+    async def set_setting(self, name, value, upsert=False, **fields):
+        """Change the value of a setting.
+
+        Parameters
+        ----------
+        name : str
+            name of the setting
+        value : any
+            new value
+        upsert : bool, default=False
+            create the setting if it doesn't exist
+        **fields
+            other fields to set in the setting document
+        """
+
+    @abstractmethod
+    async def insert(self, collection, documents):
+        """Insert log documents.
+
+        Parameters
+        ----------
+        collection : str
+            "logs" or "terminal"
+        documents : list
+            documents to insert
+        Returns
+        -------
+        ids : list
+            ids of inserted documents
+        """
+
+    @abstractmethod
+    async def grouped_logs(self, datetime_from, datetime_to, granularity, max_buckets):
+        """Count entries in buckets between two datetimes.
+
+        Parameters
+        ----------
+        datetime_from : datetime.datetime
+            The start datetime
+        datetime_to : datetime.datetime
+            The end datetime
+        granularity : datetime.timedelta or int
+            The granularity of the logs to be returned (seconds if int)
+        max_buckets : int
+            The maximum number of buckets - granularity is increased if there would be more
+        Returns
+        -------
+        logs : list
+            all buckets, in the format of fill_buckets()
+        """
+
+    @abstractmethod
+    async def load_session(self, key):
+        """Load a web session.
+
+        Parameters
+        ----------
+        key : str
+            session id
+        Returns
+        -------
+        data : str or None
+            encoded session data, None if there is no such session or it expired
+        """
+
+    @abstractmethod
+    async def save_session(self, key, data, max_age=None):
+        """Save a web session.
+
+        Parameters
+        ----------
+        key : str
+            session id
+        data : str
+            encoded session data
+        max_age : int, default=None
+            number of seconds after which the session expires, never if None
+        """
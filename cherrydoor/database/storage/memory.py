@@ -0,0 +1,181 @@
+"""In-memory storage engine, for tests, benchmarks and doors that don't need to keep data."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import copy
+from collections import deque
+from time import monotonic
+
+from pymongo.errors import DuplicateKeyError
+
+from cherrydoor.database.mongo import downsample, fill_buckets
+from cherrydoor.database.storage.base import (
+    ChangeNotifier,
+    Storage,
+    apply_update,
+    matches,
+    new_id,
+    project,
+)
+
+
+async def iterate(documents):
+    """Turn a list into an async iterator."""
+    for document in documents:
+        yield document
+
+
+class MemoryStorage(ChangeNotifier, Storage):
+    """Storage in Python dicts and lists - everything is lost when the server stops."""
+
+    name = "memory"
+
+    def __init__(self, terminal_size=10000):
+        """Initialize empty storage.
+
+        Parameters
+        ----------
+        terminal_size : int, default=10000
+            number of terminal log entries to keep, like the capped terminal collection
+        """
+        Storage.__init__(self)
+        ChangeNotifier.__init__(self)
+        self.users = {}
+        self.settings = {}
+        self.logs = []
+        self.terminal = deque(maxlen=terminal_size)
+        self.sessions = {}
+
+    def find(self, query):
+        """Find users matching a query, using the id directly if it's in the query."""
+        query = query or {}
+        if "_id" in query and not isinstance(query["_id"], dict):
+            user = self.users.get(str(query["_id"]), None)
+            candidates = [] if user is None else [user]
+        else:
+            candidates = self.users.values()
+        return [user for user in candidates if matches(user, query)]
+
+    def check_username(self, username, identity=None):
+        """Raise DuplicateKeyError if another user already has the username."""
+        for user in self.users.values():
+            if user.get("username", None) == username and user["_id"] != identity:
+                raise DuplicateKeyError(f"username {username} is already taken")
+
+    async def find_user(self, query, fields=None):
+        users = self.find(query)
+        return copy.deepcopy(project(users[0], fields)) if users else None
+
+    def find_users(
+        self, query=None, fields=None, sort=None, limit=None, batch_size=None
+    ):
+        users = self.find(query)
+        if sort is not None:
+            users = sorted(users, key=lambda user: str(user.get(sort, "")))
+        if limit is not None:
+            users = users[:limit]
+        return iterate([copy.deepcopy(project(user, fields)) for user in users])
+
+    async def count_users(self, query):
+        return len(self.find(query))
+
+    async def insert_users(self, users):
+        documents = []
+        for user in users:
+            document = copy.deepcopy(user)
+            document["_id"] = new_id()
+            self.check_username(document.get("username", None))
+            documents.append(document)
+        for document in documents:
+            self.users[document["_id"]] = document
+            self.notify("users", "insert", document["_id"], document)
+        return [document["_id"] for document in documents]
+
+    async def update_user(
+        self, query, set=None, add=None, remove=None, append=None, fields=None
+    ):
+        users = self.find(query)
+        if not users or not (set or add or remove or append):
+            return None
+        updated = copy.deepcopy(users[0])
+        apply_update(updated, set, add, remove, append)
+        self.check_username(updated.get("username", None), updated["_id"])
+        self.users[updated["_id"]] = updated
+        self.notify("users", "update", updated["_id"], updated)
+        return copy.deepcopy(project(updated, fields))
+
+    async def delete_user(self, query):
+        users = self.find(query)
+        if not users:
+            return False
+        del self.users[users[0]["_id"]]
+        self.notify("users", "delete", users[0]["_id"])
+        return True
+
+    async def get_settings(self, names=None):
+        return {
+            name: copy.deepcopy(document)
+            for name, document in self.settings.items()
+            if names is None or name in names
+        }
+
+    async def set_setting(self, name, value, upsert=False, **fields):
+        if name not in self.settings and not upsert:
+            return
+        operation = "update" if name in self.settings else "insert"
+        document = self.settings.setdefault(name, {"_id": new_id(), "setting": name})
+        document.update(fields, value=value)
+        self.notify("settings", operation, document["_id"], document)
+
+    async def insert(self, collection, documents):
+        target = self.logs if collection == "logs" else self.terminal
+        ids = []
+        for document in documents:
+            document = dict(document)
+            document.setdefault("_id", new_id())
+            target.append(document)
+            ids.append(document["_id"])
+            if collection == "logs":
+                self.notify("logs", "insert", document["_id"], document)
+        return ids
+
+    async def grouped_logs(self, datetime_from, datetime_to, granularity, max_buckets):
+        granularity, buckets = downsample(
+            datetime_from, datetime_to, granularity, max_buckets
+        )
+        groups = {}
+        for entry in self.logs:
+            timestamp = entry.get("timestamp", None)
+            if timestamp is None or not datetime_from <= timestamp <= datetime_to:
+                continue
+            index = min((timestamp - datetime_from) // granularity, buckets - 1)
+            group = groups.setdefault(
+                index, {"_id": index, "count": 0, "successful": 0, "during_break": 0}
+            )
+            group["count"] += 1
+            group["successful"] += int(bool(entry.get("success", False)))
+            group["during_break"] += int(
+                entry.get("auth_mode", None) == "Manufacturer code"
+            )
+        return await fill_buckets(
+            iterate([groups[index] for index in sorted(groups)]),
+            datetime_from,
+            buckets,
+            granularity,
+        )
+
+    async def load_session(self, key):
+        data, expires = self.sessions.get(key, (None, None))
+        if expires is not None and expires < monotonic():
+            del self.sessions[key]
+            return None
+        return data
+
+    async def save_session(self, key, data, max_age=None):
+        self.sessions[key] = (
+            data,
+            monotonic() + max_age if max_age is not None else None,
+        )
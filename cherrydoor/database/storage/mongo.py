@@ -0,0 +1,277 @@
+"""MongoDB storage engine, using Motor."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import datetime as dt
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReturnDocument, WriteConcern
+
+from cherrydoor.database.mongo import (
+    downsample,
+    fill_buckets,
+    report_collection_sizes,
+)
+from cherrydoor.database.schema import SchemaManager
+from cherrydoor.database.storage.base import ALL_OPERATIONS, Storage
+
+
+def object_id(value):
+    """Convert an id to ObjectId, leaving ids that aren't valid ObjectIds as they are."""
+    if isinstance(value, str):
+        try:
+            return ObjectId(value)
+        except InvalidId:
+            return value
+    return value
+
+
+def mongo_query(query):
+    """Convert a storage query to a MongoDB filter.
+
+    Parameters
+    ----------
+    query : dict
+        storage query
+    Returns
+    -------
+    query : dict
+        the same query with _id converted to ObjectId
+    """
+    query = dict(query or {})
+    if isinstance(query.get("_id", None), dict):
+        query["_id"] = {
+            operator: (
+                [object_id(value) for value in argument]
+                if isinstance(argument, list)
+                else object_id(argument)
+            )
+            for operator, argument in query["_id"].items()
+        }
+    elif "_id" in query:
+        query["_id"] = object_id(query["_id"])
+    return query
+
+
+def projection(fields):
+    """Convert a list of fields to a MongoDB projection, excluding _id unless it's listed."""
+    if fields is None:
+        return None
+    projection = {field: 1 for field in fields}
+    if "_id" not in fields:
+        projection["_id"] = 0
+    return projection
+
+
+class MotorStorage(Storage):
+    """Storage in MongoDB - requires a replica set for change streams."""
+
+    name = "mongo"
+
+    def __init__(self, db):
+        """Use a database.
+
+        Parameters
+        ----------
+        db : motor.motor_asyncio.AsyncIOMotorDatabase
+            The database
+        """
+        super().__init__()
+        self.db = db
+
+    async def setup(self, config):
+        await SchemaManager(config).apply(self.db)
+        await report_collection_sizes(self.db, ["users", "logs", "terminal"])
+
+    async def close(self):
+        self.db.client.close()
+
+    def writer(self, collection):
+        return self.db[collection]
+
+    def watch(self, collection, operations=None):
+        return self.db[collection].watch(
+            pipeline=[
+                {"$match": {"operationType": {"$in": operations or ALL_OPERATIONS}}}
+            ],
+            full_document="updateLookup",
+        )
+
+    async def find_user(self, query, fields=None):
+        return await self.db.users.find_one(
+            mongo_query(query), projection=projection(fields)
+        )
+
+    def find_users(
+        self, query=None, fields=None, sort=None, limit=None, batch_size=None
+    ):
+        cursor = self.db.users.find(
+            mongo_query(query),
+            projection=projection(fields),
+            batch_size=batch_size or 0,
+        )
+        if sort is not None:
+            cursor = cursor.sort(sort, ASCENDING)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    async def count_users(self, query):
+        return await self.db.users.count_documents(mongo_query(query))
+
+    async def insert_users(self, users):
+        result = await self.db.users.with_options(
+            write_concern=WriteConcern(w="majority")
+        ).insert_many(users)
+        return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+    async def update_user(
+        self, query, set=None, add=None, remove=None, append=None, fields=None
+    ):
+        pipeline = []
+        if set:
+            pipeline.append({"$set": set})
+        if add:
+            # unlike $setUnion, keeps the order of values
+            pipeline.append(
+                {
+                    "$set": {
+                        field: {
+                            "$concatArrays": [
+                                {"$ifNull": [f"${field}", []]},
+                                {
+                                    "$filter": {
+                                        "input": values,
+                                        "cond": {
+                                            "$not": {
+                                                "$in": [
+                                                    "$$this",
+                                                    {"$ifNull": [f"${field}", []]},
+                                                ]
+                                            }
+                                        },
+                                    }
+                                },
+                            ]
+                        }
+                        for field, values in add.items()
+                    }
+                }
+            )
+        if remove:
+            pipeline.append(
+                {
+                    "$set": {
+                        field: {
+                            "$filter": {
+                                "input": {"$ifNull": [f"${field}", []]},
+                                "cond": {"$not": {"$in": ["$$this", values]}},
+                            }
+                        }
+                        for field, values in remove.items()
+                    }
+                }
+            )
+        if append:
+            pipeline.append(
+                {
+                    "$set": {
+                        field: {
+                            "$concatArrays": [{"$ifNull": [f"${field}", []]}, [value]]
+                        }
+                        for field, value in append.items()
+                    }
+                }
+            )
+        if not pipeline:
+            return None
+        return await self.db.users.find_one_and_update(
+            mongo_query(query),
+            pipeline,
+            projection=projection(fields),
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def delete_user(self, query):
+        result = await self.db.users.delete_one(mongo_query(query))
+        return result.deleted_count > 0
+
+    async def add_token(self, identity, name, token):
+        await self.db.users.update_one(
+            {"_id": object_id(identity)},
+            {"$addToSet": {"tokens": {"name": name, "token": token}}},
+        )
+
+    async def get_settings(self, names=None):
+        query = {} if names is None else {"setting": {"$in": list(names)}}
+        return {
+            document["setting"]: document
+            async for document in self.db.settings.find(query, {"_id": 0})
+        }
+
+    async def set_setting(self, name, value, upsert=False, **fields):
+        await self.db.settings.update_one(
+            {"setting": name}, {"$set": {"value": value, **fields}}, upsert=upsert
+        )
+
+    async def insert(self, collection, documents):
+        result = await self.db[collection].insert_many(documents, ordered=False)
+        return result.inserted_ids
+
+    async def grouped_logs(self, datetime_from, datetime_to, granularity, max_buckets):
+        granularity, buckets = downsample(
+            datetime_from, datetime_to, granularity, max_buckets
+        )
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": datetime_from, "$lte": datetime_to}}},
+            {
+                "$group": {
+                    "_id": {
+                        # the end of the range belongs to the last bucket
+                        "$min": [
+                            {
+                                "$floor": {
+                                    "$divide": [
+                                        {"$subtract": ["$timestamp", datetime_from]},
+                                        granularity / dt.timedelta(milliseconds=1),
+                                    ]
+                                }
+                            },
+                            buckets - 1,
+                        ]
+                    },
+                    "count": {"$sum": 1},
+                    "successful": {"$sum": {"$toInt": "$success"}},
+                    "during_break": {
+                        "$sum": {"$toInt": {"$eq": ["$auth_mode", "Manufacturer code"]}}
+                    },
+                }
+            },
+            {"$sort": {"_id": 1}},
+        ]
+        return await fill_buckets(
+            self.db.logs.aggregate(pipeline), datetime_from, buckets, granularity
+        )
+
+    async def load_session(self, key):
+        document = await self.db.sessions.find_one({"key": key})
+        if document is None:
+            return None
+        expires = document.get("expire", None)
+        if expires is not None and expires < dt.datetime.utcnow():
+            return None
+        return document.get("data", None)
+
+    async def save_session(self, key, data, max_age=None):
+        expires = (
+            dt.datetime.utcnow() + dt.timedelta(seconds=max_age)
+            if max_age is not None
+            else None
+        )
+        await self.db.sessions.update_one(
+            {"key": key}, {"$set": {"data": data, "expire": expires}}, upsert=True
+        )
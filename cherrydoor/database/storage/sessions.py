@@ -0,0 +1,81 @@
+"""aiohttp-session storage keeping sessions in any storage engine."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import json
+import uuid
+
+from aiohttp_session import AbstractStorage, Session
+
+
+class StorageSessions(AbstractStorage):
+    """Session storage for engines other than MongoDB (where aiohttp-session-mongo is used)."""
+
+    def __init__(
+        self,
+        storage,
+        *,
+        cookie_name="AIOHTTP_SESSION",
+        domain=None,
+        max_age=None,
+        path="/",
+        secure=None,
+        httponly=True,
+        samesite=None,
+        key_factory=lambda: uuid.uuid4().hex,
+        encoder=json.dumps,
+        decoder=json.loads,
+    ):
+        """Initialize the session storage.
+
+        Parameters
+        ----------
+        storage : cherrydoor.database.Storage
+            The storage engine
+        key_factory : callable, default=uuid4().hex
+            function generating session ids
+        Other parameters are the same as in aiohttp_session.AbstractStorage
+        """
+        super().__init__(
+            cookie_name=cookie_name,
+            domain=domain,
+            max_age=max_age,
+            path=path,
+            secure=secure,
+            httponly=httponly,
+            samesite=samesite,
+            encoder=encoder,
+            decoder=decoder,
+        )
+        self._storage = storage
+        self._key_factory = key_factory
+
+    async def load_session(self, request):
+        cookie = self.load_cookie(request)
+        if cookie is None:
+            return Session(None, data=None, new=True, max_age=self.max_age)
+        key = str(cookie)
+        data = await self._storage.load_session(key)
+        if data is None:
+            return Session(None, data=None, new=True, max_age=self.max_age)
+        try:
+            data = self._decoder(data)
+        except ValueError:
+            data = None
+        return Session(key, data=data, new=False, max_age=self.max_age)
+
+    async def save_session(self, request, response, session):
+        key = session.identity
+        if key is None:
+            key = self._key_factory()
+            self.save_cookie(response, key, max_age=session.max_age)
+        elif session.empty:
+            self.save_cookie(response, "", max_age=session.max_age)
+        else:
+            key = str(key)
+            self.save_cookie(response, key, max_age=session.max_age)
+        data = self._encoder(self._get_session_data(session))
+        await self._storage.save_session(key, data, session.max_age)
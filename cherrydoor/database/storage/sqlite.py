@@ -0,0 +1,465 @@
+"""SQLite storage engine, using aiosqlite - for small doors that don't need a MongoDB replica set."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import datetime as dt
+import os
+import sqlite3
+from time import time
+
+from bson import json_util
+from pymongo.errors import DuplicateKeyError
+
+from cherrydoor.database.mongo import downsample, fill_buckets
+from cherrydoor.database.storage.base import (
+    ChangeNotifier,
+    Storage,
+    StorageError,
+    apply_update,
+    matches,
+    new_id,
+    project,
+)
+
+EPOCH = dt.datetime(1970, 1, 1)
+# user fields kept in columns, for sorting and keyset pagination
+COLUMNS = {"_id": "id", "username": "username"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT UNIQUE,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_cards (
+    card TEXT NOT NULL,
+    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    PRIMARY KEY (card, user_id)
+);
+CREATE INDEX IF NOT EXISTS user_cards_user ON user_cards(user_id);
+CREATE TABLE IF NOT EXISTS user_tokens (
+    token TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS user_tokens_user ON user_tokens(user_id);
+CREATE TABLE IF NOT EXISTS settings (
+    setting TEXT PRIMARY KEY,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL,
+    card TEXT,
+    success INTEGER,
+    during_break INTEGER,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_timestamp ON logs(timestamp);
+CREATE INDEX IF NOT EXISTS logs_card_timestamp ON logs(card, timestamp);
+CREATE TABLE IF NOT EXISTS terminal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    data TEXT,
+    expires REAL
+);
+"""
+
+
+def to_seconds(timestamp):
+    """Convert a naive datetime to seconds since epoch (without time zone conversion)."""
+    if not isinstance(timestamp, dt.datetime):
+        return None
+    return (timestamp - EPOCH).total_seconds()
+
+
+def encode(document):
+    return json_util.dumps(document)
+
+
+def decode(text):
+    return json_util.loads(text)
+
+
+class SqliteStorage(ChangeNotifier, Storage):
+    """Storage in a single SQLite database in WAL mode.
+
+    Documents are kept as JSON, with columns for fields that are searched or aggregated.
+    Changes are only noticed if they're made by this process.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, terminal_size=10000):
+        """Prepare the engine - the database is opened in setup().
+
+        Parameters
+        ----------
+        path : str
+            path of the database file
+        terminal_size : int, default=10000
+            number of terminal log entries to keep
+        """
+        Storage.__init__(self)
+        ChangeNotifier.__init__(self)
+        self.path = os.path.expanduser(path)
+        self.terminal_size = terminal_size
+        self.connection = None
+        self.lock = asyncio.Lock()
+
+    async def setup(self, config):
+        # imported here, so that aiosqlite is only required if this engine is used
+        import aiosqlite  # pylint: disable=import-outside-toplevel
+
+        if self.connection is not None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = await aiosqlite.connect(self.path)
+        # readers don't block the writer, and synchronous=NORMAL is safe with WAL
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("PRAGMA synchronous=NORMAL")
+        await self.connection.execute("PRAGMA foreign_keys=ON")
+        await self.connection.executescript(SCHEMA)
+        await self.connection.commit()
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def fetch(self, sql, parameters=()):
+        """Run a query and return all rows."""
+        try:
+            async with self.connection.execute(sql, parameters) as cursor:
+                return await cursor.fetchall()
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    async def write(self, statements):
+        """Run statements in a single transaction.
+
+        Parameters
+        ----------
+        statements : list
+            (sql, parameters) tuples
+        """
+        async with self.lock:
+            try:
+                for sql, parameters in statements:
+                    await self.connection.execute(sql, parameters)
+                await self.connection.commit()
+            except sqlite3.IntegrityError as e:
+                await self.connection.rollback()
+                raise DuplicateKeyError(str(e)) from e
+            except sqlite3.Error as e:
+                await self.connection.rollback()
+                raise StorageError(str(e)) from e
+
+    @staticmethod
+    def where(query):
+        """Translate conditions on indexed columns to SQL.
+
+        Equality on _id, username, a single card or a token and keyset ($gt) conditions on _id or username
+        are selected with indexes, everything else has to be checked on the documents with matches().
+
+        Parameters
+        ----------
+        query : dict
+            conditions users have to match
+        Returns
+        -------
+        conditions : list
+            SQL conditions on the users table
+        parameters : list
+            parameters of the conditions
+        covered : bool
+            True if the conditions are equivalent to the whole query
+        """
+        conditions, parameters = [], []
+        covered = True
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if field in COLUMNS and "$gt" in condition:
+                    conditions.append(f"{COLUMNS[field]} > ?")
+                    parameters.append(str(condition["$gt"]))
+                    covered = covered and len(condition) == 1
+                else:
+                    covered = False
+            elif field == "_id":
+                conditions.append("id = ?")
+                parameters.append(str(condition))
+                covered = covered and isinstance(condition, str)
+            elif field == "username" and isinstance(condition, str):
+                conditions.append("username = ?")
+                parameters.append(condition)
+            elif field == "cards" and isinstance(condition, str):
+                conditions.append(
+                    "id IN (SELECT user_id FROM user_cards WHERE card = ?)"
+                )
+                parameters.append(condition)
+            elif field == "tokens.token" and isinstance(condition, str):
+                conditions.append(
+                    "id IN (SELECT user_id FROM user_tokens WHERE token = ?)"
+                )
+                parameters.append(condition)
+            else:
+                covered = False
+        return conditions, parameters, covered
+
+    async def scan(self, query, sort=None, limit=None):
+        """Stream users matching a query.
+
+        Candidates are selected with indexed columns (see where()) and the rest of the query is checked on the documents.
+
+        Parameters
+        ----------
+        query : dict
+            conditions users have to match
+        sort : str, default=None
+            "_id" or "username" to return users in ascending order of that field
+        limit : int, default=None
+            maximum number of users to return
+        Returns
+        -------
+        users : async iterator
+            user documents
+        """
+        query = query or {}
+        conditions, parameters, _ = self.where(query)
+        sql = "SELECT document FROM users"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if sort is not None:
+            sql += f" ORDER BY {COLUMNS[sort]}"
+        found = 0
+        try:
+            async with self.connection.execute(sql, parameters) as cursor:
+                async for row in cursor:
+                    user = decode(row[0])
+                    if not matches(user, query):
+                        continue
+                    yield user
+                    found += 1
+                    if limit is not None and found >= limit:
+                        break
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    async def first(self, query):
+        """Find the first user matching a query, without reading the rest."""
+        users = [user async for user in self.scan(query, limit=1)]
+        return users[0] if users else None
+
+    def user_statements(self, user):
+        """Statements that save a user along with its card and token lookup rows."""
+        return (
+            [
+                (
+                    "INSERT OR REPLACE INTO users (id, username, document) VALUES (?, ?, ?)",
+                    (user["_id"], user.get("username", None), encode(user)),
+                ),
+                ("DELETE FROM user_cards WHERE user_id = ?", (user["_id"],)),
+                ("DELETE FROM user_tokens WHERE user_id = ?", (user["_id"],)),
+            ]
+            + [
+                (
+                    "INSERT OR IGNORE INTO user_cards (card, user_id) VALUES (?, ?)",
+                    (card, user["_id"]),
+                )
+                for card in user.get("cards", None) or []
+            ]
+            + [
+                (
+                    "INSERT OR REPLACE INTO user_tokens (token, user_id) VALUES (?, ?)",
+                    (token.get("token", ""), user["_id"]),
+                )
+                for token in user.get("tokens", None) or []
+            ]
+        )
+
+    async def find_user(self, query, fields=None):
+        return project(await self.first(query), fields)
+
+    async def find_users(
+        self, query=None, fields=None, sort=None, limit=None, batch_size=None
+    ):
+        async for user in self.scan(query, sort, limit):
+            yield project(user, fields)
+
+    async def count_users(self, query):
+        conditions, parameters, covered = self.where(query or {})
+        if not covered:
+            return len([user async for user in self.scan(query)])
+        sql = "SELECT COUNT(*) FROM users"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        rows = await self.fetch(sql, parameters)
+        return rows[0][0]
+
+    async def insert_users(self, users):
+        documents = [{**user, "_id": new_id()} for user in users]
+        statements = []
+        for document in documents:
+            statements.append(
+                (
+                    "INSERT INTO users (id, username, document) VALUES (?, ?, ?)",
+                    (document["_id"], document.get("username", None), encode(document)),
+                )
+            )
+            statements += self.user_statements(document)[1:]
+        await self.write(statements)
+        for document in documents:
+            self.notify("users", "insert", document["_id"], document)
+        return [document["_id"] for document in documents]
+
+    async def update_user(
+        self, query, set=None, add=None, remove=None, append=None, fields=None
+    ):
+        user = await self.first(query)
+        if user is None or not (set or add or remove or append):
+            return None
+        apply_update(user, set, add, remove, append)
+        statements = self.user_statements(user)
+        # REPLACE would delete the row first and cascade to cards and tokens, UPDATE doesn't
+        statements[0] = (
+            "UPDATE users SET username = ?, document = ? WHERE id = ?",
+            (user.get("username", None), encode(user), user["_id"]),
+        )
+        await self.write(statements)
+        self.notify("users", "update", user["_id"], user)
+        return project(user, fields)
+
+    async def delete_user(self, query):
+        user = await self.first(query)
+        if user is None:
+            return False
+        await self.write([("DELETE FROM users WHERE id = ?", (user["_id"],))])
+        self.notify("users", "delete", user["_id"])
+        return True
+
+    async def get_settings(self, names=None):
+        if names is None:
+            rows = await self.fetch("SELECT document FROM settings")
+        else:
+            names = list(names)
+            placeholders = ", ".join("?" for _ in names)
+            rows = await self.fetch(
+                f"SELECT document FROM settings WHERE setting IN ({placeholders})",
+                names,
+            )
+        documents = [decode(row[0]) for row in rows]
+        return {document["setting"]: document for document in documents}
+
+    async def set_setting(self, name, value, upsert=False, **fields):
+        current = (await self.get_settings([name])).get(name, None)
+        if current is None and not upsert:
+            return
+        document = current or {"_id": new_id(), "setting": name}
+        document.update(fields, value=value)
+        await self.write(
+            [
+                (
+                    "INSERT OR REPLACE INTO settings (setting, document) VALUES (?, ?)",
+                    (name, encode(document)),
+                )
+            ]
+        )
+        self.notify(
+            "settings",
+            "insert" if current is None else "update",
+            document["_id"],
+            document,
+        )
+
+    async def insert(self, collection, documents):
+        documents = [{"_id": new_id(), **document} for document in documents]
+        if collection == "logs":
+            statements = [
+                (
+                    "INSERT INTO logs (timestamp, card, success, during_break, document) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        to_seconds(document.get("timestamp", None)),
+                        document.get("card", None),
+                        int(bool(document.get("success", False))),
+                        int(document.get("auth_mode", None) == "Manufacturer code"),
+                        encode(document),
+                    ),
+                )
+                for document in documents
+            ]
+        else:
+            statements = [
+                (
+                    "INSERT INTO terminal (timestamp, document) VALUES (?, ?)",
+                    (to_seconds(document.get("timestamp", None)), encode(document)),
+                )
+                for document in documents
+            ] + [
+                # keep the table bounded, like the capped terminal collection
+                (
+                    "DELETE FROM terminal WHERE id <= (SELECT MAX(id) FROM terminal) - ?",
+                    (self.terminal_size,),
+                )
+            ]
+        await self.write(statements)
+        if collection == "logs":
+            for document in documents:
+                self.notify("logs", "insert", document["_id"], document)
+        return [document["_id"] for document in documents]
+
+    async def grouped_logs(self, datetime_from, datetime_to, granularity, max_buckets):
+        granularity, buckets = downsample(
+            datetime_from, datetime_to, granularity, max_buckets
+        )
+        rows = await self.fetch(
+            """
+            SELECT MIN(CAST((timestamp - ?) / ? AS INTEGER), ?) AS bucket,
+                COUNT(*), SUM(success), SUM(during_break)
+            FROM logs WHERE timestamp BETWEEN ? AND ?
+            GROUP BY bucket ORDER BY bucket
+            """,
+            (
+                to_seconds(datetime_from),
+                granularity.total_seconds(),
+                buckets - 1,
+                to_seconds(datetime_from),
+                to_seconds(datetime_to),
+            ),
+        )
+
+        async def groups():
+            for bucket, count, successful, during_break in rows:
+                yield {
+                    "_id": bucket,
+                    "count": count,
+                    "successful": successful,
+                    "during_break": during_break,
+                }
+
+        return await fill_buckets(groups(), datetime_from, buckets, granularity)
+
+    async def load_session(self, key):
+        rows = await self.fetch(
+            "SELECT data FROM sessions WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time()),
+        )
+        return rows[0][0] if rows else None
+
+    async def save_session(self, key, data, max_age=None):
+        await self.write(
+            [
+                (
+                    "INSERT OR REPLACE INTO sessions (key, data, expires) VALUES (?, ?, ?)",
+                    (key, data, time() + max_age if max_age is not None else None),
+                ),
+                ("DELETE FROM sessions WHERE expires < ?", (time(),)),
+            ]
+        )
@@ -0,0 +1,201 @@
+"""Compact allowlist uploaded to the arduino, so that it can open the door without asking.
+
+The allowlist is a sorted list of 32 bit FNV-1a hashes of raw UID bytes, sent as hexadecimal chunks::
+
+    LIST FULL <version> <count>         start a new list
+    LIST DIFF <base version> <version>  modify the list the device has with base version
+    LIST ADD <hashes>                   add up to CHUNK_SIZE hashes (8 hex digits each)
+    LIST DEL <hashes>                   remove up to CHUNK_SIZE hashes
+    LIST END <version> <checksum>       CRC-16/CCITT of the whole sorted list (4 bytes per hash, big endian)
+
+The device answers ``LISTOK <version>`` if the checksum of its list matches, or ``LISTERR <version>``
+if it doesn't (or the base version is wrong), in which case the whole list is sent again.
+Cards the device decided on by itself are reported with ``ENTRY <0|1>:<block0>``.
+"""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import logging
+from binascii import crc_hqx
+
+FNV_OFFSET = 0x811C9DC5
+FNV_PRIME = 0x01000193
+# 5 hashes fit in a single 64 byte arduino serial buffer, even when framed
+CHUNK_SIZE = 5
+MAX_VERSION = 0xFFFF
+
+
+def uid_hash(uid):
+    """Calculate 32 bit FNV-1a hash of a UID.
+
+    Parameters
+    ----------
+    uid : str
+        UID of the card (hexadecimal)
+    Returns
+    -------
+    hash : int or None
+        hash of raw UID bytes, None if the UID isn't valid
+    """
+    try:
+        raw = bytes.fromhex(str(uid))
+    except ValueError:
+        return None
+    if not raw:
+        return None
+    value = FNV_OFFSET
+    for byte in raw:
+        value = ((value ^ byte) * FNV_PRIME) & 0xFFFFFFFF
+    return value
+
+
+def list_checksum(hashes):
+    """Calculate checksum of a sorted list of hashes.
+
+    Parameters
+    ----------
+    hashes : list
+        sorted hashes
+    Returns
+    -------
+    crc : int
+        CRC-16/CCITT of hashes as 4 byte big endian integers
+    """
+    return crc_hqx(b"".join(value.to_bytes(4, "big") for value in hashes), 0xFFFF)
+
+
+def chunks(command, hashes):
+    """Split hashes into LIST ADD/DEL lines.
+
+    Parameters
+    ----------
+    command : str
+        "ADD" or "DEL"
+    hashes : list
+        sorted hashes
+    Returns
+    -------
+    lines : list
+        lines with up to CHUNK_SIZE hashes each
+    """
+    return [
+        f"LIST {command} "
+        + "".join(f"{value:08X}" for value in hashes[offset : offset + CHUNK_SIZE])
+        for offset in range(0, len(hashes), CHUNK_SIZE)
+    ]
+
+
+class DeviceAllowlist:
+    """Allowlist state of a single device and the commands needed to update it."""
+
+    def __init__(self, max_cards=256):
+        """Initialize an unknown device state.
+
+        Parameters
+        ----------
+        max_cards : int, default=256
+            maximum number of cards the device can store (4 bytes of RAM each)
+        """
+        self.max_cards = max_cards
+        self.logger = logging.getLogger("DEVICE_ALLOWLIST")
+        # version and hashes the device confirmed, None if unknown
+        self.version = 0
+        self.hashes = None
+        self.pending = None
+        self.full_uploads = 0
+        self.diff_uploads = 0
+        self.lines = 0
+        self.rejections = 0
+
+    def commands(self, uids):
+        """Create commands that bring the device's list up to date.
+
+        Parameters
+        ----------
+        uids : iterable
+            UIDs of all allowed cards (hexadecimal)
+        Returns
+        -------
+        version : int or None
+            version of the new list, None if there is nothing to upload
+        lines : list
+            commands to send
+        """
+        hashes = {value for value in map(uid_hash, uids) if value is not None}
+        if len(hashes) > self.max_cards:
+            self.logger.warning(
+                "%s allowed cards don't fit in the device (max %s), clearing its list",
+                len(hashes),
+                self.max_cards,
+            )
+            # the device can't authorize everyone, so it has to ask about every card
+            hashes = set()
+        if self.hashes is not None and hashes == self.hashes:
+            return None, []
+        version = self.version % MAX_VERSION + 1
+        added = sorted(hashes - (self.hashes or set()))
+        removed = sorted((self.hashes or set()) - hashes)
+        if self.hashes is None or len(added) + len(removed) >= len(hashes):
+            lines = [f"LIST FULL {version} {len(hashes)}"] + chunks(
+                "ADD", sorted(hashes)
+            )
+            self.full_uploads += 1
+        else:
+            lines = (
+                [f"LIST DIFF {self.version} {version}"]
+                + chunks("DEL", removed)
+                + chunks("ADD", added)
+            )
+            self.diff_uploads += 1
+        lines.append(f"LIST END {version} {list_checksum(sorted(hashes)):04X}")
+        self.lines += len(lines)
+        self.pending = (version, hashes)
+        return version, lines
+
+    def confirm(self, version):
+        """Mark an uploaded list as received by the device.
+
+        Parameters
+        ----------
+        version : int
+            version confirmed by the device
+        Returns
+        -------
+        bool
+            True if it's the version that was being uploaded
+        """
+        if self.pending is None or self.pending[0] != version:
+            return False
+        self.version, self.hashes = self.pending
+        self.pending = None
+        return True
+
+    def invalidate(self):
+        """Forget what the device has, so that the next upload is a full one."""
+        self.hashes = None
+        self.pending = None
+
+    def reject(self):
+        """Handle a list the device couldn't apply."""
+        self.rejections += 1
+        self.invalidate()
+
+    def stats(self):
+        """Return upload metrics.
+
+        Returns
+        -------
+        stats : dict
+            confirmed version and number of cards, number of full and diff uploads, lines sent and rejections
+        """
+        return {
+            "version": self.version,
+            "cards": None if self.hashes is None else len(self.hashes),
+            "full_uploads": self.full_uploads,
+            "diff_uploads": self.diff_uploads,
+            "lines": self.lines,
+            "rejections": self.rejections,
+        }
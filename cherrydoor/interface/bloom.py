@@ -0,0 +1,120 @@
+"""Counting Bloom filter for fast negative lookups."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+from hashlib import blake2b
+from math import ceil, exp, log
+
+MAX_COUNT = 255
+
+
+class CountingBloomFilter:
+    """Bloom filter with 8 bit counters instead of bits, so that items can also be removed.
+
+    A negative answer is always correct, a positive one is wrong with probability false_positive_rate().
+    """
+
+    def __init__(self, capacity=1024, error_rate=0.01):
+        """Allocate counters for the expected number of items.
+
+        Parameters
+        ----------
+        capacity : int, default=1024
+            expected number of items
+        error_rate : float, default=0.01
+            expected false positive rate at full capacity
+        """
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, ceil(-self.capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * log(2)))
+        self.counters = bytearray(self.size)
+        self.count = 0
+
+    def positions(self, item):
+        """Calculate counter positions of an item using double hashing.
+
+        Parameters
+        ----------
+        item : str
+            item to hash
+        Returns
+        -------
+        positions : generator
+            indexes of counters for the item
+        """
+        digest = blake2b(str(item).encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        """Add an item.
+
+        Parameters
+        ----------
+        item : str
+            item to add
+        """
+        for position in self.positions(item):
+            if self.counters[position] < MAX_COUNT:
+                self.counters[position] += 1
+        self.count += 1
+
+    def remove(self, item):
+        """Remove an item that was previously added.
+
+        Parameters
+        ----------
+        item : str
+            item to remove
+        """
+        for position in self.positions(item):
+            # saturated counters are never decremented, as they may be shared by more items than they can count
+            if 0 < self.counters[position] < MAX_COUNT:
+                self.counters[position] -= 1
+        self.count = max(0, self.count - 1)
+
+    def __contains__(self, item):
+        """Check if an item may have been added.
+
+        Parameters
+        ----------
+        item : str
+            item to check
+        Returns
+        -------
+        bool
+            False if the item definitely wasn't added, True if it probably was
+        """
+        return all(self.counters[position] for position in self.positions(item))
+
+    def false_positive_rate(self):
+        """Estimate the current false positive rate.
+
+        Returns
+        -------
+        rate : float
+            probability that an item that wasn't added is reported as present
+        """
+        return (1 - exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self):
+        """Return filter metrics.
+
+        Returns
+        -------
+        stats : dict
+            number of items, capacity, number of hash functions, memory used by counters in bytes
+            and estimated false positive rate
+        """
+        return {
+            "items": self.count,
+            "capacity": self.capacity,
+            "hashes": self.hashes,
+            "memory": len(self.counters),
+            "false_positive_rate": self.false_positive_rate(),
+        }
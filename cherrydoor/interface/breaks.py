@@ -0,0 +1,115 @@
+"""Break schedule compiled into minute-of-day transitions."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+MINUTES_IN_DAY = 24 * 60
+
+
+def minute_of_day(time):
+    """Convert a time to the number of minutes since midnight.
+
+    Parameters
+    ----------
+    time : datetime.datetime or str
+        datetime (only hour and minute are used) or a "HH:MM" string
+    Returns
+    -------
+    minute : int
+        minutes since midnight
+    """
+    if isinstance(time, str):
+        return int(time[:2]) * 60 + int(time[3:5])
+    return time.hour * 60 + time.minute
+
+
+class BreakSchedule:
+    """Sorted array of minutes of the day at which a break starts or ends.
+
+    Breaks are merged into disjoint [start, end) intervals, so a break is active
+    when an odd number of transitions happened since midnight.
+    """
+
+    def __init__(self, break_times=None):
+        """Compile initial break times.
+
+        Parameters
+        ----------
+        break_times : list, default=None
+            list of dicts with "from" and "to" keys
+        """
+        self.transitions = []
+        self.compile(break_times or [])
+
+    def compile(self, break_times):
+        """Replace the schedule with new break times.
+
+        Parameters
+        ----------
+        break_times : list
+            list of dicts with "from" and "to" keys (datetimes or "HH:MM" strings)
+        """
+        intervals = []
+        for break_time in break_times:
+            try:
+                start = minute_of_day(break_time["from"])
+                end = minute_of_day(break_time["to"])
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            if start < end:
+                intervals.append((start, end))
+            elif start > end:
+                # break that goes over midnight
+                intervals.append((start, MINUTES_IN_DAY))
+                intervals.append((0, end))
+        intervals.sort()
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.transitions = [minute for interval in merged for minute in interval]
+
+    def is_break(self, time=None):
+        """Check if there is a break at a given time.
+
+        Parameters
+        ----------
+        time : datetime.datetime, default=None
+            time to check, now if None
+        Returns
+        -------
+        bool
+            True if it's a break, False otherwise
+        """
+        if time is None:
+            time = datetime.now()
+        return bisect_right(self.transitions, minute_of_day(time)) % 2 == 1
+
+    def next_transition(self, time=None):
+        """Find the time of the next break start or end.
+
+        Parameters
+        ----------
+        time : datetime.datetime, default=None
+            time to search from, now if None
+        Returns
+        -------
+        datetime.datetime or None
+            time of the next transition or None if there are no breaks
+        """
+        if not self.transitions:
+            return None
+        if time is None:
+            time = datetime.now()
+        midnight = time.replace(hour=0, minute=0, second=0, microsecond=0)
+        index = bisect_right(self.transitions, minute_of_day(time))
+        if index < len(self.transitions):
+            return midnight + timedelta(minutes=self.transitions[index])
+        return midnight + timedelta(days=1, minutes=self.transitions[0])
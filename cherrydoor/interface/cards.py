@@ -0,0 +1,266 @@
+"""In-memory card authorization index."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+from time import monotonic
+
+from pymongo.errors import PyMongoError
+
+from cherrydoor.interface.bloom import CountingBloomFilter
+
+ENTER_PERMISSIONS = ["admin", "enter"]
+
+
+class CardIndex:
+    """Process-local map of card UIDs to authorization decisions.
+
+    The index is loaded from the users collection once and then kept in sync by a change stream,
+    so that authenticating a card is just a dictionary lookup instead of a database query.
+    A Bloom filter of all registered cards is kept alongside it, so that unknown cards can still be rejected
+    without a query for a while after the change stream fails.
+    """
+
+    def __init__(self, permissions=None, error_rate=0.01):
+        """Initialize empty index and counters.
+
+        Parameters
+        ----------
+        permissions : list, default=["admin", "enter"]
+            permissions that allow the user to enter
+        error_rate : float, default=0.01
+            target false positive rate of the registered cards Bloom filter
+        """
+        self.permissions = set(permissions or ENTER_PERMISSIONS)
+        self.error_rate = error_rate
+        self.registered = CountingBloomFilter(error_rate=error_rate)
+        self.bloom_rejections = 0
+        self.logger = logging.getLogger("CARD_INDEX")
+        # user _id -> (cards, allowed)
+        self.users = {}
+        # card uid -> set of _id of users that have that card and are allowed to enter
+        self.allowed = {}
+        self.ready = False
+        self.last_sync = None
+        # when the change stream failed - the index was in sync until then
+        self.out_of_sync_since = None
+        # incremented on every change, so copies of the index know when to update
+        self.version = 0
+        # set (and immediately cleared) on every change, so consumers can wait for one
+        self.changed = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.change_stream = None
+
+    def lookup(self, uid):
+        """Check whether a card is allowed to enter.
+
+        Parameters
+        ----------
+        uid : str
+            UID of the card (hexadecimal)
+        Returns
+        -------
+        bool or None
+            True if the card is allowed, False if it isn't and None if the index isn't in sync with the database
+        """
+        if not self.ready:
+            self.stale += 1
+            return None
+        if self.allowed.get(str(uid)):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def definitely_unknown(self, uid, max_staleness=300):
+        """Check if a card is certainly not registered, without querying the database.
+
+        Used when the index is out of sync - the Bloom filter is trusted for max_staleness seconds after the change stream
+        failed, so a card registered during that time may be rejected until the index is back in sync.
+
+        Parameters
+        ----------
+        uid : str
+            UID of the card (hexadecimal)
+        max_staleness : float, default=300
+            number of seconds since the change stream failed after which the filter is no longer used
+        Returns
+        -------
+        bool
+            True if the card isn't registered, False if it may be or the filter is too old
+        """
+        if self.last_sync is None:
+            return False
+        if (
+            self.out_of_sync_since is not None
+            and monotonic() - self.out_of_sync_since > max_staleness
+        ):
+            return False
+        if str(uid) in self.registered:
+            return False
+        self.bloom_rejections += 1
+        return True
+
+    def rebuild_filter(self, additional=0):
+        """Rebuild the Bloom filter with twice the capacity needed for currently indexed cards.
+
+        Parameters
+        ----------
+        additional : int, default=0
+            number of cards that are about to be added
+        """
+        cards = [card for user_cards, _ in self.users.values() for card in user_cards]
+        self.registered = CountingBloomFilter(
+            capacity=max(1024, 2 * (len(cards) + additional)),
+            error_rate=self.error_rate,
+        )
+        for card in cards:
+            self.registered.add(card)
+
+    def update_user(self, user):
+        """Add or replace a single user in the index.
+
+        Parameters
+        ----------
+        user : dict
+            user document with at least _id, and optionally cards and permissions
+        """
+        user_id = user["_id"]
+        self.remove_user(user_id)
+        cards = [str(card) for card in user.get("cards", None) or []]
+        allowed = bool(self.permissions & set(user.get("permissions", None) or []))
+        if self.registered.count + len(cards) > self.registered.capacity:
+            self.rebuild_filter(len(cards))
+        self.users[user_id] = (cards, allowed)
+        for card in cards:
+            self.registered.add(card)
+        if allowed:
+            for card in cards:
+                self.allowed.setdefault(card, set()).add(user_id)
+
+    def remove_user(self, user_id):
+        """Remove a user from the index.
+
+        Parameters
+        ----------
+        user_id : bson.ObjectId
+            _id of the user document
+        """
+        cards, allowed = self.users.pop(user_id, ([], False))
+        for card in cards:
+            self.registered.remove(card)
+        if not allowed:
+            return
+        for card in cards:
+            owners = self.allowed.get(card, set())
+            owners.discard(user_id)
+            if not owners:
+                self.allowed.pop(card, None)
+
+    async def load(self, storage):
+        """Rebuild the whole index from the database.
+
+        Parameters
+        ----------
+        storage : cherrydoor.database.Storage
+            storage engine to load users from
+        """
+        self.users = {}
+        self.allowed = {}
+        self.registered = CountingBloomFilter(error_rate=self.error_rate)
+        async for user in storage.find_users({}, ["_id", "cards", "permissions"]):
+            self.update_user(user)
+        self.ready = True
+        self.out_of_sync_since = None
+        self.version += 1
+        self.last_sync = monotonic()
+        self.changed.set()
+        self.changed.clear()
+        self.logger.debug("loaded %s cards allowed to enter", len(self.allowed))
+
+    async def listen(self, storage, retry_delay=5):
+        """Load the index and keep it in sync with the users collection.
+
+        Parameters
+        ----------
+        storage : cherrydoor.database.Storage
+            storage engine to watch
+        retry_delay : int, default=5
+            seconds to wait before reloading the index after the change stream failed
+        """
+        while True:
+            try:
+                async with storage.watch("users") as self.change_stream:
+                    # load after opening the stream so that no change is missed in between
+                    await self.load(storage)
+                    async for change in self.change_stream:
+                        self.apply_change(change)
+            except PyMongoError as e:
+                self.ready = False
+                # the index was up to date while the stream was open, so staleness is counted from the first failure
+                if self.out_of_sync_since is None:
+                    self.out_of_sync_since = monotonic()
+                self.logger.warning(
+                    "users change stream failed, using database until it's restored. Exception: %s",
+                    str(e),
+                )
+                await asyncio.sleep(retry_delay)
+
+    def apply_change(self, change):
+        """Apply a single change stream event to the index.
+
+        Parameters
+        ----------
+        change : dict
+            change stream event from the users collection
+        """
+        user_id = change.get("documentKey", {}).get("_id", None)
+        document = change.get("fullDocument", None)
+        if change.get("operationType", "") == "delete" or document is None:
+            self.remove_user(user_id)
+        else:
+            self.update_user(document)
+        self.version += 1
+        self.last_sync = monotonic()
+        self.changed.set()
+        self.changed.clear()
+
+    async def close(self):
+        """Close the change stream and mark the index as out of sync."""
+        self.ready = False
+        if self.out_of_sync_since is None:
+            self.out_of_sync_since = monotonic()
+        if self.change_stream is not None:
+            await self.change_stream.close()
+
+    def stats(self):
+        """Return index size and lookup counters.
+
+        Returns
+        -------
+        stats : dict
+            dictionary with hit, miss and stale lookup counts, number of indexed cards, seconds since last sync
+            and seconds since the index went out of sync
+        """
+        return {
+            "ready": self.ready,
+            "cards": len(self.allowed),
+            "users": len(self.users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "bloom_rejections": self.bloom_rejections,
+            "bloom_filter": self.registered.stats(),
+            "since_sync": None
+            if self.last_sync is None
+            else monotonic() - self.last_sync,
+            "out_of_sync_for": None
+            if self.out_of_sync_since is None
+            else monotonic() - self.out_of_sync_since,
+        }
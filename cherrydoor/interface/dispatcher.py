@@ -0,0 +1,154 @@
+"""Dispatching of commands received over serial connection."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+from time import monotonic
+
+
+class CommandMetrics:
+    """Counters for queue and handler time of a single command."""
+
+    def __init__(self):
+        """Initialize counters."""
+        self.count = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.handler_time = 0.0
+        self.max_handler_time = 0.0
+        self.errors = 0
+
+    def record(self, queue_time, handler_time):
+        """Record a processed command.
+
+        Parameters
+        ----------
+        queue_time : float
+            seconds the command waited before being handled
+        handler_time : float
+            seconds the handler took
+        """
+        self.count += 1
+        self.queue_time += queue_time
+        self.handler_time += handler_time
+        self.max_queue_time = max(self.max_queue_time, queue_time)
+        self.max_handler_time = max(self.max_handler_time, handler_time)
+
+    def as_dict(self):
+        """Return counters with averages.
+
+        Returns
+        -------
+        metrics : dict
+            count, errors, average and max queue and handler times in seconds
+        """
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_queue_time": self.queue_time / self.count if self.count else 0.0,
+            "max_queue_time": self.max_queue_time,
+            "avg_handler_time": self.handler_time / self.count if self.count else 0.0,
+            "max_handler_time": self.max_handler_time,
+        }
+
+
+class CommandDispatcher:
+    """Route commands either to an ordered worker or handle them inline.
+
+    Commands that may be slow (for example CARD, that requires authentication) go through a queue processed
+    by a single worker, so they're handled in order without blocking the serial reader.
+    All other commands are quick status updates and are handled immediately.
+    """
+
+    def __init__(self, handlers, queued=("CARD",), max_queued=100):
+        """Initialize the dispatcher.
+
+        Parameters
+        ----------
+        handlers : dict
+            mapping of command names to coroutine functions taking a single argument
+        queued : iterable, default=("CARD",)
+            commands that are handled by the worker
+        max_queued : int, default=100
+            number of queued commands after which the reader waits for the worker
+        """
+        self.handlers = handlers
+        self.queued = set(queued)
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.metrics = {}
+        self.logger = logging.getLogger("SERIAL_DISPATCHER")
+
+    async def dispatch(self, command, argument=None):
+        """Handle or queue a single command.
+
+        Parameters
+        ----------
+        command : str
+            name of the command
+        argument : str, default=None
+            argument of the command
+        Returns
+        -------
+        bool
+            True if there is a handler for the command, False otherwise
+        """
+        if command not in self.handlers:
+            return False
+        if command in self.queued:
+            await self.queue.put((command, argument, monotonic()))
+        else:
+            await self.handle(command, argument, monotonic())
+        return True
+
+    async def run(self):
+        """Process queued commands one by one."""
+        while True:
+            command, argument, received = await self.queue.get()
+            try:
+                await self.handle(command, argument, received)
+            finally:
+                self.queue.task_done()
+
+    async def handle(self, command, argument, received):
+        """Run the handler of a command and record its metrics.
+
+        Parameters
+        ----------
+        command : str
+            name of the command
+        argument : str
+            argument of the command
+        received : float
+            monotonic time the command was received at
+        """
+        metrics = self.metrics.setdefault(command, CommandMetrics())
+        start = monotonic()
+        try:
+            await self.handlers[command](argument)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            metrics.errors += 1
+            self.logger.exception(
+                "error while handling %s %s. Exception: %s", command, argument, e
+            )
+        metrics.record(start - received, monotonic() - start)
+
+    def stats(self):
+        """Return dispatcher metrics.
+
+        Returns
+        -------
+        stats : dict
+            queue depth and per-command metrics
+        """
+        return {
+            "queued": self.queue.qsize(),
+            "commands": {
+                command: metrics.as_dict() for command, metrics in self.metrics.items()
+            },
+        }
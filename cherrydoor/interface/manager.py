@@ -0,0 +1,241 @@
+"""Management of multiple card readers (doors) in a single event loop."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+
+from cherrydoor.interface.serial import Serial, get_config
+
+# keys of a door config that override the interface section
+INTERFACE_OVERRIDES = ["port", "baudrate", "backend", "framed"]
+# keys of a door config that override settings from the database
+SETTING_OVERRIDES = ["delay", "break_times"]
+
+
+class ReaderManager:
+    """Set of serial interfaces, one for each door.
+
+    The first door is the primary one - all other doors share its card index, allowlist snapshot and log writers,
+    so there is a single users change stream and a single batch writer no matter how many doors there are.
+    If no doors are configured, a single door is created from the interface section of the config.
+    """
+
+    def __init__(self, storage=None, loop=None, config=None):
+        """Create a Serial for every configured door.
+
+        Parameters
+        ----------
+        storage : cherrydoor.database.Storage
+            storage engine to use
+        loop : asyncio.EventLoop
+            event loop
+        config : AttrDict
+            app configuration
+        """
+        if config is None:
+            config = get_config()
+        self.config = config
+        self.logger = logging.getLogger("READER_MANAGER")
+        self.doors = {}
+        primary = None
+        for door in config.get("doors", None) or [{"id": None}]:
+            interface = Serial(
+                storage,
+                loop,
+                self.door_config(door),
+                door_id=door.get("id", None),
+                settings=self.door_settings(door),
+                primary=primary,
+            )
+            if primary is None:
+                primary = interface
+            self.doors[interface.door_id] = interface
+        self.primary = primary
+
+    def door_config(self, door):
+        """Create config of a single door by overriding the app config with values set for the door.
+
+        Parameters
+        ----------
+        door : dict
+            door config
+        Returns
+        -------
+        config : dict
+            config used by the door's Serial
+        """
+        config = dict(self.config)
+        config["interface"] = dict(self.config.get("interface", {}))
+        for key in INTERFACE_OVERRIDES:
+            if door.get(key, None) is not None:
+                config["interface"][key] = door[key]
+        for key in ["manufacturer_code", "reset_pin"]:
+            if door.get(key, None):
+                config[key] = door[key]
+        return config
+
+    @staticmethod
+    def door_settings(door):
+        """Get settings that are set for a door instead of loaded from the database.
+
+        Parameters
+        ----------
+        door : dict
+            door config
+        Returns
+        -------
+        settings : dict
+            setting name -> value
+        """
+        return {
+            setting: door[setting]
+            for setting in SETTING_OVERRIDES
+            # an empty list of break times means the global ones are used
+            if door.get(setting, None) not in [None, []]
+        }
+
+    def get(self, door_id=None):
+        """Get the interface of a door.
+
+        Parameters
+        ----------
+        door_id : str, default=None
+            id of the door, the primary door if None
+        Returns
+        -------
+        interface : Serial
+            the door's interface
+        Raises
+        ------
+        KeyError
+            if there is no door with that id
+        """
+        if door_id is None:
+            return self.primary
+        return self.doors[door_id]
+
+    def __iter__(self):
+        """Iterate over interfaces of all doors."""
+        return iter(self.doors.values())
+
+    def __len__(self):
+        """Return the number of doors."""
+        return len(self.doors)
+
+    async def aiohttp_startup(self, app):
+        """Queue up creation of all tasks required for serial comunication on all doors.
+
+        Parameters
+        ----------
+        app : web.Application
+            application instance
+        """
+        app["create_aiohttp_tasks"] = asyncio.create_task(
+            self.create_aiohttp_tasks(app)
+        )
+
+    async def create_aiohttp_tasks(self, app):
+        """Start all doors, the primary one first so that its shared resources exist.
+
+        Parameters
+        ----------
+        app : web.Application
+            application instance
+        """
+        await self.primary.create_aiohttp_tasks(app)
+        await asyncio.gather(
+            *[
+                interface.create_aiohttp_tasks(app)
+                for interface in self
+                if interface is not self.primary
+            ]
+        )
+        self.logger.info("started %s doors", len(self))
+
+    async def cleanup(self, app=None):
+        """Clean up all doors, the primary one last, as it closes shared resources.
+
+        Parameters
+        ----------
+        app : web.Application
+            application instance
+        """
+        for interface in self:
+            if interface is not self.primary:
+                await interface.cleanup(app)
+        await self.primary.cleanup(app)
+
+    async def wait_for_door_change(self, timeout=None):
+        """Wait until status of any door changes.
+
+        Parameters
+        ----------
+        timeout : float, default=None
+            maximum number of seconds to wait, None to wait indefinitely
+        Returns
+        -------
+        changed : bool
+            True if status of a door changed, False if timeout passed
+        """
+        waiters = [
+            asyncio.ensure_future(interface.door_event.wait()) for interface in self
+        ]
+        done, pending = await asyncio.wait(
+            waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        for waiter in pending:
+            waiter.cancel()
+        return bool(done)
+
+    async def wait_for_card(self, door_id=None, timeout=None):
+        """Wait until a card is read by a reader.
+
+        Parameters
+        ----------
+        door_id : str, default=None
+            id of the door to wait for, any door if None
+        timeout : float, default=None
+            maximum number of seconds to wait, None to wait indefinitely
+        Returns
+        -------
+        card : tuple or None
+            id of the door and UID of the card, None if timeout passed
+        Raises
+        ------
+        KeyError
+            if there is no door with that id
+        """
+        interfaces = list(self) if door_id is None else [self.doors[door_id]]
+        waiters = {
+            asyncio.ensure_future(interface.card_event.wait()): interface
+            for interface in interfaces
+        }
+        done, pending = await asyncio.wait(
+            waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        for waiter in pending:
+            waiter.cancel()
+        if not done:
+            return None
+        interface = waiters[next(iter(done))]
+        return interface.door_id, interface.last_uid
+
+    def status(self):
+        """Return status of all doors.
+
+        Returns
+        -------
+        status : dict
+            door id -> dict with "open" and "break" keys
+        """
+        return {
+            interface.door_id: {
+                "open": bool(interface.door_open),
+                "break": bool(interface.is_break),
+            }
+            for interface in self
+        }
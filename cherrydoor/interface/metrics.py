@@ -0,0 +1,174 @@
+"""In-memory latency histograms for card swipes."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+
+# upper bounds of histogram buckets in milliseconds
+DEFAULT_BUCKETS = [
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+]
+
+SWIPE_STAGES = ["extract_uid", "auth_required", "authenticate", "delay", "write"]
+
+
+class Histogram:
+    """Latency histogram with fixed bucket boundaries."""
+
+    def __init__(self, buckets=None):
+        """Initialize empty buckets.
+
+        Parameters
+        ----------
+        buckets : list, default=DEFAULT_BUCKETS
+            sorted upper bounds of buckets in milliseconds, an overflow bucket is added automatically
+        """
+        self.buckets = list(buckets or DEFAULT_BUCKETS)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, milliseconds):
+        """Record a single value.
+
+        Parameters
+        ----------
+        milliseconds : float
+            measured time in milliseconds
+        """
+        self.counts[bisect_left(self.buckets, milliseconds)] += 1
+        self.count += 1
+        self.sum += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, percent):
+        """Estimate a percentile by interpolating inside the bucket it falls in.
+
+        Parameters
+        ----------
+        percent : float
+            percentile to estimate (0-100)
+        Returns
+        -------
+        value : float or None
+            estimated value in milliseconds, None if nothing was recorded
+        """
+        if self.count == 0:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def as_dict(self):
+        """Return a summary of the histogram.
+
+        Returns
+        -------
+        summary : dict
+            count, mean, max and p50/p95/p99 in milliseconds along with raw bucket counts
+        """
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {
+                **{
+                    str(bound): count for bound, count in zip(self.buckets, self.counts)
+                },
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+class SwipeMetrics:
+    """Per-stage swipe timings and a window of recent swipes."""
+
+    def __init__(self, stages=None, recent=100, slowest=10):
+        """Create a histogram for every stage.
+
+        Parameters
+        ----------
+        stages : list, default=SWIPE_STAGES
+            names of the measured stages
+        recent : int, default=100
+            number of recent swipes kept
+        slowest : int, default=10
+            number of the slowest recent swipes reported
+        """
+        self.stages = {stage: Histogram() for stage in (stages or SWIPE_STAGES)}
+        self.total = Histogram()
+        self.recent = deque(maxlen=recent)
+        self.slowest = slowest
+
+    def record(self, timings, **details):
+        """Record timings of a single swipe.
+
+        Parameters
+        ----------
+        timings : dict
+            mapping of stage names to durations in seconds
+        **details : dict
+            additional information stored with the swipe (for example uid and result)
+        """
+        total = 0.0
+        for stage, seconds in timings.items():
+            milliseconds = seconds * 1000
+            total += milliseconds
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].record(milliseconds)
+        self.total.record(total)
+        self.recent.append(
+            {
+                "timestamp": datetime.now().isoformat(),
+                "total": total,
+                "stages": {stage: seconds * 1000 for stage, seconds in timings.items()},
+                **details,
+            }
+        )
+
+    def as_dict(self):
+        """Return all histograms and the slowest recent swipes.
+
+        Returns
+        -------
+        metrics : dict
+            total and per-stage histogram summaries and slowest recent swipes (times in milliseconds)
+        """
+        return {
+            "total": self.total.as_dict(),
+            "stages": {stage: hist.as_dict() for stage, hist in self.stages.items()},
+            "slowest": sorted(self.recent, key=lambda swipe: swipe["total"])[
+                -self.slowest :
+            ][::-1],
+        }
@@ -0,0 +1,164 @@
+"""Offline authorization from a local snapshot of allowed cards."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import logging
+import mmap
+import os
+import struct
+
+MAGIC = b"CDAL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHI")
+MAX_UID_LENGTH = 10
+# 1 byte for UID length + UID padded with zeroes
+RECORD_SIZE = 1 + MAX_UID_LENGTH
+
+
+def encode_uid(uid):
+    """Encode a UID as a fixed-size, sortable record.
+
+    Parameters
+    ----------
+    uid : str
+        UID of the card (hexadecimal)
+    Returns
+    -------
+    record : bytes or None
+        encoded UID, None if the UID isn't valid
+    """
+    try:
+        raw = bytes.fromhex(str(uid))
+    except ValueError:
+        return None
+    if not raw or len(raw) > MAX_UID_LENGTH:
+        return None
+    return bytes([len(raw)]) + raw.ljust(MAX_UID_LENGTH, b"\0")
+
+
+class AllowlistSnapshot:
+    """Sorted binary file with UIDs of allowed cards, searched through a memory map.
+
+    The file consists of a header (magic, format version, number of records) followed by sorted fixed-size records.
+    """
+
+    def __init__(self, path):
+        """Initialize the snapshot.
+
+        Parameters
+        ----------
+        path : str
+            path of the snapshot file
+        """
+        self.path = path
+        self.logger = logging.getLogger("ALLOWLIST_SNAPSHOT")
+        self.file = None
+        self.map = None
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, uids):
+        """Atomically replace the snapshot with a new set of UIDs and load it.
+
+        Parameters
+        ----------
+        uids : iterable
+            UIDs of all allowed cards (hexadecimal)
+        """
+        self.save(uids)
+        self.load()
+
+    def save(self, uids):
+        """Atomically replace the snapshot file with a new set of UIDs, without loading it.
+
+        Doesn't touch the loaded snapshot, so it's safe to call from another thread while cards are being checked.
+
+        Parameters
+        ----------
+        uids : iterable
+            UIDs of all allowed cards (hexadecimal)
+        """
+        records = sorted(
+            {record for record in map(encode_uid, uids) if record is not None}
+        )
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(records)))
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def load(self):
+        """Memory-map the snapshot file.
+
+        Returns
+        -------
+        bool
+            True if a valid snapshot was loaded, False otherwise
+        """
+        self.close()
+        try:
+            self.file = open(self.path, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self.logger.warning("unable to load snapshot %s - %s", self.path, e)
+            self.close()
+            return False
+        if len(self.map) < HEADER.size:
+            self.close()
+            return False
+        magic, version, count = HEADER.unpack_from(self.map, 0)
+        if (
+            magic != MAGIC
+            or version != FORMAT_VERSION
+            or len(self.map) < HEADER.size + count * RECORD_SIZE
+        ):
+            self.logger.warning("invalid snapshot file %s", self.path)
+            self.close()
+            return False
+        self.count = count
+        return True
+
+    def close(self):
+        """Unmap and close the snapshot file."""
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+        self.map = None
+        self.file = None
+        self.count = 0
+
+    def __contains__(self, uid):
+        """Check if a UID is in the snapshot using binary search.
+
+        Parameters
+        ----------
+        uid : str
+            UID of the card (hexadecimal)
+        Returns
+        -------
+        bool
+            True if the card is allowed, False otherwise
+        """
+        if self.map is None and not self.load():
+            return False
+        record = encode_uid(uid)
+        if record is None:
+            return False
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD_SIZE
+            current = self.map[offset : offset + RECORD_SIZE]
+            if current < record:
+                low = middle + 1
+            elif current > record:
+                high = middle
+            else:
+                return True
+        return False
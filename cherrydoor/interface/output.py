@@ -0,0 +1,193 @@
+"""Prioritized single-writer queue for the serial connection."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import itertools
+import logging
+from time import monotonic
+
+from cherrydoor.interface.metrics import Histogram
+from cherrydoor.interface.protocol import FRAME_START
+
+# lower number is written first
+PRIORITIES = {"ACK": 0, "NAK": 0, "AUTH": 0, "NTFY": 1, "PING": 3}
+DEFAULT_PRIORITY = 2
+
+
+def priority(line):
+    """Get the priority of a line based on its command.
+
+    Parameters
+    ----------
+    line : str
+        plain-text or framed command
+    Returns
+    -------
+    priority : int
+        priority of the line, lower is more urgent
+    """
+    if line.startswith(FRAME_START):
+        # skip "@SS " of a framed command
+        line = line[4:]
+    return PRIORITIES.get(line.split(" ", 1)[0], DEFAULT_PRIORITY)
+
+
+class OutputQueue:
+    """Queue of lines written to the serial connection by a single task.
+
+    Lines are written in order of priority (AUTH before NTFY before PING), and lines of the same priority
+    in the order they were queued. Everything that's waiting when the writer wakes up is coalesced into one write.
+    """
+
+    def __init__(self, write, on_error=None, encoding="utf-8", max_batch=1024):
+        """Initialize the queue.
+
+        Parameters
+        ----------
+        write : coroutine function
+            function writing bytes to the serial connection
+        on_error : coroutine function, default=None
+            called with the exception after a write failed, for example to reconnect
+        encoding : str, default="utf-8"
+            encoding of written lines
+        max_batch : int, default=1024
+            maximum number of bytes written at once
+        """
+        self.write = write
+        self.on_error = on_error
+        self.encoding = encoding
+        self.max_batch = max_batch
+        self.queue = asyncio.PriorityQueue()
+        # keeps lines of the same priority in order
+        self.counter = itertools.count()
+        self.task = None
+        self.logger = logging.getLogger("SERIAL_OUTPUT")
+        self.latency = Histogram()
+        self.max_queued = 0
+        self.lines = 0
+        self.writes = 0
+        self.bytes = 0
+        self.errors = 0
+
+    async def put(self, line, line_priority=None):
+        """Queue a line and wait until it's written.
+
+        Parameters
+        ----------
+        line : str
+            line to write, without a newline
+        line_priority : int, default=None
+            priority of the line, based on its command if None
+        Returns
+        -------
+        bool
+            True if the line was written, False if writing it failed
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put(
+            (
+                priority(line) if line_priority is None else line_priority,
+                next(self.counter),
+                f"{line}\n".encode(self.encoding),
+                monotonic(),
+                future,
+            )
+        )
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+        return await future
+
+    def start(self, loop=None):
+        """Start the writer task.
+
+        Parameters
+        ----------
+        loop : asyncio.AbstractEventLoop, default=None
+            event loop to run the task in, current event loop if None
+        Returns
+        -------
+        task : asyncio.Task
+            the writer task
+        """
+        if self.task is None or self.task.done():
+            self.task = (loop or asyncio.get_event_loop()).create_task(self.run())
+        return self.task
+
+    async def run(self):
+        """Write queued lines until cancelled."""
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][2])
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if size + len(item[2]) > self.max_batch:
+                    # put it back (with the same position) for the next write
+                    self.queue.put_nowait(item)
+                    break
+                batch.append(item)
+                size += len(item[2])
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        """Write a batch of queued lines at once.
+
+        Parameters
+        ----------
+        batch : list
+            queue items to write
+        """
+        success = True
+        try:
+            await self.write(b"".join(item[2] for item in batch))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            success = False
+            self.errors += 1
+            self.logger.exception(
+                "unable to write %s lines to serial. Exception: %s", len(batch), e
+            )
+            if self.on_error is not None:
+                await self.on_error(e)
+        now = monotonic()
+        for _, _, data, queued, future in batch:
+            if success:
+                self.latency.record((now - queued) * 1000)
+            if not future.done():
+                future.set_result(success)
+        if success:
+            self.lines += len(batch)
+            self.writes += 1
+            self.bytes += sum(len(item[2]) for item in batch)
+
+    def close(self):
+        """Stop the writer task and fail all lines that are still queued."""
+        if self.task is not None:
+            self.task.cancel()
+        while not self.queue.empty():
+            future = self.queue.get_nowait()[-1]
+            if not future.done():
+                future.set_result(False)
+
+    def stats(self):
+        """Return writer metrics.
+
+        Returns
+        -------
+        stats : dict
+            current and max queue depth, number of lines, writes, bytes and errors,
+            and latency from queueing to being written (milliseconds)
+        """
+        return {
+            "queued": self.queue.qsize(),
+            "max_queued": self.max_queued,
+            "lines": self.lines,
+            "writes": self.writes,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "lines_per_write": self.lines / self.writes if self.writes else None,
+            "latency": self.latency.as_dict(),
+        }
@@ -0,0 +1,269 @@
+"""Framed serial line protocol with sequence numbers, checksums and acknowledgements.
+
+A framed line looks like ``@SS PAYLOAD*CCCC`` where SS is a hexadecimal sequence number (00-FF),
+PAYLOAD is a regular plain-text command (for example ``AUTH 1``) and CCCC is a hexadecimal CRC-16/CCITT
+of ``SS PAYLOAD``. The receiving side answers with ``ACK SS`` if the checksum matches or ``NAK SS`` if it doesn't.
+
+Framing is negotiated at connect time by sending ``PROTO 1`` - a device that supports it answers with ``PROTO 1``,
+otherwise plain-text commands are used.
+"""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+from binascii import crc_hqx
+
+PROTOCOL_VERSION = 1
+FRAME_START = "@"
+CHECKSUM_SEPARATOR = "*"
+
+
+def checksum(text):
+    """Calculate CRC-16/CCITT of a text.
+
+    Parameters
+    ----------
+    text : str
+        text to calculate the checksum for
+    Returns
+    -------
+    crc : int
+        16 bit checksum
+    """
+    return crc_hqx(text.encode("utf-8", errors="ignore"), 0xFFFF)
+
+
+def frame(seq, payload):
+    """Wrap a command in a frame.
+
+    Parameters
+    ----------
+    seq : int
+        sequence number (0-255)
+    payload : str
+        plain-text command
+    Returns
+    -------
+    line : str
+        framed line, without a newline
+    """
+    body = f"{seq:02X} {payload}"
+    return f"{FRAME_START}{body}{CHECKSUM_SEPARATOR}{checksum(body):04X}"
+
+
+def unframe(line):
+    """Extract the sequence number and command from a framed line.
+
+    Parameters
+    ----------
+    line : str
+        framed line (without a newline)
+    Returns
+    -------
+    seq : int
+        sequence number
+    payload : str
+        plain-text command
+    Raises
+    ------
+    ValueError
+        if the line isn't a valid frame. If the sequence number could be read it's available as the second argument
+    """
+    if not line.startswith(FRAME_START):
+        raise ValueError("not a frame", None)
+    body, separator, crc = line[1:].rpartition(CHECKSUM_SEPARATOR)
+    try:
+        seq = int(body[:2], 16)
+    except ValueError:
+        raise ValueError("invalid sequence number", None)
+    if not separator or body[2:3] != " ":
+        raise ValueError("malformed frame", seq)
+    try:
+        valid = int(crc, 16) == checksum(body)
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ValueError("checksum mismatch", seq)
+    return seq, body[3:]
+
+
+class FramedProtocol:
+    """Send framed commands and retransmit them until they're acknowledged."""
+
+    def __init__(self, write, timeout=0.5, retries=3, on_failure=None, loop=None):
+        """Initialize the protocol state.
+
+        Parameters
+        ----------
+        write : coroutine function
+            function used to write a single line to the serial connection
+        timeout : float, default=0.5
+            seconds to wait for an acknowledgement before retransmitting
+        retries : int, default=3
+            number of retransmissions before giving up
+        on_failure : callable, default=None
+            called with the payload of a command that was never acknowledged
+        loop : asyncio.AbstractEventLoop, default=None
+            event loop used for retransmission timers
+        """
+        self.write = write
+        self.timeout = timeout
+        self.retries = retries
+        self.on_failure = on_failure
+        self.loop = loop
+        self.logger = logging.getLogger("SERIAL_PROTOCOL")
+        self.seq = 0
+        self.last_received = None
+        # seq -> [payload, attempts, timer handle]
+        self.pending = {}
+        self.retransmitted = 0
+        self.failed = 0
+
+    def next_seq(self):
+        """Return the next sequence number to use."""
+        seq = self.seq
+        self.seq = (self.seq + 1) % 256
+        return seq
+
+    async def send(self, payload):
+        """Send a framed command and schedule its retransmission.
+
+        Doesn't wait for an acknowledgement, so it's safe to call from the serial reader.
+
+        Parameters
+        ----------
+        payload : str
+            plain-text command
+        """
+        seq = self.next_seq()
+        stale = self.pending.pop(seq, None)
+        if stale is not None:
+            stale[2].cancel()
+        self.pending[seq] = [payload, 0, None]
+        await self.transmit(seq)
+
+    async def transmit(self, seq):
+        """Write a pending frame and start its acknowledgement timer.
+
+        Parameters
+        ----------
+        seq : int
+            sequence number of the pending frame
+        """
+        entry = self.pending.get(seq, None)
+        if entry is None:
+            return
+        loop = self.loop or asyncio.get_event_loop()
+        entry[2] = loop.call_later(self.timeout, self.expire, seq)
+        await self.write(frame(seq, entry[0]))
+
+    def expire(self, seq):
+        """Retransmit a frame that wasn't acknowledged in time, or give up on it.
+
+        Parameters
+        ----------
+        seq : int
+            sequence number of the pending frame
+        """
+        entry = self.pending.get(seq, None)
+        if entry is None:
+            return
+        if entry[1] >= self.retries:
+            self.pending.pop(seq, None)
+            self.failed += 1
+            self.logger.warning(
+                "%s was not acknowledged after %s retries", entry[0], self.retries
+            )
+            if self.on_failure is not None:
+                self.on_failure(entry[0])
+            return
+        entry[1] += 1
+        self.retransmitted += 1
+        (self.loop or asyncio.get_event_loop()).create_task(self.transmit(seq))
+
+    def ack(self, seq):
+        """Mark a frame as acknowledged.
+
+        Parameters
+        ----------
+        seq : int or str
+            sequence number (hexadecimal if str)
+        """
+        entry = self.pending.pop(self.parse_seq(seq), None)
+        if entry is not None and entry[2] is not None:
+            entry[2].cancel()
+
+    def nak(self, seq):
+        """Retransmit a frame immediately after the device reported a checksum error.
+
+        Parameters
+        ----------
+        seq : int or str
+            sequence number (hexadecimal if str)
+        """
+        seq = self.parse_seq(seq)
+        entry = self.pending.get(seq, None)
+        if entry is None:
+            return
+        if entry[2] is not None:
+            entry[2].cancel()
+        self.expire(seq)
+
+    def receive(self, line):
+        """Unwrap a framed line received from the device.
+
+        Parameters
+        ----------
+        line : str
+            received line
+        Returns
+        -------
+        reply : str
+            ACK or NAK line that should be sent back
+        payload : str or None
+            plain-text command to process, None if it's invalid or a retransmission of the last frame
+        """
+        try:
+            seq, payload = unframe(line)
+        except ValueError as e:
+            self.logger.debug("invalid frame %s - %s", line, e.args[0])
+            if e.args[1] is None:
+                return None, None
+            return f"NAK {e.args[1]:02X}", None
+        reply = f"ACK {seq:02X}"
+        if seq == self.last_received:
+            return reply, None
+        self.last_received = seq
+        return reply, payload
+
+    def reset(self):
+        """Forget all pending frames, for example after the connection was lost."""
+        for entry in self.pending.values():
+            if entry[2] is not None:
+                entry[2].cancel()
+        self.pending = {}
+        self.last_received = None
+
+    @staticmethod
+    def parse_seq(seq):
+        """Convert a sequence number to int.
+
+        Parameters
+        ----------
+        seq : int or str
+            sequence number (hexadecimal if str)
+        Returns
+        -------
+        seq : int or None
+            sequence number, None if it's invalid
+        """
+        if isinstance(seq, int):
+            return seq
+        try:
+            return int(seq, 16)
+        except (TypeError, ValueError):
+            return None
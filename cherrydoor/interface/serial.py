@@ -7,13 +7,33 @@ __status__ = "Prototype"
 
 import asyncio
 import logging
+import os
 import sys
 from datetime import datetime
-from math import ceil
+from time import monotonic
 from typing import Union
 
 import aioserial
-from motor import motor_asyncio as motor
+from pymongo.errors import PyMongoError
+
+from cherrydoor.database.buffer import BufferedWriter
+from cherrydoor.database.rollups import update_rollups
+from cherrydoor.database.spool import Spool
+from cherrydoor.database.storage import create_storage
+from cherrydoor.interface.allowlist import DeviceAllowlist
+from cherrydoor.interface.breaks import BreakSchedule
+from cherrydoor.interface.cards import CardIndex
+from cherrydoor.interface.dispatcher import CommandDispatcher
+from cherrydoor.interface.metrics import SwipeMetrics
+from cherrydoor.interface.offline import AllowlistSnapshot
+from cherrydoor.interface.output import OutputQueue
+from cherrydoor.interface.terminal import TerminalLog
+from cherrydoor.interface.transport import SerialTransport
+from cherrydoor.interface.protocol import (
+    FRAME_START,
+    PROTOCOL_VERSION,
+    FramedProtocol,
+)
 
 try:
     import RPi.GPIO as GPIO  # pylint: disable=import-outside-toplevel,import-error
@@ -23,6 +43,9 @@ try:
 except ModuleNotFoundError:
     gpio_enabled = False
 
+# missed pings after which unsuccessful pings are no longer logged
+MAX_LOGGED_PINGS = 20
+
 
 def get_config():
     """Load AttrDict with configuration."""
@@ -35,33 +58,138 @@ def get_config():
 class Serial:
     """implementation of everything that requires a serial connection."""
 
-    def __init__(self, motor=None, loop=None, config=get_config()):
+    def __init__(
+        self,
+        storage=None,
+        loop=None,
+        config=get_config(),
+        door_id=None,
+        settings=None,
+        primary=None,
+    ):
         """Initialize variables and setup logging.
 
         Parameters
         ----------
-        motor : Motor
-            motor instance to use
+        storage : cherrydoor.database.Storage
+            storage engine to use, created from config in start() if None
         loop : asyncio.EventLoop
             event loop
         config : AttrDict
             app configuration
+        door_id : str, default=None
+            id of the door this reader opens, added to entry logs if set
+        settings : dict, default=None
+            settings (break_times, delay) set for this door only, they aren't loaded from the database
+        primary : Serial, default=None
+            reader to share the card index, allowlist snapshot and log writers with
         """
         self.config = config
+        self.door_id = door_id
+        self.primary = primary
+        self.tasks = {}
         self.encoding = self.config.get("interface", {}).get("encoding", "utf-8")
         self.manual_auth = False
+        self.require_auth = True
+        self.fixed_settings = settings or {}
+        self.watched_settings = [
+            setting
+            for setting in ["break_times", "delay", "require_auth"]
+            if setting not in self.fixed_settings
+        ]
         self.is_break = False
-        self.command_funcions = {"CARD": self.card, "EXIT": sys.exit, "PONG": self.pong}
+        self.command_funcions = {
+            "CARD": self.card,
+            "EXIT": sys.exit,
+            "PONG": self.pong,
+            "STATUS": self.status,
+            "ACK": self.ack,
+            "NAK": self.nak,
+            "PROTO": self.proto,
+            "LISTOK": self.list_ok,
+            "LISTERR": self.list_err,
+            "ENTRY": self.entry,
+        }
+        self.dispatcher = CommandDispatcher(self.command_funcions, queued=["CARD"])
         self.break_times = []
+        self.break_schedule = BreakSchedule()
+        self.break_times_changed = asyncio.Event()
         self.delay = 0
         self.loop = loop
         self.card_event = asyncio.Event()
         self.last_uid = ""
-        self.logger = logging.getLogger("SERIAL")
-        self.db = motor
+        self.logger = logging.getLogger(
+            "SERIAL" if door_id is None else f"SERIAL:{door_id}"
+        )
+        self.storage = storage
         self.settings_change_stream = None
+        if primary is None:
+            self.card_index = CardIndex(
+                error_rate=self.config.get("card_index", {}).get(
+                    "bloom_error_rate", 0.01
+                )
+            )
+        else:
+            self.card_index = primary.card_index
+        self.swipe_metrics = SwipeMetrics()
+        # milliseconds in config, seconds here
+        self.dedupe_window = (
+            self.config.get("interface", {}).get("dedupe_window", 0) / 1000
+        )
+        self.recent_swipes = {}
+        self.duplicate_swipes = 0
+        self.offline_config = self.config.get("offline", {})
+        self.snapshot = None if primary is None else primary.snapshot
+        if primary is None and self.offline_config.get("enabled", False):
+            self.snapshot = AllowlistSnapshot(
+                os.path.join(self.offline_directory(), "allowlist.bin")
+            )
+            self.snapshot.load()
+        self.offline_since = None
+        self.offline_decisions = 0
+        self.entry_log = None
+        self.command_log = None
+        # stats cached by the app, invalidated as entries are written
+        self.stats_cache = None
+        terminal_config = self.config.get("terminal_log", {})
+        self.terminal_log = TerminalLog(
+            routes=terminal_config.get("routes", None),
+            default=terminal_config.get("default", "db"),
+            history=terminal_config.get("history", 200),
+            door=door_id,
+        )
         self.door_open = False
+        self.door_event = asyncio.Event()
+        self.door_changed_at = None
+        # set once the arduino pushes STATUS by itself, PING is then only used as a heartbeat
+        self.status_push = False
+        self.heartbeat_interval = self.config.get("interface", {}).get(
+            "heartbeat_interval", 30
+        )
+        self.missed_pings = self.config.get("interface", {}).get("missed_pings", 3)
         self.ping_counter = 0
+        self.output = OutputQueue(
+            self.write_bytes, on_error=self.write_failed, encoding=self.encoding
+        )
+        self.device_allowlist_config = self.config.get("device_allowlist", {})
+        self.device_allowlist = None
+        if self.device_allowlist_config.get("enabled", False):
+            self.device_allowlist = DeviceAllowlist(
+                max_cards=self.device_allowlist_config.get("max_cards", 256)
+            )
+        self.allowlist_event = asyncio.Event()
+        self.device_decisions = 0
+        self.framed = False
+        self.protocol_event = asyncio.Event()
+        self.protocol = FramedProtocol(
+            self.write_raw,
+            timeout=self.config.get("interface", {}).get("ack_timeout", 0.5),
+            retries=self.config.get("interface", {}).get("retries", 3),
+            on_failure=self.framing_failed,
+            loop=loop,
+        )
+        for setting, value in self.fixed_settings.items():
+            self.apply_setting(setting, {"value": value})
         if gpio_enabled:
             self.reset_pin = config.get("reset_pin", 2)
             GPIO.setup(self.reset_pin, GPIO.OUT)
@@ -77,16 +205,15 @@ class Serial:
         try:
             if self.loop is None:
                 self.loop = asyncio.get_event_loop()
-            if self.db is None:
-                self.db = motor.AsyncIOMotorClient(
-                    f"mongodb://{self.config.get('mongo', {}).get('url', 'localhost:27017')}/{self.config.get('mongo', {}).get('name', 'cherrydoor')}",
-                    username=self.config.get("mongo", {}).get("username", None),
-                    password=self.config.get("mongo", {}).get("password", None),
-                    io_loop=self.loop,
-                )[self.config.get("mongo", {}).get("name", "cherrydoor")]
+            if self.storage is None:
+                self.storage = create_storage(self.config, self.loop)
+                self.loop.run_until_complete(self.storage.setup(self.config))
+            self.init_log_writers()
             self.serial_init()
             self.loop.create_task(self.commands())
+            self.loop.create_task(self.dispatcher.run())
             self.loop.create_task(self.settings_listener())
+            self.loop.create_task(self.card_index.listen(self.storage))
             self.loop.create_task(self.breaks())
             self.logger.info(
                 "Listening on %s",
@@ -120,19 +247,96 @@ class Serial:
         app : web.Application
             application instance
         """
+        self.stats_cache = app.get("stats_cache", None)
+        self.init_log_writers()
         await self.serial_init()
-        app["serial_listener"] = asyncio.create_task(self.commands())
-        app["settings_listener"] = asyncio.create_task(self.settings_listener())
-        app["breaks_listener"] = asyncio.create_task(self.breaks())
-        app["serial_ping"] = asyncio.create_task(self.ping())
+        self.tasks["serial_listener"] = asyncio.create_task(self.commands())
+        self.tasks["serial_dispatcher"] = asyncio.create_task(self.dispatcher.run())
+        self.tasks["serial_protocol"] = asyncio.create_task(self.negotiate_protocol())
+        if self.watched_settings:
+            self.tasks["settings_listener"] = asyncio.create_task(
+                self.settings_listener()
+            )
+        if self.primary is None:
+            # the card index and snapshot are shared with other readers, so only the primary one updates them
+            self.tasks["users_listener"] = asyncio.create_task(
+                self.card_index.listen(self.storage)
+            )
+            if self.snapshot is not None:
+                self.tasks["snapshot_writer"] = asyncio.create_task(
+                    self.snapshot_writer()
+                )
+        self.tasks["breaks_listener"] = asyncio.create_task(self.breaks())
+        if self.device_allowlist is not None:
+            self.tasks["allowlist_uploader"] = asyncio.create_task(
+                self.allowlist_uploader()
+            )
+        self.tasks["serial_ping"] = asyncio.create_task(self.ping())
         self.logger.info(
             "Listening on %s",
             self.config.get("interface", {}).get("port", "/dev/serial0"),
         )
 
+    def init_log_writers(self):
+        """Create buffered writers for entry and serial terminal logs and start flushing them.
+
+        Readers with a primary reader use its writers.
+        """
+        if self.primary is not None:
+            self.entry_log = self.primary.entry_log
+            self.command_log = self.primary.command_log
+            self.terminal_log.writer = self.command_log
+            return
+        buffer_config = self.config.get("log_buffer", {})
+        options = {
+            "max_size": buffer_config.get("size", 100),
+            "max_age": buffer_config.get("max_age", 1.0),
+            "max_pending": buffer_config.get("max_pending", 10000),
+        }
+        if self.entry_log is None:
+            spool = None
+            if self.snapshot is not None:
+                spool = Spool(os.path.join(self.offline_directory(), "logs.spool"))
+            self.entry_log = BufferedWriter(
+                self.storage.writer("logs"),
+                spool=spool,
+                on_write=self.entries_written,
+                **options,
+            )
+        if self.command_log is None:
+            self.command_log = BufferedWriter(
+                self.storage.writer("terminal"), **options
+            )
+            self.terminal_log.writer = self.command_log
+        self.entry_log.start(self.loop)
+        self.command_log.start(self.loop)
+
+    async def entries_written(self, entries):
+        """Update rollups and cached stats after entries were written to the database.
+
+        Cached stats are invalidated after rollups, so that they're never recomputed from rollups without the new entries.
+
+        Parameters
+        ----------
+        entries : list
+            entry log documents that were inserted
+        """
+        # rollups are only kept in MongoDB
+        if (
+            self.config.get("stats", {}).get("rollups", True)
+            and self.storage.db is not None
+        ):
+            await update_rollups(self.storage.db, entries)
+        if self.stats_cache is not None:
+            for entry in entries:
+                self.stats_cache.invalidate(entry.get("timestamp", None))
+
     async def cleanup(self, app=None):
         """Clean up change streams and serial after app is closed.
 
+        Logs left in the buffers are written to the database before returning.
+        Resources shared with other readers (card index, log writers, GPIO) are only closed by the primary reader.
+
         Parameters
         ----------
         app : web.Application
@@ -140,14 +344,21 @@ class Serial:
         """
         if self.settings_change_stream is not None:
             await self.settings_change_stream.close()
-        await self.serial.close()
-        if gpio_enabled:
+        if self.entry_log is not None:
+            await self.flush_swipes()
+        if self.primary is None:
+            await self.card_index.close()
+            for writer in (self.entry_log, self.command_log):
+                if writer is not None:
+                    await writer.close()
+        self.output.close()
+        self.serial.close()
+        if gpio_enabled and self.primary is None:
             GPIO.cleanup()
-        app["serial_listener"].cancel()
-        app["settings_listener"].cancel()
-        app["breaks_listener"].cancel()
-        app["serial_ping"].cancel()
-        app["periodic_reset"].cancel()
+        for task in self.tasks.values():
+            task.cancel()
+        if app is not None and "periodic_reset" in app:
+            app["periodic_reset"].cancel()
 
     async def reset(self):
         """Reset the arduino by turning the reset pin low and high again.
@@ -158,21 +369,198 @@ class Serial:
             GPIO.output(self.reset_pin, GPIO.LOW)
             await asyncio.sleep(1)
             GPIO.output(self.reset_pin, GPIO.HIGH)
+            self.framed = False
+            # give the arduino some time to boot before negotiating the protocol again
+            await asyncio.sleep(2)
+            await self.negotiate_protocol()
+
+    async def negotiate_protocol(self):
+        """Ask the arduino to use framed commands if it's enabled in config.
+
+        Falls back to plain-text commands if the arduino doesn't answer in time.
+        """
+        interface_config = self.config.get("interface", {})
+        self.framed = False
+        self.protocol.reset()
+        if not interface_config.get("framed", False):
+            return
+        self.protocol_event.clear()
+        await self.write_raw(f"PROTO {PROTOCOL_VERSION}")
+        try:
+            await asyncio.wait_for(
+                self.protocol_event.wait(),
+                interface_config.get("negotiation_timeout", 2),
+            )
+            self.logger.info("using framed serial protocol")
+        except asyncio.TimeoutError:
+            self.logger.info(
+                "arduino doesn't support framed commands, using plain-text commands"
+            )
+
+    async def proto(self, version):
+        """Switch to framed commands if the arduino confirmed the protocol version.
+
+        Parameters
+        ----------
+        version : str
+            protocol version supported by the arduino
+        """
+        if version == str(PROTOCOL_VERSION):
+            self.framed = True
+            self.protocol_event.set()
+
+    async def ack(self, seq):
+        """Mark a framed command as received by the arduino.
+
+        Parameters
+        ----------
+        seq : str
+            sequence number of the command (hexadecimal)
+        """
+        self.protocol.ack(seq)
+
+    async def nak(self, seq):
+        """Retransmit a framed command the arduino received with an invalid checksum.
+
+        Parameters
+        ----------
+        seq : str
+            sequence number of the command (hexadecimal)
+        """
+        self.protocol.nak(seq)
+
+    def framing_failed(self, payload):
+        """Go back to plain-text commands after a framed command was never acknowledged.
+
+        Parameters
+        ----------
+        payload : str
+            command that wasn't acknowledged
+        """
+        self.framed = False
+        self.protocol.reset()
+        loop = self.loop or asyncio.get_event_loop()
+        loop.create_task(self.write_raw(payload))
+        loop.create_task(self.negotiate_protocol())
+
+    async def allowlist_uploader(self):
+        """Keep the allowlist on the arduino in sync with the card index.
+
+        The list is uploaded whenever the card index changes, as a diff if the arduino confirmed the previous version.
+        If the arduino doesn't confirm a list in time or reconnects, the whole list is uploaded again after retry_interval.
+        """
+        timeout = self.device_allowlist_config.get("ack_timeout", 5)
+        while True:
+            if self.card_index.ready:
+                version, lines = self.device_allowlist.commands(
+                    list(self.card_index.allowed)
+                )
+                if version is not None:
+                    self.allowlist_event.clear()
+                    for line in lines:
+                        await self.writeline(line)
+                    try:
+                        await asyncio.wait_for(self.allowlist_event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        self.logger.warning(
+                            "arduino didn't confirm allowlist version %s", version
+                        )
+                        self.device_allowlist.reject()
+                        await asyncio.sleep(
+                            self.device_allowlist_config.get("retry_interval", 60)
+                        )
+                        continue
+            try:
+                # also check periodically, as the list is resent after the arduino reconnects
+                await asyncio.wait_for(
+                    self.card_index.changed.wait(),
+                    self.device_allowlist_config.get("retry_interval", 60),
+                )
+            except asyncio.TimeoutError:
+                continue
+            # changes usually come in bursts, so upload them together
+            await asyncio.sleep(self.device_allowlist_config.get("debounce", 1))
+
+    async def list_ok(self, version):
+        """Mark an allowlist version as received by the arduino.
+
+        Parameters
+        ----------
+        version : str
+            version of the list the arduino has
+        """
+        if self.device_allowlist is None or version is None:
+            return
+        try:
+            confirmed = self.device_allowlist.confirm(int(version))
+        except ValueError:
+            return
+        if confirmed:
+            self.allowlist_event.set()
+
+    async def list_err(self, version):
+        """Upload the whole allowlist again after the arduino couldn't apply it.
+
+        Parameters
+        ----------
+        version : str
+            version of the list that couldn't be applied
+        """
+        if self.device_allowlist is None:
+            return
+        self.logger.info("arduino rejected allowlist version %s", version)
+        self.device_allowlist.reject()
+        self.allowlist_event.set()
+        # wake up the uploader, so the full list is sent right away
+        self.card_index.changed.set()
+        self.card_index.changed.clear()
+
+    async def entry(self, argument):
+        """Log a card the arduino authorized by itself using the allowlist.
+
+        Parameters
+        ----------
+        argument : str
+            "<result>:<block0>", where result is 1 if the door was opened and 0 otherwise
+        """
+        result, _, block0 = (argument or "").partition(":")
+        if not block0:
+            return
+        self.device_decisions += 1
+        self.last_uid = self.extract_uid(block0)
+        await self.log_entry(block0, "Device allowlist", result == "1")
+        self.card_event.set()
+        self.card_event.clear()
 
     async def serial_init(self, n=1):
         """Asynchronous function for initializing serial connection.
 
+        Uses aioserial or the native non-blocking transport, depending on interface.backend setting.
+
         Parameters
         ----------
         n : int
             number of times connection failed
         """
+        interface_config = self.config.get("interface", {})
+        if isinstance(getattr(self, "serial", None), SerialTransport):
+            self.serial.close()
+        if self.device_allowlist is not None:
+            # the arduino may have been restarted and lost its list
+            self.device_allowlist.invalidate()
         try:
-            self.serial = aioserial.AioSerial(
-                loop=self.loop,
-                port=self.config.get("interface", {}).get("port", "/dev/serial0"),
-                baudrate=self.config.get("interface", {}).get("baudrate", 115200),
-            )
+            if interface_config.get("backend", "aioserial") == "native":
+                self.serial = SerialTransport(
+                    port=interface_config.get("port", "/dev/serial0"),
+                    baudrate=interface_config.get("baudrate", 115200),
+                    loop=self.loop,
+                )
+            else:
+                self.serial = aioserial.AioSerial(
+                    loop=self.loop,
+                    port=interface_config.get("port", "/dev/serial0"),
+                    baudrate=interface_config.get("baudrate", 115200),
+                )
         except aioserial.serialutil.SerialException as e:
             if n <= 20:
                 self.logger.info(
@@ -187,13 +575,22 @@ class Serial:
                 )
             await asyncio.sleep(1 + (n * (n < 25) or 24))
             await self.serial_init(n + 1)
+        self.output.start(self.loop)
 
     async def commands(self):
-        """Process commands by listening on serial connection."""
+        """Process commands by listening on serial connection.
+
+        Commands are passed to the dispatcher, which queues slow commands (CARD) for an ordered worker,
+        so the reader never waits for them.
+        """
         while True:
-            self.card_event.clear()
             try:
-                line = await self.serial.readline_async()
+                if isinstance(self.serial, SerialTransport):
+                    # parsed from the transport's buffer, without decoding the whole line first
+                    command = await self.serial.readcommand_async()
+                else:
+                    line = await self.serial.readline_async()
+                    command = line.decode("utf-8", errors="ignore").rstrip().split(" ")
             except aioserial.serialutil.SerialException as e:
                 self.logger.exception(
                     "disconnected from serial while trying to read. Exception: %s",
@@ -201,19 +598,28 @@ class Serial:
                 )
                 await self.serial_init()
                 continue
-            command = line.decode("utf-8", errors="ignore").rstrip().split(" ")
-            self.loop.create_task(self.log_command(command))
-            if len(command) == 0 or len(command[0]) < 4:
+            if command[0].startswith(FRAME_START):
+                # the checksum covers the whole line
+                reply, text = self.protocol.receive(" ".join(command))
+                if reply is not None:
+                    await self.write_raw(reply)
+                if text is None:
+                    continue
+                command = text.split(" ")
+            await self.log_command(command)
+            if len(command) == 0 or len(command[0]) < 3:
                 continue
-            process = self.command_funcions.get(command[0], None)
-            if process is not None:
-                await process(command[1] if len(command) > 1 else None)
-                await asyncio.sleep(0.1)
+            await self.dispatcher.dispatch(
+                command[0], command[1] if len(command) > 1 else None
+            )
 
     async def card(self, block0):
         """Process first block of a MiFare card.
 
         Authenticates the card with either UID or manufacturer code and logs the envent.
+        Time spent in each stage is recorded in self.swipe_metrics.
+        If the same card is read again within the dedupe window, the previous decision is reused
+        and the repeat is counted in the original log entry instead.
 
         Parameters
         ----------
@@ -221,8 +627,19 @@ class Serial:
             first block of a MiFare card (hexadecimal, UID + manufacturer data)
         """
         self.logger.debug("processing a card")
+        timings = {}
+        start = monotonic()
         uid = self.extract_uid(block0)
-        if await self.auth_required():
+        timings["extract_uid"] = monotonic() - start
+        previous = self.recent_swipes.get(uid, None)
+        if previous is not None:
+            await self.repeat_swipe(uid, previous)
+            return
+        start = monotonic()
+        auth_required = await self.auth_required()
+        timings["auth_required"] = monotonic() - start
+        start = monotonic()
+        if auth_required:
             result = await self.authenticate(uid)
             auth_mode = "UID"
         else:
@@ -236,21 +653,117 @@ class Serial:
                 )
                 result = await self.authenticate(uid)
                 auth_mode = "UID" if result else auth_mode
+        timings["authenticate"] = monotonic() - start
+        start = monotonic()
         if self.delay:
             await asyncio.sleep(self.delay)
-        await self.writeline(f"AUTH {int(result)}")
-        self.loop.create_task(self.log_entry(block0, auth_mode, result))
+        timings["delay"] = monotonic() - start
+        start = monotonic()
+        await self.send_result(result)
+        timings["write"] = monotonic() - start
+        self.swipe_metrics.record(timings, uid=uid, auth_mode=auth_mode, success=result)
+        if self.dedupe_window > 0 and uid is not None:
+            entry = self.entry_document(block0, auth_mode, result, uid)
+            entry["repeats"] = 0
+            self.recent_swipes[uid] = {
+                "result": result,
+                "entry": entry,
+                "timer": self.get_loop().call_later(
+                    self.dedupe_window, self.end_swipe, uid
+                ),
+            }
+        else:
+            await self.log_entry(block0, auth_mode, result)
         self.logger.debug(
             "Authentication %s", "successful" if result else "unsuccessful"
         )
         self.last_uid = uid
+        # wake up everyone waiting for a card, the next one will wait for a new card
         self.card_event.set()
-        # TODO: stop requiring this repeat. Perhaps by implementing any kind of error detection/correction?
+        self.card_event.clear()
+        await self.repeat_result(result)
+
+    async def repeat_swipe(self, uid, previous):
+        """Answer a card that was read again within the dedupe window with the previous decision.
+
+        Parameters
+        ----------
+        uid : str
+            UID of the card (hexadecimal)
+        previous : dict
+            the previous swipe of this card
+        """
+        self.duplicate_swipes += 1
+        previous["entry"]["repeats"] += 1
+        # the window is extended with every repeat, so a card held against the reader is logged once
+        previous["timer"].cancel()
+        previous["timer"] = self.get_loop().call_later(
+            self.dedupe_window, self.end_swipe, uid
+        )
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        await self.send_result(previous["result"])
+        await self.repeat_result(previous["result"])
+
+    async def send_result(self, result):
+        """Send the result of authentication to the arduino.
+
+        Parameters
+        ----------
+        result : bool
+            whether the door should be opened
+        """
         await self.writeline(f"AUTH {int(result)}")
 
+    async def repeat_result(self, result):
+        """Send the result of authentication again if plain-text commands are used.
+
+        Plain-text commands have no error detection, so the result is sent twice.
+
+        Parameters
+        ----------
+        result : bool
+            whether the door should be opened
+        """
+        if not self.framed:
+            await self.writeline(f"AUTH {int(result)}")
+
+    def end_swipe(self, uid):
+        """Log a swipe after its dedupe window has passed.
+
+        Parameters
+        ----------
+        uid : str
+            UID of the card (hexadecimal)
+        """
+        swipe = self.recent_swipes.pop(uid, None)
+        if swipe is not None:
+            self.get_loop().create_task(self.entry_log.add(swipe["entry"]))
+
+    async def flush_swipes(self):
+        """Log all swipes that are still in their dedupe window."""
+        for uid in list(self.recent_swipes):
+            swipe = self.recent_swipes.pop(uid)
+            swipe["timer"].cancel()
+            await self.entry_log.add(swipe["entry"])
+
+    def get_loop(self):
+        """Return the event loop used by the interface.
+
+        Returns
+        -------
+        loop : asyncio.AbstractEventLoop
+            self.loop if set, current event loop otherwise
+        """
+        return self.loop or asyncio.get_event_loop()
+
     async def authenticate(self, uid):
         """Authenticate a card with its UID.
 
+        Uses the in-memory card index if it's in sync with the database and falls back to a query otherwise,
+        unless the card index Bloom filter shows the card isn't registered at all.
+        If offline mode is enabled and the database doesn't respond in time, the local allowlist snapshot is used.
+
         Parameters
         ----------
         uid : str
@@ -260,82 +773,218 @@ class Serial:
         bool
             True if the card was successfully authenticated, False otherwise
         """
-        result = await self.db.users.count_documents(
-            {"permissions": {"$in": ["admin", "enter"]}, "cards": str(uid)}
-        )
+        result = self.card_index.lookup(uid)
+        if result is not None:
+            return result
+        if self.card_index.definitely_unknown(
+            uid, self.config.get("card_index", {}).get("max_staleness", 300)
+        ):
+            return False
+        if self.snapshot is None:
+            result = await self.storage.count_users(
+                {"permissions": {"$in": ["admin", "enter"]}, "cards": str(uid)}
+            )
+            return result > 0
+        if (
+            self.offline_since is not None
+            and monotonic() - self.offline_since
+            < self.offline_config.get("retry_interval", 30)
+        ):
+            return self.offline_authenticate(uid)
+        try:
+            result = await asyncio.wait_for(
+                self.storage.count_users(
+                    {"permissions": {"$in": ["admin", "enter"]}, "cards": str(uid)}
+                ),
+                self.offline_config.get("db_timeout", 1),
+            )
+        except (PyMongoError, asyncio.TimeoutError) as e:
+            if self.offline_since is None:
+                self.logger.warning(
+                    "database unreachable, authenticating cards with local snapshot. Exception: %s",
+                    str(e),
+                )
+            self.offline_since = monotonic()
+            return self.offline_authenticate(uid)
+        self.offline_since = None
         return result > 0
 
+    def offline_authenticate(self, uid):
+        """Authenticate a card with the local allowlist snapshot.
+
+        Parameters
+        ----------
+        uid : str
+            UID of the card (hexadecimal)
+        Returns
+        -------
+        bool
+            True if the card is in the snapshot, False otherwise
+        """
+        self.offline_decisions += 1
+        return uid in self.snapshot
+
+    def offline_directory(self):
+        """Return the directory offline mode files are kept in.
+
+        Returns
+        -------
+        directory : str
+            path of the directory
+        """
+        return os.path.expanduser(
+            self.offline_config.get("directory", None) or "~/.local/share/cherrydoor"
+        )
+
+    async def snapshot_writer(self):
+        """Save allowed cards from the card index to the local snapshot whenever they change."""
+        written_version = None
+        while True:
+            if self.card_index.ready and self.card_index.version != written_version:
+                written_version = self.card_index.version
+                try:
+                    # the file is written in an executor, but loaded here - cards are checked against the map on this thread
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, self.snapshot.save, list(self.card_index.allowed)
+                    )
+                    self.snapshot.load()
+                except OSError as e:
+                    self.logger.error(
+                        "unable to save allowlist snapshot. Exception: %s", str(e)
+                    )
+            await asyncio.sleep(self.offline_config.get("snapshot_interval", 60))
+
+    def offline_stats(self):
+        """Return offline mode metrics.
+
+        Returns
+        -------
+        stats : dict
+            whether offline mode is enabled and active, number of cards in the snapshot,
+            number of offline decisions and entry log spool metrics
+        """
+        stats = {
+            "enabled": self.snapshot is not None,
+            "active": self.offline_since is not None,
+            "decisions": self.offline_decisions,
+        }
+        if self.snapshot is not None:
+            stats["snapshot_cards"] = self.snapshot.count
+        if self.entry_log is not None and self.entry_log.spool is not None:
+            stats["spool"] = self.entry_log.spool.stats()
+        return stats
+
     async def auth_required(self):
         """Check if authentication is required.
 
         Authentication is not required if it's currently a break and require_auth is not set to manual,
         or require_auth is set to manual and its value is set to False.
+        Uses the require_auth setting cached by settings_listener, so no database query is made.
 
         Returns
         -------
         bool
             True if authentication is required, False otherwise
         """
-        auth = await self.db.settings.find_one(
-            {"setting": "require_auth"}, {"_id": 0, "manual": 1, "value": 1}
-        )
-        try:
-            self.manual_auth = auth.get("manual", False)
-        except AttributeError:
-            return not self.is_break
         if self.manual_auth:
-            return auth.get("value", True)
+            return self.require_auth
         return not self.is_break
 
-    async def settings_listener(self):
-        """Listen for settings changes and update variables accordingly."""
-        break_documents = await self.db.settings.find_one({"setting": "break_times"})
-        self.break_times = break_documents.get("value", [])
-        async with self.db.settings.watch(
-            pipeline=[
-                {
-                    "$match": {
-                        "fullDocument.setting": {"$in": ["break_times", "delay"]},
-                        "operationType": {"$in": ["insert", "update", "replace"]},
-                    }
-                },
-                {
-                    "$project": {
-                        "value": "$fullDocument.value",
-                        "setting": "$fullDocument.setting",
-                    }
-                },
-            ],
-            full_document="updateLookup",
-        ) as self.settings_change_stream:
-            async for change in self.settings_change_stream:
-                setting = change.get("setting", "")
-                if setting == "break_times":
-                    self.break_times = change.get("value", [])
-                    print(f"new break times: {self.break_times}")
-                elif setting == "delay":
-                    self.delay = change.get("value", 0)
-                    print(f"new response delay: {self.delay}s")
-
-    async def breaks(self):
-        """Adjust self.is_break when a break starts or ends."""
+    def apply_setting(self, setting, document):
+        """Update cached value of a single setting.
+
+        Parameters
+        ----------
+        setting : str
+            name of the setting
+        document : dict
+            settings document (or its projection) with value and optionally manual keys
+        """
+        if document is None:
+            document = {}
+        if setting == "break_times":
+            self.break_times = document.get("value", None) or []
+            self.break_schedule.compile(self.break_times)
+            self.break_times_changed.set()
+            self.logger.debug("new break times: %s", self.break_times)
+        elif setting == "delay":
+            self.delay = document.get("value", None) or 0
+            self.logger.debug("new response delay: %ss", self.delay)
+        elif setting == "require_auth":
+            self.manual_auth = bool(document.get("manual", False))
+            self.require_auth = document.get("value", True)
+            self.logger.debug(
+                "new require_auth setting - manual: %s, value: %s",
+                self.manual_auth,
+                self.require_auth,
+            )
+
+    async def load_settings(self):
+        """Load all settings used by the serial interface from the database."""
+        settings = await self.storage.get_settings(self.watched_settings)
+        for setting, document in settings.items():
+            self.apply_setting(setting, document)
+
+    async def settings_listener(self, retry_delay=5):
+        """Listen for settings changes and update variables accordingly.
+
+        If the change stream fails, settings are reloaded from the database before watching again.
+
+        Parameters
+        ----------
+        retry_delay : int, default=5
+            seconds to wait before reloading settings after the change stream failed
+        """
+        while True:
+            try:
+                async with self.storage.watch(
+                    "settings", ["insert", "update", "replace"]
+                ) as self.settings_change_stream:
+                    # load after opening the stream so that no change is missed in between
+                    await self.load_settings()
+                    async for change in self.settings_change_stream:
+                        document = change.get("fullDocument", None) or {}
+                        setting = document.get("setting", "")
+                        if setting in self.watched_settings:
+                            self.apply_setting(setting, document)
+            except PyMongoError as e:
+                self.logger.warning(
+                    "settings change stream failed, reloading settings in %s seconds. Exception: %s",
+                    retry_delay,
+                    str(e),
+                )
+                await asyncio.sleep(retry_delay)
+                try:
+                    await self.load_settings()
+                except PyMongoError:
+                    pass
+
+    async def breaks(self, max_sleep=3600):
+        """Adjust self.is_break when a break starts or ends.
+
+        Sleeps until the next transition in the break schedule or until break times change.
+
+        Parameters
+        ----------
+        max_sleep : int, default=3600
+            maximum number of seconds to sleep, so that changes to the system clock are picked up
+        """
         while True:
             now = datetime.now()
-            next_time = datetime.fromtimestamp(ceil(now.timestamp()))
-            delta = next_time - now
-            await asyncio.sleep(delta.total_seconds())
-            time = next_time.replace(year=2020, month=2, day=2)
             previous = self.is_break
-            self.is_break = False
-            for break_time in self.break_times:
-                self.is_break = self.is_break or (
-                    break_time.get("from", datetime.max)
-                    < time
-                    < break_time.get("to", datetime.min)
-                )
+            self.is_break = self.break_schedule.is_break(now)
             if previous != self.is_break and not self.manual_auth:
                 self.logger.debug("break time: %s", self.is_break)
                 await self.writeline(f"NTFY {3 if self.is_break else 4}")
+            next_time = self.break_schedule.next_transition(now)
+            timeout = max_sleep
+            if next_time is not None:
+                timeout = min(max_sleep, (next_time - datetime.now()).total_seconds())
+            self.break_times_changed.clear()
+            try:
+                await asyncio.wait_for(self.break_times_changed.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
 
     # pylint: disable=unsubscriptable-object
     async def open(self, open_door: Union[bool, str]) -> None:
@@ -353,27 +1002,69 @@ class Serial:
     async def writeline(self, text):
         """Send a line of text to the arduino over serial connection.
 
+        If framed protocol was negotiated, the line is framed and retransmitted until it's acknowledged.
+
         Parameters
         ----------
         text : str
             line of text to be sent
         """
-        try:
-            await self.serial.write_async(f"{text}\n".encode(self.encoding))
-            self.serial.flush()
-        except (aioserial.serialutil.SerialException, AttributeError) as e:
-            self.logger.exception("Serial exception while trying to write. %s", str(e))
-            await self.serial_init()
+        if self.framed:
+            await self.protocol.send(text)
+        else:
+            await self.write_raw(text)
+
+    async def write_raw(self, text):
+        """Write a line of text to the serial connection as-is.
+
+        The line goes through the output queue, so it's written by a single task after all more urgent lines.
+
+        Parameters
+        ----------
+        text : str
+            line of text to be sent
+        Returns
+        -------
+        bool
+            True if the line was written, False otherwise
+        """
+        return await self.output.put(text)
+
+    async def write_bytes(self, data):
+        """Write data to the serial connection. Only used by the output queue.
+
+        Parameters
+        ----------
+        data : bytes
+            one or more encoded lines
+        """
+        await self.serial.write_async(data)
+        if isinstance(self.serial, aioserial.AioSerial):
+            # flush blocks until everything is transmitted, so keep it off the event loop
+            await asyncio.get_event_loop().run_in_executor(None, self.serial.flush)
+
+    async def write_failed(self, exception):
+        """Reconnect after the output queue failed to write.
+
+        Parameters
+        ----------
+        exception : Exception
+            exception raised while writing
+        """
+        self.logger.error("Serial exception while trying to write. %s", str(exception))
+        await self.serial_init()
 
     async def log_entry(self, block0: str, auth_mode: str, success: bool):
         """Log an entry event.
 
+        The entry is added to a buffer that is written to the database in batches.
+
         Parameters
         ----------
         block0 : str
             full first block of the card
         auth_mode : str
-            authentication mode used ("UID" or "Manufacturer code")
+            authentication mode used ("UID", "Manufacturer code" or "Device allowlist")
         success : bool
             True if authentication was successful, False otherwise
 
@@ -388,69 +1079,146 @@ class Serial:
         manufacturer_code : str
             Manufacturer code of the card (last 2 bytes of block 0)
         auth_mode : str
-            authentication mode used ("UID" or "Manufacturer code")
+            authentication mode used ("UID", "Manufacturer code" or "Device allowlist")
         success : bool
             True if authentication was successful, False otherwise
+        repeats : int
+            number of times the card was read again within the dedupe window (only if it's enabled)
+        door : str
+            id of the door (only if there are multiple doors)
         """
-        await self.db.logs.insert_one(
-            {
-                "timestamp": datetime.now(),
-                "card": self.extract_uid(block0),
-                "manufacturer_code": block0[-2:],
-                "auth_mode": auth_mode,
-                "success": success,
-            }
-        )
+        await self.entry_log.add(self.entry_document(block0, auth_mode, success))
 
-        await asyncio.sleep(0.1)
-        self.card_event.clear()
+    def entry_document(self, block0, auth_mode, success, uid=None):
+        """Create an entry log document.
+
+        Parameters
+        ----------
+        block0 : str
+            full first block of the card
+        auth_mode : str
+            authentication mode used ("UID", "Manufacturer code" or "Device allowlist")
+        success : bool
+            True if authentication was successful, False otherwise
+        uid : str, default=None
+            UID of the card, extracted from block0 if None
+        Returns
+        -------
+        entry : dict
+            the document described in log_entry
+        """
+        entry = {
+            "timestamp": datetime.now(),
+            "card": uid if uid is not None else self.extract_uid(block0),
+            "manufacturer_code": block0[-2:],
+            "auth_mode": auth_mode,
+            "success": success,
+        }
+        if self.door_id is not None:
+            entry["door"] = self.door_id
+        return entry
 
     async def log_command(self, command):
         """Log all commands sent over serial.
 
+        The command is routed by the terminal log according to terminal_log.routes setting
+        - to the database (through a buffer written in batches), only to the in-memory console history, or nowhere.
+
         Parameters
         ----------
-        command : str
-            command sent by or to the arduino
+        command : list
+            command sent by or to the arduino, followed by its arguments
         """
-        await self.db.terminal.insert_one(
-            {
-                "command": command[0],
-                "arguments": command[1:],
-                "source": "serial",
-                "timestamp": datetime.now(),
-            }
-        )
+        await self.terminal_log.add(command)
 
     async def ping(self):
-        """Test connection to arduino every 2 seconds.
+        """Test connection to arduino.
 
-        TODO #54 create and use a new status command instead of a ping/pong
+        Until the arduino pushes its first STATUS, door status is polled with PING every 2 seconds.
+        After that PING is only a heartbeat sent every heartbeat_interval seconds.
         """
         while True:
-            if self.ping_counter >= 1 and self.ping_counter < 10:
+            interval = self.heartbeat_interval if self.status_push else 2
+            # thresholds are in missed pings, so a single lost PONG isn't an error even with a long heartbeat interval
+            if 1 <= self.ping_counter < self.missed_pings:
                 self.logger.debug("Unsuccessful ping")
-            elif self.ping_counter >= 10 and self.ping_counter < 20:
+            elif self.missed_pings <= self.ping_counter < MAX_LOGGED_PINGS:
                 self.logger.error(
-                    "Pings were unsuccessful for more than 10 seconds - there is most likely an error on the other side of the serial connection"
+                    "%s pings in a row were unsuccessful - there is most likely an error on the other side of the serial connection",
+                    self.ping_counter,
                 )
-            elif self.ping_counter == 20:
+            elif self.ping_counter == MAX_LOGGED_PINGS:
                 self.logger.error(
                     "Pings were unsuccessful for a long time - stopping logging"
                 )
             await self.writeline("PING")
             self.ping_counter += 1
-            await asyncio.sleep(2)
+            await asyncio.sleep(interval)
 
     async def pong(self, status=0):
         """Acknowledges ping return and uses the argument to set current door status.
 
-        TODO create and use a new status command instead of a ping/pong
+        Parameters
+        ----------
+        status : str, default=0
+            1 if the door is open, 0 otherwise
+        """
+        if status is None:
+            status = 0
+        self.ping_counter = 0
+        self.set_door_state(int(status) > 0)
+
+    async def status(self, status=0):
+        """Process door status pushed by the arduino when it changes.
+
+        Parameters
+        ----------
+        status : str, default=0
+            1 if the door is open, 0 otherwise
         """
         if status is None:
             status = 0
+        if not self.status_push:
+            self.logger.debug(
+                "arduino pushes door status, using PING as a heartbeat only"
+            )
+        self.status_push = True
         self.ping_counter = 0
-        self.door_open = int(status) > 0
+        self.set_door_state(int(status) > 0)
+
+    def set_door_state(self, door_open):
+        """Update door status and notify everyone waiting for a change.
+
+        Parameters
+        ----------
+        door_open : bool
+            True if the door is open, False otherwise
+        """
+        if door_open == self.door_open:
+            return
+        self.door_open = door_open
+        self.door_changed_at = datetime.now()
+        self.door_event.set()
+        self.door_event.clear()
+
+    async def wait_for_door_change(self, timeout=None):
+        """Wait until door status changes.
+
+        Parameters
+        ----------
+        timeout : float, default=None
+            maximum number of seconds to wait, None to wait indefinitely
+        Returns
+        -------
+        door_open : bool
+            current door status
+        Raises
+        ------
+        asyncio.TimeoutError
+            if door status didn't change within the timeout
+        """
+        await asyncio.wait_for(self.door_event.wait(), timeout)
+        return self.door_open
 
     # pylint: disable=unsubscriptable-object
     def extract_uid(self, block0: Union[str, bytearray]) -> str:
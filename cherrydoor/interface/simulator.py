@@ -0,0 +1,421 @@
+"""Simulated arduino on a pseudo-terminal, for testing and benchmarking the serial interface without hardware."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+import os
+import pty
+import random
+import tty
+from collections import deque
+from functools import reduce
+from operator import xor
+from time import monotonic
+
+from cherrydoor.interface.allowlist import list_checksum, uid_hash
+from cherrydoor.interface.protocol import FRAME_START, PROTOCOL_VERSION, unframe
+
+CASCADE_TAG = 0x88
+
+
+def bcc(data):
+    """Calculate the block check character (xor of all bytes).
+
+    Parameters
+    ----------
+    data : iterable
+        bytes to calculate BCC for
+    Returns
+    -------
+    bcc : int
+        the BCC byte
+    """
+    return reduce(xor, data, 0)
+
+
+def make_block0(uid, manufacturer_code="18"):
+    """Create block 0 of a MiFare card with a given UID.
+
+    UIDs longer than 4 bytes are stored with cascade tags, the same way they're sent by the reader.
+
+    Parameters
+    ----------
+    uid : bytes
+        UID of the card (4, 7 or 10 bytes)
+    manufacturer_code : str, default="18"
+        last byte of the block (hexadecimal)
+    Returns
+    -------
+    block0 : str
+        block 0 as a hexadecimal string
+    """
+    if len(uid) == 4:
+        levels = [uid]
+    elif len(uid) == 7:
+        levels = [bytes([CASCADE_TAG]) + uid[:3], uid[3:]]
+    elif len(uid) == 10:
+        levels = [
+            bytes([CASCADE_TAG]) + uid[:3],
+            bytes([CASCADE_TAG]) + uid[3:6],
+            uid[6:],
+        ]
+    else:
+        raise ValueError(f"invalid UID length: {len(uid)}")
+    block = bytearray()
+    for level in levels:
+        block += level + bytes([bcc(level)])
+    # fill the rest with "manufacturer data"
+    block += bytes(random.getrandbits(8) for _ in range(15 - len(block)))
+    return block.hex() + manufacturer_code
+
+
+def percentile(values, percent):
+    """Get a percentile of sorted values using the nearest-rank method.
+
+    Parameters
+    ----------
+    values : list
+        sorted values
+    percent : float
+        percentile to get (0-100)
+    Returns
+    -------
+    value : float or None
+        the percentile, None if there are no values
+    """
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values))) - 1))
+    return values[index]
+
+
+class ArduinoSimulator:
+    """Arduino speaking the CARD/PONG/STATUS/AUTH/NTFY/DOOR/LIST protocol over a pseudo-terminal.
+
+    Point Cherrydoor's interface.port at simulator.port, then use run() to swipe cards and measure
+    the latency between sending CARD and receiving AUTH.
+    """
+
+    def __init__(
+        self,
+        cards=100,
+        uid_lengths=(4, 7, 10),
+        manufacturer_codes=("18",),
+        loop=None,
+        framed=False,
+    ):
+        """Generate cards and initialize state.
+
+        Parameters
+        ----------
+        cards : int, default=100
+            number of different cards that will be swiped
+        uid_lengths : iterable, default=(4, 7, 10)
+            UID lengths to generate cards with
+        manufacturer_codes : iterable, default=("18",)
+            manufacturer codes to generate cards with
+        loop : asyncio.AbstractEventLoop, default=None
+            event loop to use, current event loop if None
+        framed : bool, default=False
+            whether to accept framed commands when Cherrydoor asks for them with PROTO
+        """
+        self.loop = loop
+        self.framed = framed
+        # number of next frames that will be rejected as if their checksum didn't match
+        self.corrupt_frames = 0
+        self.frames = {"ACK": 0, "NAK": 0}
+        self.logger = logging.getLogger("SIMULATOR")
+        # block 0 -> UID (hexadecimal)
+        self.uids = {}
+        for _ in range(cards):
+            uid = os.urandom(random.choice(list(uid_lengths)))
+            self.uids[make_block0(uid, random.choice(list(manufacturer_codes)))] = (
+                uid.hex().upper()
+            )
+        self.cards = list(self.uids)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.buffer = bytearray()
+        self.connected = asyncio.Event()
+        self.door_open = False
+        self.is_break = False
+        # [swipe time, number of AUTH lines still expected, whether the first one was received]
+        self.pending = deque()
+        # set once framed commands were negotiated - results are then sent once instead of twice
+        self.negotiated = False
+        self.latencies = []
+        self.results = {True: 0, False: 0}
+        self.duplicates = 0
+        self.swipes = 0
+        self.received = {}
+        # allowlist uploaded by Cherrydoor
+        self.allowlist = set()
+        self.allowlist_version = 0
+        self.staged_allowlist = None
+        self.local_decisions = 0
+
+    def open(self):
+        """Open the pseudo-terminal and start listening on it.
+
+        Returns
+        -------
+        port : str
+            path of the serial port Cherrydoor should connect to
+        """
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        (self.loop or asyncio.get_event_loop()).add_reader(
+            self.master, self.on_readable
+        )
+        return self.port
+
+    def close(self):
+        """Stop listening and close the pseudo-terminal."""
+        if self.master is None:
+            return
+        (self.loop or asyncio.get_event_loop()).remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+        self.master = None
+
+    def on_readable(self):
+        """Read and handle all complete lines sent by Cherrydoor."""
+        try:
+            self.buffer += os.read(self.master, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # no one has the other side open
+            return
+        while True:
+            index = self.buffer.find(b"\n")
+            if index == -1:
+                break
+            line = self.buffer[:index].decode("utf-8", errors="ignore").strip()
+            del self.buffer[: index + 1]
+            if line.startswith(FRAME_START):
+                line = self.unframe(line)
+            if line:
+                self.handle(line)
+
+    def unframe(self, line):
+        """Acknowledge a framed command and unwrap it.
+
+        Parameters
+        ----------
+        line : str
+            framed line sent by Cherrydoor
+        Returns
+        -------
+        payload : str or None
+            plain-text command, None if the frame was rejected
+        """
+        try:
+            seq, payload = unframe(line)
+        except ValueError as e:
+            if e.args[1] is not None:
+                self.nak(e.args[1])
+            return None
+        if self.corrupt_frames > 0:
+            self.corrupt_frames -= 1
+            self.nak(seq)
+            return None
+        self.frames["ACK"] += 1
+        self.writeline(f"ACK {seq:02X}")
+        return payload
+
+    def nak(self, seq):
+        """Ask Cherrydoor to retransmit a frame.
+
+        Parameters
+        ----------
+        seq : int
+            sequence number of the frame
+        """
+        self.frames["NAK"] += 1
+        self.writeline(f"NAK {seq:02X}")
+
+    def handle(self, line):
+        """Respond to a single command.
+
+        Parameters
+        ----------
+        line : str
+            command sent by Cherrydoor
+        """
+        command, _, argument = line.partition(" ")
+        self.received[command] = self.received.get(command, 0) + 1
+        self.connected.set()
+        if command == "PING":
+            self.writeline(f"PONG {int(self.door_open)}")
+        elif command == "AUTH":
+            self.handle_auth(argument == "1")
+        elif command == "DOOR":
+            door_open = argument == "1"
+            if door_open != self.door_open:
+                self.door_open = door_open
+                self.writeline(f"STATUS {int(door_open)}")
+        elif command == "LIST":
+            self.handle_list(argument.split(" "))
+        elif command == "PROTO":
+            if self.framed and argument == str(PROTOCOL_VERSION):
+                self.negotiated = True
+                self.writeline(f"PROTO {PROTOCOL_VERSION}")
+        elif command == "NTFY":
+            if argument in ["3", "4"]:
+                self.is_break = argument == "3"
+
+    def handle_auth(self, result):
+        """Match an AUTH line with the swipe it answers.
+
+        Swipes are answered in order, with every result sent twice in plain-text mode,
+        so a repeated result is never mistaken for the answer to the next swipe.
+
+        Parameters
+        ----------
+        result : bool
+            whether the card was allowed
+        """
+        if not self.pending:
+            self.duplicates += 1
+            return
+        swipe = self.pending[0]
+        if swipe[2]:
+            # plain-text protocol sends every result twice
+            self.duplicates += 1
+        else:
+            swipe[2] = True
+            self.latencies.append(monotonic() - swipe[0])
+            self.results[result] += 1
+        swipe[1] -= 1
+        if swipe[1] <= 0:
+            self.pending.popleft()
+
+    def handle_list(self, arguments):
+        """Apply a single allowlist upload command.
+
+        Parameters
+        ----------
+        arguments : list
+            LIST subcommand followed by its arguments
+        """
+        subcommand, arguments = arguments[0], arguments[1:]
+        if subcommand == "FULL":
+            self.staged_allowlist = set()
+        elif subcommand == "DIFF":
+            self.staged_allowlist = (
+                set(self.allowlist)
+                if int(arguments[0]) == self.allowlist_version
+                else None
+            )
+        elif subcommand in ["ADD", "DEL"] and self.staged_allowlist is not None:
+            hashes = {
+                int(arguments[0][offset : offset + 8], 16)
+                for offset in range(0, len(arguments[0]), 8)
+            }
+            if subcommand == "ADD":
+                self.staged_allowlist |= hashes
+            else:
+                self.staged_allowlist -= hashes
+        elif subcommand == "END":
+            version, checksum = int(arguments[0]), int(arguments[1], 16)
+            if (
+                self.staged_allowlist is not None
+                and list_checksum(sorted(self.staged_allowlist)) == checksum
+            ):
+                self.allowlist = self.staged_allowlist
+                self.allowlist_version = version
+                self.writeline(f"LISTOK {version}")
+            else:
+                self.writeline(f"LISTERR {version}")
+            self.staged_allowlist = None
+
+    def writeline(self, text):
+        """Send a line to Cherrydoor.
+
+        Parameters
+        ----------
+        text : str
+            line to send
+        """
+        os.write(self.master, f"{text}\n".encode("utf-8"))
+
+    def swipe(self, block0=None):
+        """Send a single CARD command, or ENTRY if the card is in the allowlist uploaded by Cherrydoor.
+
+        Parameters
+        ----------
+        block0 : str, default=None
+            block 0 of the card, random card from self.cards if None
+        """
+        if block0 is None:
+            block0 = random.choice(self.cards)
+        if uid_hash(self.uids.get(block0, "")) in self.allowlist:
+            # opened locally, Cherrydoor is only notified
+            self.swipes += 1
+            self.local_decisions += 1
+            self.writeline(f"ENTRY 1:{block0}")
+            return
+        self.pending.append([monotonic(), 1 if self.negotiated else 2, False])
+        self.swipes += 1
+        self.writeline(f"CARD {block0}")
+
+    async def run(self, rate=1.0, duration=10.0, timeout=5.0):
+        """Swipe cards at random intervals and wait for responses.
+
+        Parameters
+        ----------
+        rate : float, default=1.0
+            average number of swipes per second
+        duration : float, default=10.0
+            number of seconds to swipe cards for
+        timeout : float, default=5.0
+            seconds to wait for remaining responses after the last swipe
+        Returns
+        -------
+        report : dict
+            latency report
+        """
+        end = monotonic() + duration
+        while monotonic() < end:
+            self.swipe()
+            await asyncio.sleep(random.expovariate(rate))
+        end = monotonic() + timeout
+        while self.pending and monotonic() < end:
+            await asyncio.sleep(0.05)
+        return self.report()
+
+    def report(self):
+        """Summarize swipe results and card to AUTH latency.
+
+        Returns
+        -------
+        report : dict
+            number of swipes, answered and unanswered swipes, results and latency percentiles in milliseconds
+        """
+        latencies = sorted(latency * 1000 for latency in self.latencies)
+        return {
+            "swipes": self.swipes,
+            "answered": len(latencies),
+            "unanswered": sum(not swipe[2] for swipe in self.pending),
+            "allowed": self.results[True],
+            "denied": self.results[False],
+            "duplicate_auth": self.duplicates,
+            "local_decisions": self.local_decisions,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "received": dict(self.received),
+            "frames": dict(self.frames),
+        }
@@ -0,0 +1,140 @@
+"""Routing of serial terminal log entries to the database and an in-memory history."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+
+ROUTES = ["db", "memory", "none"]
+# heartbeat and protocol chatter is only useful in the live console
+DEFAULT_ROUTES = {"PONG": "memory", "ACK": "memory", "NAK": "memory"}
+
+
+class TerminalLog:
+    """Serial terminal log with per-command routing.
+
+    Every command is routed to one of:
+
+    - db - kept in history and written to the terminal collection
+    - memory - only kept in history
+    - none - dropped
+
+    History is a ring buffer of the most recent entries, used to send the console history to new clients.
+    Clients can also subscribe to receive entries as they're added.
+    """
+
+    def __init__(self, writer=None, routes=None, default="db", history=200, door=None):
+        """Initialize the log.
+
+        Parameters
+        ----------
+        writer : cherrydoor.database.BufferedWriter, default=None
+            buffered writer of the terminal collection, entries routed to db are only kept in history if None
+        routes : dict, default=None
+            mapping of command names to routes, overrides DEFAULT_ROUTES
+        default : str, default="db"
+            route of commands that aren't in routes
+        history : int, default=200
+            number of entries kept in memory
+        door : str, default=None
+            id of the door, added to entries if set
+        """
+        self.writer = writer
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self.default = default
+        self.door = door
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        self.counts = {route: 0 for route in ROUTES}
+        self.logger = logging.getLogger("TERMINAL_LOG")
+
+    def route(self, command):
+        """Get the route of a command.
+
+        Parameters
+        ----------
+        command : str
+            name of the command
+        Returns
+        -------
+        route : str
+            "db", "memory" or "none"
+        """
+        return self.routes.get(command, self.default)
+
+    async def add(self, command, source="serial"):
+        """Route a single command.
+
+        Parameters
+        ----------
+        command : list
+            command name followed by its arguments
+        source : str, default="serial"
+            where the command came from
+        """
+        route = self.route(command[0])
+        self.counts[route] += 1
+        if route == "none":
+            return
+        entry = {
+            "command": command[0],
+            "arguments": command[1:],
+            "source": source,
+            "timestamp": datetime.now(),
+        }
+        if self.door is not None:
+            entry["door"] = self.door
+        self.history.append(entry)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                self.logger.debug("console subscriber is too slow, dropping entry")
+        if route == "db" and self.writer is not None:
+            # the writer may add _id to the document, so give it a copy
+            await self.writer.add(dict(entry))
+
+    def subscribe(self, maxsize=1000):
+        """Start receiving new entries.
+
+        Parameters
+        ----------
+        maxsize : int, default=1000
+            number of entries that may wait in the queue before new ones are dropped
+        Returns
+        -------
+        queue : asyncio.Queue
+            queue new entries are put into
+        """
+        queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """Stop receiving new entries.
+
+        Parameters
+        ----------
+        queue : asyncio.Queue
+            queue returned by subscribe
+        """
+        self.subscribers.discard(queue)
+
+    def stats(self):
+        """Return routing metrics.
+
+        Returns
+        -------
+        stats : dict
+            number of entries per route, entries in history and number of subscribers
+        """
+        return {
+            "routed": dict(self.counts),
+            "history": len(self.history),
+            "subscribers": len(self.subscribers),
+        }
@@ -0,0 +1,216 @@
+"""Non-blocking serial transport running directly on the event loop."""
+
+__author__ = "opliko"
+__license__ = "MIT"
+__version__ = "0.8.b0"
+__status__ = "Prototype"
+
+import asyncio
+import os
+
+import serial
+from serial.serialutil import SerialException
+
+NEWLINE = 10
+SPACE = 32
+# stripped from the end of a line, like str.rstrip() does
+TRAILING_WHITESPACE = b" \t\r\x0b\x0c"
+READ_SIZE = 4096
+
+
+class SerialTransport:
+    """Serial connection on a non-blocking file descriptor watched with loop.add_reader.
+
+    Has the same readline_async/write_async interface as aioserial.AioSerial, but doesn't use an executor thread
+    for every read and write. Received bytes go into a single reusable buffer that lines are cut from.
+    readcommand_async parses a command and its arguments straight from the buffer, without copying the line first.
+
+    ..warning:: Only works on POSIX systems.
+    """
+
+    def __init__(self, port, baudrate=115200, loop=None):
+        """Open the serial port and start watching it.
+
+        Parameters
+        ----------
+        port : str
+            serial port path
+        baudrate : int, default=115200
+            baudrate of the connection
+        loop : asyncio.AbstractEventLoop, default=None
+            event loop to use, current event loop if None
+        Raises
+        ------
+        serial.serialutil.SerialException
+            if the port can't be opened
+        """
+        self.loop = loop or asyncio.get_event_loop()
+        self.serial = serial.Serial(port=port, baudrate=baudrate, timeout=0)
+        self.fd = self.serial.fileno()
+        os.set_blocking(self.fd, False)
+        self.buffer = bytearray()
+        self.chunk = bytearray(READ_SIZE)
+        self.chunk_view = memoryview(self.chunk)
+        # position up to which buffer was already searched for a newline
+        self.scanned = 0
+        self.reader = None
+        self.error = None
+        self.closed = False
+        self.loop.add_reader(self.fd, self.on_readable)
+
+    def on_readable(self):
+        """Read everything available from the port into the buffer."""
+        try:
+            read = os.readv(self.fd, [self.chunk])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.fail(SerialException(f"read failed: {e}"))
+            return
+        if read == 0:
+            self.fail(SerialException("device disconnected"))
+            return
+        self.buffer += self.chunk_view[:read]
+        if self.reader is not None and not self.reader.done():
+            if self.chunk.find(NEWLINE, 0, read) != -1:
+                self.reader.set_result(None)
+
+    def fail(self, error):
+        """Stop reading and pass an error to the waiting reader.
+
+        Parameters
+        ----------
+        error : Exception
+            exception raised from readline_async
+        """
+        self.error = error
+        self.loop.remove_reader(self.fd)
+        if self.reader is not None and not self.reader.done():
+            self.reader.set_exception(error)
+
+    async def wait_for_line(self):
+        """Wait until there is a complete line in the buffer.
+
+        Returns
+        -------
+        index : int
+            position of the newline ending the first line in the buffer
+        Raises
+        ------
+        serial.serialutil.SerialException
+            if the connection was lost
+        """
+        while True:
+            index = self.buffer.find(NEWLINE, self.scanned)
+            if index != -1:
+                self.scanned = 0
+                return index
+            self.scanned = len(self.buffer)
+            if self.error is not None:
+                raise self.error
+            self.reader = self.loop.create_future()
+            try:
+                await self.reader
+            finally:
+                self.reader = None
+
+    async def readline_async(self):
+        """Read a single line, including the newline.
+
+        Returns
+        -------
+        line : bytes
+            received line
+        Raises
+        ------
+        serial.serialutil.SerialException
+            if the connection was lost
+        """
+        index = await self.wait_for_line()
+        line = bytes(self.buffer[: index + 1])
+        del self.buffer[: index + 1]
+        return line
+
+    async def readcommand_async(self, encoding="utf-8"):
+        """Read a single line and split it into a command and its arguments.
+
+        Equivalent to ``readline_async().decode(encoding, errors="ignore").rstrip().split(" ")``,
+        but only the fields are decoded, straight from the buffer.
+
+        Parameters
+        ----------
+        encoding : str, default="utf-8"
+            encoding of the line
+        Returns
+        -------
+        command : list
+            command name followed by its arguments, [""] for an empty line
+        Raises
+        ------
+        serial.serialutil.SerialException
+            if the connection was lost
+        """
+        index = await self.wait_for_line()
+        end = index
+        while end > 0 and self.buffer[end - 1] in TRAILING_WHITESPACE:
+            end -= 1
+        command = []
+        start = 0
+        # the view has to be released before the line is removed from the buffer
+        with memoryview(self.buffer) as view:
+            while True:
+                space = self.buffer.find(SPACE, start, end)
+                if space == -1:
+                    command.append(str(view[start:end], encoding, "ignore"))
+                    break
+                command.append(str(view[start:space], encoding, "ignore"))
+                start = space + 1
+        del self.buffer[: index + 1]
+        return command
+
+    async def write_async(self, data):
+        """Write data, waiting for the port to become writable if needed.
+
+        Parameters
+        ----------
+        data : bytes
+            data to write
+        Returns
+        -------
+        written : int
+            number of bytes written
+        Raises
+        ------
+        serial.serialutil.SerialException
+            if the connection was lost
+        """
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+            except OSError as e:
+                raise SerialException(f"write failed: {e}")
+            view = view[written:]
+            if view:
+                writable = self.loop.create_future()
+                self.loop.add_writer(
+                    self.fd, lambda: writable.done() or writable.set_result(None)
+                )
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+        return len(data)
+
+    def flush(self):
+        """Do nothing - write_async returns after all data was passed to the OS."""
+
+    def close(self):
+        """Stop watching the port and close it."""
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.remove_reader(self.fd)
+        self.serial.close()
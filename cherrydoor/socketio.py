@@ -8,6 +8,7 @@ __status__ = "Prototype"
 import asyncio
 import logging
 from datetime import datetime as dt
+from itertools import count
 
 import socketio
 from aiohttp_security import check_permission
@@ -29,6 +30,9 @@ logger = logging.getLogger("SOCKET.IO")
 internal_logger = logging.getLogger("SOCKET.IO-INTERNALS")
 internal_logger.setLevel(logging.ERROR)
 
+# numbers of user listings, so that batches of different listings can be told apart
+user_listings = count()
+
 sio = socketio.AsyncServer(
     async_mode="aiohttp",
     cors_allowed_origins="*",
@@ -86,63 +90,117 @@ async def setup_socket_tasks(app):
 
 
 async def send_status(app):
-    """Send door status to connected clients in "door" room every second.
+    """Send door status to connected clients in "door" room as soon as it changes, or every second otherwise.
+
+    Top-level status is the status of the primary door, status of every door is sent in "doors" if there are more.
 
     Parameters
     ----------
     app : aiohttp.web.Application
         The aiohttp application instance.
     """
+    readers = app["readers"]
     while True:
         try:
-            await sio.emit(
-                "door",
-                {
-                    "open": bool(app["serial"].door_open),
-                    "break": bool(app["serial"].is_break),
-                },
-                room="door",
-            )
+            status = {
+                "open": bool(app["serial"].door_open),
+                "break": bool(app["serial"].is_break),
+            }
+            if len(readers) > 1:
+                status["doors"] = readers.status()
+            await sio.emit("door", status, room="door")
         except Exception as e:
             logger.debug("failed to emit status. Exception: %s", e)
-        await asyncio.sleep(1)
+        await readers.wait_for_door_change(timeout=1)
+
+
+def format_console_entry(entry, door_id=None):
+    """Convert a terminal log entry to the format expected by the serial console.
+
+    Parameters
+    ----------
+    entry : dict
+        terminal log entry
+    door_id : str, default=None
+        id of the door whose reader logged the entry
+    Returns
+    -------
+    dict
+        command, arguments, timestamp formatted as HH:MM:SS:mmm and door_id
+    """
+    return {
+        "command": entry["command"],
+        "arguments": entry["arguments"],
+        "timestamp": entry["timestamp"].strftime("%H:%M:%S:%f")[:-3],
+        "door_id": door_id,
+    }
 
 
 async def send_console(app):
-    """Senda all serial input/output to clients in "console" room as it's logged.
+    """Senda all serial input/output of every reader to clients in "console" room as it's logged.
+
+    Entries are taken from the in-memory terminal logs, so commands that aren't saved to the database are sent too.
 
     Parameters
     ----------
     app : aiohttp.web.Application
         The aiohttp application instance.
     """
-    async with app["db"].terminal.watch(
-        pipeline=[
-            {
-                "$match": {
-                    "operationType": {"$in": ["insert", "update", "replace", "rename"]},
-                }
-            },
-            {
-                "$project": {
-                    "command": "$fullDocument.command",
-                    "arguments": "$fullDocument.arguments",
-                    "timestamp": {
-                        "$dateToString": {
-                            "format": "%H:%M:%S:%L",
-                            "date": "$fullDocument.timestamp",
-                        }
-                    },
-                }
-            },
-        ],
-        full_document="updateLookup",
-    ) as terminal_change_stream:
-        async for change in terminal_change_stream:
+    await asyncio.gather(
+        *[send_reader_console(interface) for interface in app["readers"]]
+    )
+
+
+async def send_reader_console(interface):
+    """Send serial input/output of a single reader to clients in "console" room, tagged with its door id.
+
+    Parameters
+    ----------
+    interface : cherrydoor.interface.serial.Serial
+        The reader
+    """
+    terminal_log = interface.terminal_log
+    queue = terminal_log.subscribe()
+    try:
+        while True:
+            entry = await queue.get()
             try:
-                await sio.emit("serial_command", data=change, room="serial_console")
+                await sio.emit(
+                    "serial_command",
+                    data=format_console_entry(entry, interface.door_id),
+                    room="serial_console",
+                )
             except Exception as e:
                 logger.exception("failed to emit serial result. Exception: %s", e)
+    finally:
+        terminal_log.unsubscribe(queue)
+
+
+async def send_console_history(sid, data={}, broadcast=False):
+    """Send recent serial commands of all readers to a client that joined "serial_console" room.
+
+    Parameters
+    ----------
+    sid : str
+        The sid of the socket.
+    data : dict
+        currently unused.
+    broadcast : bool
+        unused, history is always sent only to the client that requested it.
+    """
+    app = sio.get_environ(sid)["aiohttp.request"].app
+    history = sorted(
+        (
+            (entry, interface.door_id)
+            for interface in app["readers"]
+            for entry in list(interface.terminal_log.history)
+        ),
+        key=lambda item: item[0]["timestamp"],
+    )
+    for entry, door_id in history:
+        await sio.emit(
+            "serial_command", data=format_console_entry(entry, door_id), room=sid
+        )
 
 
 async def send_new_logs(app):
@@ -154,21 +212,8 @@ async def send_new_logs(app):
         The aiohttp application instance.
     """
     # TODO actually finish this function
-    async with app["db"].logs.watch(
-        pipeline=[
-            {
-                "$match": {
-                    "operationType": {"$in": ["insert", "update", "replace"]},
-                }
-            },
-            {
-                "$project": {
-                    "value": "$fullDocument.value",
-                    "setting": "$fullDocument.setting",
-                }
-            },
-        ],
-        full_document="updateLookup",
+    async with app["storage"].watch(
+        "logs", ["insert", "update", "replace"]
     ) as logs_change_stream:
         async for change in logs_change_stream:
             try:
@@ -190,7 +235,8 @@ async def door_socket(sid, data):
     sid : str
         The sid of the socket.
     data : dict
-        The data sent by the client, containing a "open" key with boolean value (True for open, False for close).
+        The data sent by the client, containing a "open" key with boolean value (True for open, False for close)
+        and optionally a "door_id" key with id of the door (primary door is used if it's not set).
     Returns
     -------
     dict
@@ -199,46 +245,64 @@ async def door_socket(sid, data):
     await authenticate_socket(sid, "enter")
 
     if isinstance(data, dict) and isinstance(data.get("open", None), bool):
-        interface = sio.get_environ(sid)["aiohttp.request"].app["serial"]
+        readers = sio.get_environ(sid)["aiohttp.request"].app["readers"]
+        try:
+            interface = readers.get(data.get("door_id", None))
+        except KeyError:
+            return {"Ok": False, "Error": "Unknown door"}
         await interface.open(data.get("open", False))
         return {"Ok": True}
 
 
 @sio.on("reset")
-async def reset(sid):
+async def reset(sid, data=None):
     """Reset the arduino over GPIO.
 
     Parameters
     ----------
     sid : str
         The sid of the socket.
+    data : dict, default=None
+        optionally a "door_id" key with id of the door (primary door is used if it's not set).
+    Returns
+    -------
+    dict
+        The response to the client, with "Ok" key set to True if request was successful.
     """
     await authenticate_socket(sid, "admin")
-    interface = sio.get_environ(sid)["aiohttp.request"].app["serial"]
+    readers = sio.get_environ(sid)["aiohttp.request"].app["readers"]
+    try:
+        interface = readers.get((data or {}).get("door_id", None))
+    except KeyError:
+        return {"Ok": False, "Error": "Unknown door"}
     await interface.reset()
+    return {"Ok": True}
 
 
 @sio.on("get_card")
-async def get_card(sid):
-    """Read a single card from the card reader and return it to the client.
+async def get_card(sid, data=None):
+    """Read a single card from a card reader and return it to the client.
 
     Parameters
     ----------
     sid : str
         The sid of the socket.
+    data : dict, default=None
+        optionally a "door_id" key with id of the door to read the card from (any door if it's not set).
     Returns
     -------
     dict
-        The response to the client, with "uid" key set to the card id.
+        The response to the client, with "uid" key set to the card id and "door_id" to the door it was read on.
     """
     await asyncio.gather(
         authenticate_socket(sid, "cards"), authenticate_socket(sid, "users_read")
     )
-    await sio.get_environ(sid)["aiohttp.request"].app["serial"].card_event.wait()
+    readers = sio.get_environ(sid)["aiohttp.request"].app["readers"]
     try:
-        return {"uid": sio.get_environ(sid)["aiohttp.request"].app["serial"].last_uid}
+        door_id, uid = await readers.wait_for_card((data or {}).get("door_id", None))
     except KeyError:
-        pass
+        return {"Ok": False, "Error": "Unknown door"}
+    return {"uid": uid, "door_id": door_id}
 
 
 @sio.on("modify_users")
@@ -342,18 +406,32 @@ async def serial_command(sid, data):
     sid : str
         The sid of the socket.
     data : dict
-        The data sent with a "command" key containing the text to send.
+        The data sent with a "command" key containing the text to send
+        and optionally a "door_id" key with id of the door (primary door is used if it's not set).
+    Returns
+    -------
+    dict
+        The response to the client, with "Ok" key set to True if request was successful.
     """
     await authenticate_socket(sid, "admin")
-    app = sio.get_environ(sid)["aiohttp.request"].app
+    readers = sio.get_environ(sid)["aiohttp.request"].app["readers"]
+    try:
+        interface = readers.get(data.get("door_id", None))
+    except KeyError:
+        return {"Ok": False, "Error": "Unknown door"}
     command = data.get("command", False)
     if command:
-        await app["serial"].writeline(command)
+        await interface.writeline(command)
+    return {"Ok": True}
 
 
 async def send_users(sid, data={}, broadcast=False):
     """Ask to emit the users list to the client.
 
+    Users are streamed from the database and emitted in batches of user_listing.batch_size.
+    Every batch has the same listing number, the first one has first set to True and the last one has last set to True,
+    so clients can tell batches of overlapping listings apart.
+
     Parameters
     ----------
     sid : str
@@ -364,14 +442,33 @@ async def send_users(sid, data={}, broadcast=False):
         Whether to send the list to all clients in "users" room or just the one that requested it.
     """
     app = sio.get_environ(sid)["aiohttp.request"].app
-    users = await (await get_users(app, ["username", "permissions", "cards"])).to_list(
-        None
-    )
+    batch_size = max(1, app["config"].get("user_listing", {}).get("batch_size", 100))
     logger.debug("socket got a message")
-    # ensure all sent users have permissions
-    users = await asyncio.gather(*map(lambda user: map_permissions(app, user), users))
     room = "users" if broadcast else sid
-    await sio.emit("users", data={"users": users}, room=room)
+    listing = next(user_listings)
+    first = True
+    batch = []
+
+    async def emit(last):
+        # ensure all sent users have permissions
+        users = await asyncio.gather(
+            *map(lambda user: map_permissions(app, user), batch)
+        )
+        await sio.emit(
+            "users",
+            data={"users": users, "listing": listing, "first": first, "last": last},
+            room=room,
+        )
+
+    async for user in await get_users(
+        app, ["username", "permissions", "cards"], batch_size=batch_size
+    ):
+        batch.append(user)
+        if len(batch) >= batch_size:
+            await emit(last=False)
+            first = False
+            batch = []
+    await emit(last=True)
 
 
 async def send_settings(sid, data={}, broadcast=False):
@@ -400,7 +497,7 @@ rooms = {
     "door": {"permissions": ["enter"], "function": None},
     "users": {"permissions": ["users_manage", "users_read"], "function": send_users},
     "settings": {"permissions": ["admin"], "function": send_settings},
-    "serial_console": {"permissions": ["admin"], "function": None},
+    "serial_console": {"permissions": ["admin"], "function": send_console_history},
 }
 
 
@@ -18,22 +18,32 @@ const ManageUsers = {
 				password: "",
 			},
 			original_users: [],
+			listing: null,
 		};
 	},
 	inject: ["user", "socket"],
 	mounted() {
+		// users are sent in batches - the first batch of a listing replaces the list, the rest are appended to it
 		this.socket.on("users", (data) => {
-			if (data != null) {
-				this.$data.original_users = JSON.parse(JSON.stringify(data.users));
-				data.users.forEach((user) => {
-					user.edit = {
-						permissions: false,
-						cards: user.cards.map((x) => false),
-						username: false,
-					};
-				});
-				this.$data.users = data.users;
+			if (data == null) return;
+			if (data.first) {
+				this.$data.listing = data.listing;
+				this.$data.original_users = [];
+				this.$data.users = [];
+			} else if (data.listing !== this.$data.listing) {
+				return;
 			}
+			this.$data.original_users.push(
+				...JSON.parse(JSON.stringify(data.users))
+			);
+			data.users.forEach((user) => {
+				user.edit = {
+					permissions: false,
+					cards: user.cards.map((x) => false),
+					username: false,
+				};
+			});
+			this.$data.users.push(...data.users);
 		});
 		this.socket.emit("enter_room", { room: "users" });
 	},
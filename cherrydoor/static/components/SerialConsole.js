@@ -6,7 +6,7 @@ const SerialConsole = {
 				header: "Serial Console",
 				subHeader: "Allows sending commands directly to the arduino",
 				helpHeader:
-					'Just type the string to send over serial. You can clear the console with "clear" command',
+					'Just type the string to send over serial, prefix it with "@<door id> " to send it to a door other than the primary one. You can clear the console with "clear" command',
 				sign: ">",
 				emoji: {},
 			},
@@ -17,7 +17,8 @@ const SerialConsole = {
 		const container = document.getElementById("container");
 		this.socket.on("serial_command", (data) => {
 			if (data != null) {
-				const command = `(${data.timestamp}) < ${
+				const door = data.door_id != null ? `[${data.door_id}] ` : "";
+				const command = `(${data.timestamp}) ${door}< ${
 					data.command
 				} ${data.arguments.join(" ")}`;
 				this.send_to_terminal = command;
@@ -35,7 +36,15 @@ const SerialConsole = {
 	},
 	methods: {
 		prompt(value) {
-			this.socket.emit("serial_command", { command: value });
+			const target = value.match(/^@(\S+)\s+(.*)$/);
+			if (target != null) {
+				this.socket.emit("serial_command", {
+					door_id: target[1],
+					command: target[2],
+				});
+			} else {
+				this.socket.emit("serial_command", { command: value });
+			}
 			const container = document.getElementById("container");
 			if (
 				container.scrollHeight - container.scrollTop <
@@ -71,7 +71,9 @@ setup(
             "Brotli",
             "cchardet",
             "uvloop>=0.14",
-        ]
+        ],
+        "sqlite": ["aiosqlite>=0.17"],
+        "test": ["pytest>=6", "pytest-asyncio>=0.17"],
     },
     classifiers=[
         "Development Status :: 3 - Alpha",
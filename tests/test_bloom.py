@@ -0,0 +1,32 @@
+"""Counting Bloom filter of registered cards."""
+
+from cherrydoor.interface.bloom import CountingBloomFilter
+
+
+def test_added_items_are_always_found():
+    bloom = CountingBloomFilter(capacity=100)
+    cards = [f"{i:08x}" for i in range(100)]
+    for card in cards:
+        bloom.add(card)
+    assert all(card in bloom for card in cards)
+    assert bloom.count == 100
+
+
+def test_removed_items_are_not_found():
+    bloom = CountingBloomFilter(capacity=100)
+    bloom.add("deadbeef")
+    bloom.add("cafebabe")
+    bloom.remove("deadbeef")
+    assert "deadbeef" not in bloom
+    assert "cafebabe" in bloom
+    assert bloom.count == 1
+
+
+def test_false_positive_rate_at_capacity():
+    bloom = CountingBloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"registered-{i}")
+    false_positives = sum(f"unknown-{i}" in bloom for i in range(10000))
+    # a generous bound, so that the test doesn't depend on the hash function
+    assert false_positives / 10000 < 0.03
+    assert bloom.false_positive_rate() < 0.03
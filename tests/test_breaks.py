@@ -0,0 +1,55 @@
+"""Break schedule compilation and lookups."""
+
+from datetime import datetime
+
+from cherrydoor.interface.breaks import BreakSchedule
+
+
+def at(hour, minute=0):
+    return datetime(2021, 9, 1, hour, minute)
+
+
+def test_no_breaks():
+    schedule = BreakSchedule()
+    assert not schedule.is_break(at(12))
+    assert schedule.next_transition(at(12)) is None
+
+
+def test_break_is_half_open():
+    schedule = BreakSchedule([{"from": "10:00", "to": "10:15"}])
+    assert not schedule.is_break(at(9, 59))
+    assert schedule.is_break(at(10))
+    assert schedule.is_break(at(10, 14))
+    assert not schedule.is_break(at(10, 15))
+
+
+def test_overlapping_breaks_are_merged():
+    schedule = BreakSchedule(
+        [
+            {"from": "10:00", "to": "10:30"},
+            {"from": "10:15", "to": "11:00"},
+            {"from": "11:00", "to": "11:10"},
+        ]
+    )
+    assert schedule.transitions == [600, 670]
+
+
+def test_break_over_midnight():
+    schedule = BreakSchedule([{"from": at(23), "to": at(1)}])
+    assert schedule.is_break(at(23, 30))
+    assert schedule.is_break(at(0, 30))
+    assert not schedule.is_break(at(1))
+    assert schedule.next_transition(at(12)) == at(23)
+
+
+def test_next_transition_wraps_to_the_next_day():
+    schedule = BreakSchedule([{"from": "08:00", "to": "08:10"}])
+    assert schedule.next_transition(at(8, 5)) == at(8, 10)
+    assert schedule.next_transition(at(9)) == datetime(2021, 9, 2, 8, 0)
+
+
+def test_invalid_break_times_are_skipped():
+    schedule = BreakSchedule(
+        [{"from": "12:00"}, None, {"from": "13:00", "to": "13:30"}]
+    )
+    assert schedule.transitions == [780, 810]
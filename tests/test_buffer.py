@@ -0,0 +1,129 @@
+"""Write-behind buffer for entry and terminal logs."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from cherrydoor.database.buffer import BufferedWriter
+from cherrydoor.database.spool import Spool
+
+
+class Collection:
+    """Collection that records insert_many calls and fails while error is set."""
+
+    name = "logs"
+
+    def __init__(self):
+        self.batches = []
+        self.error = None
+
+    async def insert_many(self, documents, ordered=False):
+        if self.error is not None:
+            raise self.error
+        self.batches.append(list(documents))
+        return SimpleNamespace(inserted_ids=[document["i"] for document in documents])
+
+    @property
+    def documents(self):
+        return [document for batch in self.batches for document in batch]
+
+
+@pytest.mark.asyncio
+async def test_full_batches_are_written_right_away():
+    collection = Collection()
+    writer = BufferedWriter(collection, max_size=3, max_age=60)
+    writer.start()
+    for i in range(7):
+        await writer.add({"i": i})
+    await asyncio.sleep(0.05)
+    assert [len(batch) for batch in collection.batches] == [3, 3]
+    await writer.close()
+    assert [document["i"] for document in collection.documents] == list(range(7))
+    assert writer.stats()["written"] == 7
+
+
+@pytest.mark.asyncio
+async def test_old_documents_are_written_after_max_age():
+    collection = Collection()
+    writer = BufferedWriter(collection, max_size=100, max_age=0.05)
+    writer.start()
+    await writer.add({"i": 0})
+    await asyncio.sleep(0.01)
+    assert not collection.batches
+    await asyncio.sleep(0.1)
+    assert collection.documents == [{"i": 0}]
+    await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_is_kept_when_the_engine_fails():
+    collection = Collection()
+    writer = BufferedWriter(collection, max_size=100, max_age=0.01)
+    # a closed engine doesn't raise PyMongoError
+    collection.error = AttributeError("'NoneType' object has no attribute 'execute'")
+    await writer.add({"i": 0})
+    await writer.add({"i": 1})
+    await writer.flush()
+    assert len(writer) == 2
+    collection.error = None
+    await writer.flush()
+    assert [document["i"] for document in collection.documents] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_failed_batches_are_spooled_and_replayed(tmp_path):
+    collection = Collection()
+    spool = Spool(str(tmp_path / "logs.spool"))
+    written = []
+
+    async def on_write(documents):
+        written.extend(document["i"] for document in documents)
+
+    writer = BufferedWriter(
+        collection, max_size=2, max_age=60, spool=spool, on_write=on_write
+    )
+    collection.error = AutoReconnect("down")
+    for i in range(4):
+        await writer.add({"i": i})
+        await writer.flush()
+    assert spool.pending()
+    assert spool.stats()["spooled"] == 4
+    collection.error = None
+    await writer.add({"i": 4})
+    await writer.flush()
+    await writer.replay_task
+    assert sorted(document["i"] for document in collection.documents) == list(range(5))
+    assert sorted(written) == list(range(5))
+    assert not spool.pending()
+
+
+@pytest.mark.asyncio
+async def test_failing_on_write_doesnt_stop_the_buffer():
+    collection = Collection()
+
+    async def on_write(documents):
+        raise AutoReconnect("rollups unavailable")
+
+    writer = BufferedWriter(collection, max_size=1, max_age=60, on_write=on_write)
+    writer.start()
+    await writer.add({"i": 0})
+    await asyncio.sleep(0.02)
+    await writer.add({"i": 1})
+    await asyncio.sleep(0.02)
+    assert not writer.task.done()
+    assert len(collection.documents) == 2
+    await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_close_writes_what_is_left():
+    collection = Collection()
+    writer = BufferedWriter(collection, max_size=100, max_age=60)
+    writer.start()
+    for i in range(5):
+        await writer.add({"i": i})
+    await writer.close()
+    assert len(collection.documents) == 5
+    assert len(writer) == 0
@@ -0,0 +1,132 @@
+"""Cache of entry statistics."""
+
+import asyncio
+import datetime as dt
+
+import pytest
+
+from cherrydoor.database.cache import StatsCache, align
+from cherrydoor.database.storage import MemoryStorage
+from cherrydoor.interface.serial import Serial
+
+HOUR = dt.timedelta(hours=1)
+
+
+class Compute:
+    """Stats computation that counts calls and returns one point per bucket."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, datetime_from, datetime_to, granularity):
+        self.calls.append((datetime_from, datetime_to, granularity))
+        await asyncio.sleep(self.delay)
+        points = []
+        start = datetime_from
+        while start < datetime_to:
+            points.append(
+                {
+                    "date_from": start.isoformat(),
+                    "date_to": (start + granularity).isoformat(),
+                    "count": len(self.calls),
+                }
+            )
+            start += granularity
+        return points
+
+
+def test_ranges_are_aligned_to_buckets():
+    start = dt.datetime(2021, 3, 4, 5, 6)
+    assert align(start, start + 2 * HOUR, HOUR) == (
+        dt.datetime(2021, 3, 4, 5),
+        dt.datetime(2021, 3, 4, 8),
+        HOUR,
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_computed_once():
+    cache = StatsCache()
+    compute = Compute(delay=0.02)
+    start = dt.datetime(2021, 3, 4)
+    results = await asyncio.gather(
+        *[cache.get(start, start + 3 * HOUR, HOUR, compute) for _ in range(5)]
+    )
+    assert len(compute.calls) == 1
+    assert all(result == results[0] for result in results)
+    assert await cache.get(start, start + 3 * HOUR, HOUR, compute) == results[0]
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 4, 1)
+
+
+@pytest.mark.asyncio
+async def test_failed_computation_isnt_cached():
+    cache = StatsCache()
+    start = dt.datetime(2021, 3, 4)
+
+    async def fail(*args):
+        await asyncio.sleep(0.01)
+        raise ValueError("aggregation failed")
+
+    requests = [cache.get(start, start + HOUR, HOUR, fail) for _ in range(2)]
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert not cache.entries
+    assert not cache.pending
+
+
+@pytest.mark.asyncio
+async def test_open_trailing_bucket_is_refreshed_after_ttl():
+    cache = StatsCache(ttl=0.05)
+    compute = Compute()
+    start = dt.datetime.now() - 2 * HOUR
+    first = await cache.get(start, start + 3 * HOUR, HOUR, compute)
+    await cache.get(start, start + 3 * HOUR, HOUR, compute)
+    assert len(compute.calls) == 1
+    await asyncio.sleep(0.06)
+    refreshed = await cache.get(start, start + 3 * HOUR, HOUR, compute)
+    # only the last bucket is computed again
+    assert compute.calls[-1][0] == dt.datetime.fromisoformat(first[-1]["date_from"])
+    assert refreshed[:-1] == first[:-1]
+    assert refreshed[-1]["count"] == 2
+    assert cache.stats()["tail_refreshes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_closed_ranges_dont_expire():
+    cache = StatsCache(ttl=0)
+    compute = Compute()
+    start = dt.datetime(2021, 3, 4)
+    await cache.get(start, start + HOUR, HOUR, compute)
+    await asyncio.sleep(0.01)
+    await cache.get(start, start + HOUR, HOUR, compute)
+    assert len(compute.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_new_entries_invalidate_cached_stats():
+    cache = StatsCache(ttl=3600)
+    compute = Compute()
+    end = dt.datetime.now()
+    key = align(end - 3 * HOUR, end, HOUR)
+    await cache.get(end - 3 * HOUR, end, HOUR, compute)
+    cache.invalidate(dt.datetime.now())
+    assert cache.entries[key]["tail_invalid"]
+    await cache.get(end - 3 * HOUR, end, HOUR, compute)
+    assert cache.stats()["tail_refreshes"] == 1
+    # a backdated entry changes a bucket that isn't recomputed, so the whole range is dropped
+    cache.invalidate(key[0])
+    assert key not in cache.entries
+
+
+@pytest.mark.asyncio
+async def test_written_entries_invalidate_the_app_cache():
+    cache = StatsCache(ttl=3600)
+    compute = Compute()
+    start = dt.datetime.now() - 2 * HOUR
+    await cache.get(start, start + 3 * HOUR, HOUR, compute)
+    interface = Serial(MemoryStorage(), asyncio.get_event_loop(), {})
+    interface.stats_cache = cache
+    await interface.entries_written([{"timestamp": dt.datetime.now()}])
+    assert cache.stats()["invalidations"] == 1
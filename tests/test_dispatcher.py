@@ -0,0 +1,71 @@
+"""Dispatching of commands received over the serial connection."""
+
+import asyncio
+
+import pytest
+
+from cherrydoor.interface.dispatcher import CommandDispatcher
+
+
+def recording_handlers(handled, slow=()):
+    """Create handlers that append (command, argument) to handled, sleeping first for slow commands."""
+
+    def handler(command):
+        async def handle(argument):
+            if command in slow:
+                await asyncio.sleep(0.02)
+            handled.append((command, argument))
+
+        return handle
+
+    return {command: handler(command) for command in ["CARD", "STATUS", "PONG"]}
+
+
+@pytest.mark.asyncio
+async def test_queued_commands_are_handled_in_order():
+    handled = []
+    dispatcher = CommandDispatcher(recording_handlers(handled, slow=("CARD",)))
+    worker = asyncio.create_task(dispatcher.run())
+    for i in range(5):
+        assert await dispatcher.dispatch("CARD", str(i))
+    await dispatcher.queue.join()
+    worker.cancel()
+    assert handled == [("CARD", str(i)) for i in range(5)]
+    assert dispatcher.stats()["commands"]["CARD"]["count"] == 5
+
+
+@pytest.mark.asyncio
+async def test_status_updates_dont_wait_for_queued_commands():
+    handled = []
+    dispatcher = CommandDispatcher(recording_handlers(handled, slow=("CARD",)))
+    worker = asyncio.create_task(dispatcher.run())
+    await dispatcher.dispatch("CARD", "a")
+    await dispatcher.dispatch("STATUS", "1")
+    await dispatcher.dispatch("PONG", "0")
+    # handled inline, while the card is still being authenticated
+    assert handled == [("STATUS", "1"), ("PONG", "0")]
+    await dispatcher.queue.join()
+    worker.cancel()
+    assert handled[-1] == ("CARD", "a")
+
+
+@pytest.mark.asyncio
+async def test_unknown_commands_and_failing_handlers():
+    handled = []
+    handlers = recording_handlers(handled)
+
+    async def fail(argument):
+        raise ValueError(argument)
+
+    handlers["CARD"] = fail
+    dispatcher = CommandDispatcher(handlers)
+    worker = asyncio.create_task(dispatcher.run())
+    assert not await dispatcher.dispatch("NOPE", "x")
+    await dispatcher.dispatch("CARD", "a")
+    await dispatcher.dispatch("CARD", "b")
+    await dispatcher.queue.join()
+    # the worker keeps going after a handler failed
+    assert not worker.done()
+    worker.cancel()
+    assert dispatcher.stats()["commands"]["CARD"]["errors"] == 2
+    assert "NOPE" not in dispatcher.stats()["commands"]
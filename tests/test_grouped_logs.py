@@ -0,0 +1,73 @@
+"""Bucketing of logs for entry statistics."""
+
+import datetime as dt
+
+import pytest
+
+from cherrydoor.database.mongo import downsample, fill_buckets
+
+START = dt.datetime(2021, 9, 1)
+
+
+async def iterate(documents):
+    for document in documents:
+        yield document
+
+
+def test_downsample_keeps_granularity_below_max_buckets():
+    granularity, buckets = downsample(START, START + dt.timedelta(hours=1), 60)
+    assert granularity == dt.timedelta(minutes=1)
+    assert buckets == 60
+
+
+def test_downsample_increases_granularity():
+    granularity, buckets = downsample(
+        START, START + dt.timedelta(days=1), dt.timedelta(minutes=1), max_buckets=100
+    )
+    assert granularity == dt.timedelta(minutes=15)
+    assert buckets == 96
+
+
+def test_downsample_partial_bucket():
+    granularity, buckets = downsample(START, START + dt.timedelta(seconds=90), 60)
+    assert buckets == 2
+
+
+def test_downsample_empty_range():
+    assert downsample(START, START, 60)[1] == 1
+
+
+def test_downsample_rejects_non_positive_granularity():
+    with pytest.raises(ValueError):
+        downsample(START, START + dt.timedelta(hours=1), 0)
+
+
+@pytest.mark.asyncio
+async def test_fill_buckets_adds_empty_buckets():
+    granularity = dt.timedelta(minutes=10)
+    logs = await fill_buckets(
+        iterate(
+            [
+                {"_id": 1, "count": 3, "successful": 2, "during_break": 1},
+                {"_id": 3, "count": 1, "successful": 1, "during_break": 0},
+            ]
+        ),
+        START,
+        5,
+        granularity,
+    )
+    assert [log["count"] for log in logs] == [0, 3, 0, 1, 0]
+    assert logs[1] == {
+        "date_from": (START + granularity).isoformat(),
+        "date_to": (START + 2 * granularity).isoformat(),
+        "count": 3,
+        "successful": 2,
+        "during_break": 1,
+    }
+    assert logs[-1]["date_to"] == (START + 5 * granularity).isoformat()
+
+
+@pytest.mark.asyncio
+async def test_fill_buckets_without_logs():
+    logs = await fill_buckets(iterate([]), START, 3, dt.timedelta(hours=1))
+    assert [log["count"] for log in logs] == [0, 0, 0]
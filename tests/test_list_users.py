@@ -0,0 +1,80 @@
+"""Keyset pagination of the user list."""
+
+import pytest
+import pytest_asyncio
+
+from cherrydoor.database import list_users
+from cherrydoor.database.storage import create_storage
+
+NAMES = ["eve", "alice", "dave", "bob", "carol"]
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite"])
+async def app(request, tmp_path):
+    storage = create_storage(
+        {
+            "storage": {
+                "engine": request.param,
+                "path": str(tmp_path / "cherrydoor.sqlite"),
+            }
+        }
+    )
+    await storage.setup({})
+    await storage.insert_users(
+        [
+            {
+                "username": name,
+                "permissions": ["enter", "admin"] if i % 2 else ["enter"],
+                "cards": [f"{'ab' if i < 2 else 'cd'}{i:06x}"],
+            }
+            for i, name in enumerate(NAMES)
+        ]
+    )
+    yield {"storage": storage}
+    await storage.close()
+
+
+async def all_pages(app, **kwargs):
+    """Follow the after cursor until the last page, return usernames of each page."""
+    pages = []
+    after = None
+    while True:
+        users, after = await list_users(app, after=after, **kwargs)
+        pages.append([user["username"] for user in users])
+        if after is None:
+            return pages
+
+
+@pytest.mark.asyncio
+async def test_pages_by_username(app):
+    assert await all_pages(app, limit=2) == [
+        ["alice", "bob"],
+        ["carol", "dave"],
+        ["eve"],
+    ]
+    # an exactly full last page doesn't lead to an empty one
+    assert await all_pages(app, limit=5) == [sorted(NAMES)]
+
+
+@pytest.mark.asyncio
+async def test_pages_by_id(app):
+    pages = await all_pages(app, sort="_id", limit=2, return_fields=["username"])
+    assert [name for page in pages for name in page] == NAMES
+    users, after = await list_users(app, sort="_id", limit=1, return_fields=[])
+    # the sort field is always returned, so the next page can be requested
+    assert list(users[0]) == ["_id"]
+    assert after == users[0]["_id"]
+
+
+@pytest.mark.asyncio
+async def test_filters(app):
+    assert await all_pages(app, limit=1, permission="admin") == [["alice"], ["bob"]]
+    assert await all_pages(app, card_prefix="ab") == [["alice", "eve"]]
+    # the prefix isn't a regular expression
+    assert await all_pages(app, card_prefix=".") == [[]]
+
+
+@pytest.mark.asyncio
+async def test_unsupported_sort(app):
+    with pytest.raises(ValueError):
+        await list_users(app, sort="cards")
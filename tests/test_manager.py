@@ -0,0 +1,83 @@
+"""Management of multiple card readers."""
+
+import asyncio
+
+import pytest
+
+from cherrydoor.database.storage import MemoryStorage
+from cherrydoor.interface.manager import ReaderManager
+
+CONFIG = {
+    "interface": {"port": "/dev/serial0", "baudrate": 115200, "framed": False},
+    "manufacturer_code": ["18"],
+    "doors": [
+        {"id": "front"},
+        {
+            "id": "back",
+            "port": "/dev/serial1",
+            "framed": True,
+            "manufacturer_code": ["20"],
+            "delay": 2,
+            "break_times": [],
+        },
+    ],
+}
+
+
+@pytest.mark.asyncio
+async def test_doors_override_the_interface_config():
+    readers = ReaderManager(MemoryStorage(), asyncio.get_event_loop(), CONFIG)
+    assert len(readers) == 2
+    front, back = readers.get("front"), readers.get("back")
+    assert readers.get() is front
+    assert front.primary is None
+    assert back.primary is front
+    assert back.card_index is front.card_index
+    assert front.config["interface"]["port"] == "/dev/serial0"
+    assert back.config["interface"] == {
+        "port": "/dev/serial1",
+        "baudrate": 115200,
+        "framed": True,
+    }
+    assert back.config["manufacturer_code"] == ["20"]
+    # the door's delay is fixed, break times still come from the database
+    assert back.delay == 2
+    assert "delay" not in back.watched_settings
+    assert "break_times" in back.watched_settings
+    with pytest.raises(KeyError):
+        readers.get("side")
+
+
+@pytest.mark.asyncio
+async def test_single_door_without_doors_config():
+    config = {key: value for key, value in CONFIG.items() if key != "doors"}
+    readers = ReaderManager(MemoryStorage(), asyncio.get_event_loop(), config)
+    assert len(readers) == 1
+    assert readers.get().door_id is None
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_doors_and_cards():
+    readers = ReaderManager(MemoryStorage(), asyncio.get_event_loop(), CONFIG)
+    front, back = readers.get("front"), readers.get("back")
+    assert not await readers.wait_for_door_change(timeout=0.01)
+    waiter = asyncio.ensure_future(readers.wait_for_door_change(timeout=1))
+    # let the waiters start waiting
+    await asyncio.sleep(0.01)
+    back.set_door_state(True)
+    assert await waiter
+    assert readers.status() == {
+        "front": {"open": False, "break": False},
+        "back": {"open": True, "break": False},
+    }
+
+    # waiting for a single door ignores cards read by the others
+    waiter = asyncio.ensure_future(readers.wait_for_card("back", timeout=0.1))
+    any_door = asyncio.ensure_future(readers.wait_for_card(timeout=1))
+    # let the waiters start waiting
+    await asyncio.sleep(0.01)
+    front.last_uid = "01020304"
+    front.card_event.set()
+    front.card_event.clear()
+    assert await any_door == ("front", "01020304")
+    assert await waiter is None
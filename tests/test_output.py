@@ -0,0 +1,70 @@
+"""Prioritized writer queue of the serial connection."""
+
+import asyncio
+
+import pytest
+
+from cherrydoor.interface.output import OutputQueue, priority
+
+
+def test_priority_of_plain_and_framed_lines():
+    assert priority("AUTH 1") == 0
+    assert priority("@01 AUTH 1 AB") == 0
+    assert priority("NTFY 3") == 1
+    assert priority("DOOR 1") == 2
+    assert priority("PING") == 3
+
+
+@pytest.mark.asyncio
+async def test_lines_are_written_by_priority_and_coalesced():
+    writes = []
+
+    async def write(data):
+        writes.append(data)
+
+    queue = OutputQueue(write)
+    lines = ["PING", "DOOR 1", "NTFY 3", "AUTH 1", "AUTH 0"]
+    # queue everything before the writer starts, so all lines are waiting at once
+    puts = [asyncio.ensure_future(queue.put(line)) for line in lines]
+    await asyncio.sleep(0)
+    queue.start()
+    assert await asyncio.gather(*puts) == [True] * 5
+    queue.close()
+    assert writes == [b"AUTH 1\nAUTH 0\nNTFY 3\nDOOR 1\nPING\n"]
+    assert queue.stats()["lines"] == 5
+    assert queue.stats()["writes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batches_are_limited_by_size():
+    writes = []
+
+    async def write(data):
+        writes.append(data)
+
+    queue = OutputQueue(write, max_batch=14)
+    puts = [asyncio.ensure_future(queue.put(f"DOOR {i}")) for i in range(3)]
+    await asyncio.sleep(0)
+    queue.start()
+    await asyncio.gather(*puts)
+    queue.close()
+    assert writes == [b"DOOR 0\nDOOR 1\n", b"DOOR 2\n"]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_reported():
+    errors = []
+
+    async def write(data):
+        raise OSError("disconnected")
+
+    async def on_error(e):
+        errors.append(e)
+
+    queue = OutputQueue(write, on_error=on_error)
+    queue.start()
+    assert not await queue.put("AUTH 1")
+    queue.close()
+    assert len(errors) == 1
+    assert queue.stats()["errors"] == 1
+    assert queue.stats()["lines"] == 0
@@ -0,0 +1,178 @@
+"""Pre-aggregated entry statistics."""
+
+import datetime as dt
+
+import pytest
+
+from cherrydoor.database.rollups import (
+    BACKFILL_SETTING,
+    backfill_rollups,
+    bucket_start,
+    get_rollup_stats,
+    rollups_backfilled,
+    update_rollups,
+)
+
+
+class Cursor:
+    """Async iterator over a list of documents."""
+
+    def __init__(self, documents):
+        self.documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.documents)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+
+class Collection:
+    """The part of a Motor collection used by rollups, with documents kept by _id."""
+
+    def __init__(self):
+        self.documents = {}
+        self.bulk_writes = 0
+        # result of aggregate() - the logs collection is already grouped by minute
+        self.minutes = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.bulk_writes += 1
+        for request in requests:
+            _id = request._filter["_id"]
+            document = self.documents.setdefault(_id, {"_id": _id})
+            for counter, value in request._doc.get("$inc", {}).items():
+                document[counter] = document.get(counter, 0) + value
+            document.update(request._doc.get("$set", {}))
+
+    def aggregate(self, pipeline, **kwargs):
+        return Cursor([dict(document) for document in self.minutes])
+
+    def find(self, query, sort=None):
+        return Cursor(
+            document
+            for _id, document in sorted(self.documents.items())
+            if query["_id"]["$gte"] <= _id <= query["_id"]["$lte"]
+        )
+
+    async def find_one(self, query, projection=None):
+        return next(iter(self.documents.values()), None)
+
+    async def update_one(self, query, update, upsert=False):
+        self.documents[query["setting"]] = {**query, **update["$set"]}
+
+
+class Database(dict):
+    def __missing__(self, name):
+        self[name] = Collection()
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def entry(timestamp, success=True, auth_mode="UID"):
+    return {"timestamp": timestamp, "success": success, "auth_mode": auth_mode}
+
+
+def test_bucket_start():
+    timestamp = dt.datetime(2021, 3, 4, 5, 6, 7, 8)
+    assert bucket_start(timestamp, dt.timedelta(minutes=1)) == dt.datetime(
+        2021, 3, 4, 5, 6
+    )
+    assert bucket_start(timestamp, dt.timedelta(days=1)) == dt.datetime(2021, 3, 4)
+
+
+@pytest.mark.asyncio
+async def test_entries_are_added_with_one_upsert_per_bucket():
+    db = Database()
+    start = dt.datetime(2021, 3, 4, 5, 6)
+    await update_rollups(
+        db,
+        [
+            entry(start),
+            entry(start + dt.timedelta(seconds=30), success=False),
+            entry(start + dt.timedelta(minutes=1), auth_mode="Manufacturer code"),
+        ],
+    )
+    await update_rollups(db, [entry(start + dt.timedelta(seconds=59))])
+    minutes = db.logs_rollup_minute.documents
+    assert minutes[start] == {
+        "_id": start,
+        "count": 3,
+        "successful": 2,
+        "during_break": 0,
+    }
+    assert minutes[start + dt.timedelta(minutes=1)]["during_break"] == 1
+    hour = db.logs_rollup_hour.documents[dt.datetime(2021, 3, 4, 5)]
+    assert hour["count"] == 4
+    assert hour["successful"] == 3
+    assert db.logs_rollup_day.documents[dt.datetime(2021, 3, 4)]["count"] == 4
+    assert db.logs_rollup_minute.bulk_writes == 2
+
+
+@pytest.mark.asyncio
+async def test_backfill_overwrites_buckets_and_is_recorded():
+    db = Database()
+    start = dt.datetime(2021, 3, 4, 5, 6)
+    db.logs.minutes = [
+        {"_id": start, "count": 2, "successful": 1, "during_break": 0},
+        {
+            "_id": start + dt.timedelta(hours=1),
+            "count": 3,
+            "successful": 3,
+            "during_break": 1,
+        },
+    ]
+    db.logs.documents[0] = entry(start)
+    # counted before the backfill, it must not be added to the rebuilt buckets
+    await update_rollups(db, [entry(start)])
+    assert not await rollups_backfilled(db)
+    written = await backfill_rollups(db, since=start)
+    assert written == {
+        "logs_rollup_day": 1,
+        "logs_rollup_hour": 2,
+        "logs_rollup_minute": 2,
+    }
+    assert db.logs_rollup_minute.documents[start]["count"] == 2
+    assert db.logs_rollup_day.documents[dt.datetime(2021, 3, 4)]["count"] == 5
+    # only a full rebuild covers all logs
+    assert not await rollups_backfilled(db)
+    await backfill_rollups(db)
+    assert BACKFILL_SETTING in db.settings.documents
+    assert await rollups_backfilled(db)
+
+
+@pytest.mark.asyncio
+async def test_empty_database_is_backfilled():
+    db = Database()
+    assert await rollups_backfilled(db)
+    assert BACKFILL_SETTING in db.settings.documents
+
+
+@pytest.mark.asyncio
+async def test_stats_are_read_from_the_coarsest_fitting_rollup():
+    db = Database()
+    start = dt.datetime(2021, 3, 4)
+    await update_rollups(
+        db,
+        [entry(start + dt.timedelta(hours=hour)) for hour in [0, 0, 2]],
+    )
+    stats = await get_rollup_stats(
+        db,
+        start + dt.timedelta(minutes=30),
+        start + dt.timedelta(hours=3),
+        dt.timedelta(hours=1),
+    )
+    # the start is rounded down to a whole hour
+    assert [point["count"] for point in stats] == [2, 0, 1]
+    assert stats[0]["date_from"] == start.isoformat()
+    assert (
+        await get_rollup_stats(
+            db, start, start + dt.timedelta(hours=1), dt.timedelta(seconds=30)
+        )
+        is None
+    )
@@ -0,0 +1,109 @@
+"""Collection options and indexes applied by diffing them against the database."""
+
+from cherrydoor.database.schema import desired_schema, logs_indexes, plan_collection
+
+
+def index_information(models):
+    """Get indexes in the index_information() format, as if they were created from models."""
+    indexes = {"_id_": {"key": [("_id", 1)], "v": 2}}
+    for model in models:
+        document = dict(model.document)
+        name = document.pop("name")
+        indexes[name] = {"key": list(document.pop("key").items()), "v": 2, **document}
+    return indexes
+
+
+def test_logs_are_kept_forever_by_default():
+    timestamp_index = logs_indexes()[0].document
+    assert "expireAfterSeconds" not in timestamp_index
+    assert logs_indexes(3600)[0].document["expireAfterSeconds"] == 3600
+
+
+def test_adding_retention_recreates_the_timestamp_index():
+    spec = desired_schema({"logs": {"retention": 3600}})["logs"]
+    operations = plan_collection(
+        "logs", spec, True, {}, index_information(logs_indexes())
+    )
+    assert [operation for operation, _ in operations] == [
+        "drop_index",
+        "create_indexes",
+    ]
+    assert operations[0][1] == {"name": "timestamp_index"}
+    (model,) = operations[1][1]["indexes"]
+    assert model.document["expireAfterSeconds"] == 3600
+
+
+def test_changing_retention_only_modifies_the_index():
+    spec = desired_schema({"logs": {"retention": 7200}})["logs"]
+    operations = plan_collection(
+        "logs", spec, True, {}, index_information(logs_indexes(3600))
+    )
+    assert operations == [
+        (
+            "collMod",
+            {"index": {"name": "timestamp_index", "expireAfterSeconds": 7200}},
+        )
+    ]
+
+
+def test_missing_collections_are_created():
+    schema = desired_schema({})
+    operations = plan_collection("terminal", schema["terminal"], False, {}, {})
+    assert operations == [
+        ("create_collection", {"capped": True, "size": 100000000, "max": 10000})
+    ]
+    operations = plan_collection("logs", schema["logs"], False, {}, {})
+    assert operations[0] == ("create_collection", {})
+    assert operations[1][0] == "create_indexes"
+    assert [model.document["name"] for model in operations[1][1]["indexes"]] == [
+        "timestamp_index",
+        "card_timestamp_index",
+    ]
+
+
+def test_matching_collection_needs_no_operations():
+    spec = desired_schema({})["users"]
+    assert (
+        plan_collection("users", spec, True, {}, index_information(spec["indexes"]))
+        == []
+    )
+
+
+def test_changed_and_missing_indexes():
+    spec = desired_schema({})["users"]
+    indexes = index_information(spec["indexes"])
+    del indexes["token_index"]
+    # created without unique
+    indexes["username_index"] = {"key": [("username", 1)], "v": 2}
+    operations = plan_collection("users", spec, True, {}, indexes)
+    assert operations[0] == ("drop_index", {"name": "username_index"})
+    assert operations[1][0] == "create_indexes"
+    assert [model.document["name"] for model in operations[1][1]["indexes"]] == [
+        "username_index",
+        "token_index",
+    ]
+
+
+def test_capped_collection_options():
+    spec = desired_schema({"command_log_size": 1000})["terminal"]
+    assert plan_collection("terminal", spec, True, {}, {}) == [
+        ("convertToCapped", {"size": 1000}),
+        ("collMod", {"cappedMax": 10000}),
+    ]
+    # MongoDB rounds the size up to a multiple of 256
+    options = {"capped": True, "size": 1024, "max": 10000}
+    assert plan_collection("terminal", spec, True, options, {}) == []
+    options = {"capped": True, "size": 4096, "max": 500}
+    assert plan_collection("terminal", spec, True, options, {}) == [
+        ("collMod", {"cappedSize": 1024, "cappedMax": 10000})
+    ]
+
+
+def test_capped_collections_dont_get_ttl_indexes():
+    spec = {
+        **desired_schema({"command_log_size": 1000})["terminal"],
+        "indexes": logs_indexes(3600),
+    }
+    operations = plan_collection("terminal", spec, False, {}, {})
+    model, _ = operations[-1][1]["indexes"]
+    assert "expireAfterSeconds" not in model.document
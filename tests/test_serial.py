@@ -0,0 +1,170 @@
+"""Serial interface talking to a simulated arduino, with in-memory storage."""
+
+import asyncio
+from contextlib import asynccontextmanager
+from time import monotonic
+
+import pytest
+
+from cherrydoor.database.storage import MemoryStorage
+from cherrydoor.interface.allowlist import uid_hash
+from cherrydoor.interface.serial import Serial
+from cherrydoor.interface.simulator import ArduinoSimulator
+
+
+async def wait_until(condition, timeout=3):
+    """Wait until condition() is true, fail the test if it takes longer than timeout seconds."""
+    end = monotonic() + timeout
+    while not condition():
+        if monotonic() > end:
+            pytest.fail("timed out waiting for the simulated arduino")
+        await asyncio.sleep(0.01)
+
+
+@asynccontextmanager
+async def connected(framed=False, device_allowlist=False, dedupe_window=0):
+    """Connect a Serial to a simulated arduino with one allowed and one unknown card.
+
+    Yields the simulator, the interface, the storage and block 0 of the allowed and unknown card.
+    """
+    simulator = ArduinoSimulator(cards=2, uid_lengths=(4,), framed=framed)
+    allowed, unknown = simulator.cards
+    storage = MemoryStorage()
+    await storage.insert_users(
+        [
+            {
+                "username": "test",
+                "permissions": ["enter"],
+                # cards are registered the way Serial reads them - lowercase hex
+                "cards": [simulator.uids[allowed].lower()],
+            }
+        ]
+    )
+    config = {
+        "interface": {
+            "port": simulator.open(),
+            "baudrate": 115200,
+            "backend": "native",
+            "framed": framed,
+            "negotiation_timeout": 1,
+            "ack_timeout": 0.2,
+            "dedupe_window": dedupe_window,
+        },
+        "manufacturer_code": ["18"],
+        "stats": {"rollups": False},
+        "device_allowlist": {
+            "enabled": device_allowlist,
+            "ack_timeout": 1,
+            "debounce": 0,
+        },
+    }
+    interface = Serial(storage, asyncio.get_event_loop(), config)
+    await interface.card_index.load(storage)
+    interface.init_log_writers()
+    await interface.serial_init()
+    interface.tasks["serial_listener"] = asyncio.create_task(interface.commands())
+    interface.tasks["serial_dispatcher"] = asyncio.create_task(
+        interface.dispatcher.run()
+    )
+    try:
+        yield simulator, interface, storage, allowed, unknown
+    finally:
+        await interface.cleanup()
+        simulator.close()
+
+
+@pytest.mark.asyncio
+async def test_card_is_answered_with_auth():
+    async with connected() as (simulator, interface, storage, allowed, unknown):
+        # plain-text results are sent twice, so wait for both before the next swipe
+        simulator.swipe(allowed)
+        await wait_until(lambda: simulator.received.get("AUTH", 0) == 2)
+        simulator.swipe(unknown)
+        await wait_until(lambda: simulator.received.get("AUTH", 0) == 4)
+        report = simulator.report()
+        assert report["allowed"] == 1
+        assert report["denied"] == 1
+        assert report["duplicate_auth"] == 2
+    assert [entry["success"] for entry in storage.logs] == [True, False]
+    assert storage.logs[0]["auth_mode"] == "UID"
+
+
+@pytest.mark.asyncio
+async def test_overlapping_swipes_are_matched_with_their_results():
+    async with connected() as (simulator, interface, storage, allowed, unknown):
+        for block0 in [allowed, unknown, allowed, unknown, unknown]:
+            simulator.swipe(block0)
+        await wait_until(lambda: not simulator.pending)
+        report = simulator.report()
+        assert report["answered"] == 5
+        assert report["unanswered"] == 0
+        assert report["allowed"] == 2
+        assert report["denied"] == 3
+        assert report["duplicate_auth"] == 5
+        assert len(simulator.latencies) == 5
+
+
+@pytest.mark.asyncio
+async def test_repeated_swipes_are_answered_and_logged_once():
+    async with connected(dedupe_window=500) as (simulator, interface, storage, *_):
+        allowed = simulator.cards[0]
+        for _ in range(3):
+            simulator.swipe(allowed)
+            # repeats are answered the same way as the first swipe - twice in plain-text mode
+            await wait_until(lambda: not simulator.pending)
+        report = simulator.report()
+        assert report["allowed"] == 3
+        assert report["duplicate_auth"] == 3
+        assert interface.duplicate_swipes == 2
+        # still in the dedupe window
+        assert not storage.logs
+    assert len(storage.logs) == 1
+    assert storage.logs[0]["success"]
+    assert storage.logs[0]["repeats"] == 2
+
+
+@pytest.mark.asyncio
+async def test_framed_commands_are_retransmitted_after_nak():
+    async with connected(framed=True) as (simulator, interface, *_, allowed, _):
+        await interface.negotiate_protocol()
+        assert interface.framed
+        simulator.corrupt_frames = 1
+        simulator.swipe(allowed)
+        await wait_until(lambda: not simulator.pending)
+        await wait_until(lambda: not interface.protocol.pending)
+        report = simulator.report()
+        assert report["allowed"] == 1
+        # framed results are only sent once
+        assert report["duplicate_auth"] == 0
+        assert report["frames"] == {"ACK": 1, "NAK": 1}
+        assert interface.protocol.retransmitted == 1
+        assert interface.protocol.failed == 0
+
+
+@pytest.mark.asyncio
+async def test_allowlist_is_uploaded_and_used_by_the_device():
+    async with connected(device_allowlist=True) as (
+        simulator,
+        interface,
+        storage,
+        allowed,
+        unknown,
+    ):
+        interface.tasks["allowlist_uploader"] = asyncio.create_task(
+            interface.allowlist_uploader()
+        )
+        await wait_until(lambda: interface.device_allowlist.version > 0)
+        assert simulator.allowlist == {uid_hash(simulator.uids[allowed])}
+        assert simulator.allowlist_version == interface.device_allowlist.version
+        assert interface.device_allowlist.stats()["full_uploads"] == 1
+        simulator.swipe(allowed)
+        await wait_until(lambda: interface.device_decisions == 1)
+        assert simulator.report()["local_decisions"] == 1
+        # unknown cards are still sent to Cherrydoor
+        simulator.swipe(unknown)
+        await wait_until(lambda: not simulator.pending)
+        assert simulator.report()["denied"] == 1
+    assert [entry["auth_mode"] for entry in storage.logs] == [
+        "Device allowlist",
+        "UID",
+    ]
@@ -0,0 +1,114 @@
+"""Local spool for documents that couldn't be written to the database."""
+
+import datetime as dt
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from cherrydoor.database.spool import Spool
+
+
+class Collection:
+    """Collection that records inserted documents and fails the insert with the given number."""
+
+    def __init__(self, fail_at=None, error=None):
+        self.batches = []
+        self.fail_at = fail_at
+        self.error = error
+
+    async def insert_many(self, documents, ordered=False):
+        if len(self.batches) == self.fail_at:
+            self.fail_at = None
+            raise self.error
+        self.batches.append(documents)
+        return SimpleNamespace(inserted_ids=[document["i"] for document in documents])
+
+    @property
+    def documents(self):
+        return [document["i"] for batch in self.batches for document in batch]
+
+
+@pytest.mark.asyncio
+async def test_documents_are_replayed_in_batches(tmp_path):
+    spool = Spool(str(tmp_path / "logs.spool"), batch_size=2)
+    assert not spool.pending()
+    timestamp = dt.datetime(2021, 3, 4, 5, 6, 7)
+    await spool.append([{"i": 0, "timestamp": timestamp}, {"i": 1}])
+    await spool.append([{"i": 2}])
+    assert spool.pending()
+    collection = Collection()
+    written = []
+
+    async def on_write(documents):
+        written.append(len(documents))
+
+    assert await spool.replay(collection, on_write) == 3
+    assert [len(batch) for batch in collection.batches] == [2, 1]
+    assert collection.documents == [0, 1, 2]
+    # documents are spooled as extended JSON, so types are kept
+    assert collection.batches[0][0]["timestamp"] == timestamp
+    assert written == [2, 1]
+    assert not spool.pending()
+    assert spool.stats()["replayed"] == 3
+    assert await spool.replay(collection) == 0
+
+
+@pytest.mark.asyncio
+async def test_replay_stops_when_the_database_fails(tmp_path):
+    spool = Spool(str(tmp_path / "logs.spool"), batch_size=2)
+    await spool.append([{"i": i} for i in range(5)])
+    collection = Collection(fail_at=1, error=AutoReconnect("down"))
+    assert await spool.replay(collection) == 2
+    assert spool.pending()
+    # appended while the replay file was waiting, replayed after it
+    await spool.append([{"i": 5}])
+    assert await spool.replay(collection) == 4
+    assert collection.documents == list(range(6))
+    assert not spool.pending()
+
+
+@pytest.mark.asyncio
+async def test_rejected_documents_arent_retried(tmp_path):
+    spool = Spool(str(tmp_path / "logs.spool"))
+    await spool.append([{"i": i} for i in range(3)])
+    error = BulkWriteError(
+        {"nInserted": 2, "writeErrors": [{"index": 1, "errmsg": "duplicate key"}]}
+    )
+    written = []
+
+    async def on_write(documents):
+        written.extend(document["i"] for document in documents)
+
+    assert await spool.replay(Collection(fail_at=0, error=error), on_write) == 3
+    assert written == [0, 2]
+    assert not spool.pending()
+
+
+@pytest.mark.asyncio
+async def test_file_operations_dont_block_the_event_loop(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path / "logs.spool"))
+    await spool.append([{"i": 0}])
+    loop_thread = threading.get_ident()
+    threads = []
+    real_replace = os.replace
+
+    def replace(*args):
+        threads.append(threading.get_ident())
+        return real_replace(*args)
+
+    monkeypatch.setattr(os, "replace", replace)
+    for name in ["read_replay", "rewrite_replay"]:
+        method = getattr(spool, name)
+
+        def record(*args, method=method):
+            threads.append(threading.get_ident())
+            return method(*args)
+
+        monkeypatch.setattr(spool, name, record)
+    await spool.replay(Collection(fail_at=0, error=AutoReconnect("down")))
+    await spool.replay(Collection())
+    assert len(threads) == 4
+    assert loop_thread not in threads
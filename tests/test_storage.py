@@ -0,0 +1,224 @@
+"""Storage engines without MongoDB and the query matching they use."""
+
+import datetime as dt
+
+import pytest
+import pytest_asyncio
+from pymongo.errors import DuplicateKeyError
+
+from cherrydoor.database.storage import (
+    SqliteStorage,
+    Storage,
+    StorageError,
+    create_storage,
+)
+from cherrydoor.database.storage.base import matches
+
+USER = {
+    "_id": "b",
+    "username": "test",
+    "permissions": ["enter", "cards"],
+    "cards": ["deadbeef", "cafebabe"],
+    "tokens": [{"name": "api", "token": "secret"}],
+}
+
+
+def test_equality():
+    assert matches(USER, {"username": "test"})
+    assert not matches(USER, {"username": "other"})
+    assert matches(USER, {})
+
+
+def test_array_membership():
+    assert matches(USER, {"cards": "deadbeef"})
+    assert not matches(USER, {"cards": "00000000"})
+    # a list has to be equal, like in MongoDB
+    assert matches(USER, {"permissions": ["enter", "cards"]})
+    assert not matches(USER, {"permissions": ["enter"]})
+
+
+def test_tokens():
+    assert matches(USER, {"tokens.token": "secret"})
+    assert not matches(USER, {"tokens.token": "public"})
+
+
+def test_operators():
+    assert matches(USER, {"permissions": {"$in": ["admin", "enter"]}})
+    assert not matches(USER, {"permissions": {"$in": ["admin"]}})
+    assert matches(USER, {"_id": {"$gt": "a"}})
+    assert not matches(USER, {"_id": {"$gt": "b"}})
+    assert matches(USER, {"cards": {"$regex": "^cafe"}})
+    assert not matches(USER, {"cards": {"$regex": "^f00d"}})
+
+
+def test_all_conditions_have_to_match():
+    assert matches(USER, {"username": "test", "cards": "deadbeef"})
+    assert not matches(USER, {"username": "test", "cards": "00000000"})
+
+
+def test_missing_field():
+    assert not matches(USER, {"email": "test@example.com"})
+    assert not matches(USER, {"email": {"$gt": ""}})
+
+
+def test_unsupported_operator():
+    with pytest.raises(StorageError):
+        matches(USER, {"cards": {"$size": 2}})
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite"])
+async def storage(request, tmp_path):
+    engine = create_storage(
+        {
+            "storage": {
+                "engine": request.param,
+                "path": str(tmp_path / "cherrydoor.sqlite"),
+            }
+        }
+    )
+    await engine.setup({})
+    yield engine
+    await engine.close()
+
+
+@pytest.mark.asyncio
+async def test_users(storage):
+    ids = await storage.insert_users(
+        [
+            {"username": "b", "permissions": ["enter"], "cards": ["deadbeef"]},
+            {"username": "a", "permissions": [], "cards": []},
+        ]
+    )
+    with pytest.raises(DuplicateKeyError):
+        await storage.insert_users([{"username": "a", "permissions": [], "cards": []}])
+    user = await storage.find_user({"cards": "deadbeef"}, ["username"])
+    assert user == {"username": "b"}
+    assert (await storage.find_user({"_id": ids[1]}))["username"] == "a"
+    assert await storage.find_user({"username": "c"}) is None
+    assert await storage.count_users({}) == 2
+    assert await storage.count_users({"permissions": "enter"}) == 1
+    assert await storage.count_users({"cards": "00000000"}) == 0
+    usernames = [
+        user["username"]
+        async for user in storage.find_users({}, ["username"], sort="username")
+    ]
+    assert usernames == ["a", "b"]
+
+    user = await storage.update_user(
+        {"username": "a"},
+        set={"username": "c"},
+        add={"cards": ["cafebabe"]},
+        fields=["username", "cards"],
+    )
+    assert user == {"username": "c", "cards": ["cafebabe"]}
+    # the lookup by card follows the change
+    assert (await storage.find_user({"cards": "cafebabe"}))["_id"] == ids[1]
+    await storage.update_user({"_id": ids[1]}, remove={"cards": ["cafebabe"]})
+    assert await storage.find_user({"cards": "cafebabe"}) is None
+
+    await storage.add_token(ids[0], "api", "secret")
+    assert (await storage.find_user({"tokens.token": "secret"}))["_id"] == ids[0]
+    assert await storage.delete_user({"username": "b"})
+    assert not await storage.delete_user({"username": "b"})
+    assert await storage.find_user({"tokens.token": "secret"}) is None
+
+
+@pytest.mark.asyncio
+async def test_user_changes_are_notified(storage):
+    async with storage.watch("users", ["insert", "delete"]) as changes:
+        (identity,) = await storage.insert_users([{"username": "a"}])
+        await storage.update_user({"_id": identity}, set={"cards": ["deadbeef"]})
+        await storage.delete_user({"_id": identity})
+        insert = await changes.__anext__()
+        assert insert["operationType"] == "insert"
+        assert insert["fullDocument"]["username"] == "a"
+        # updates weren't asked for
+        delete = await changes.__anext__()
+        assert delete == {"operationType": "delete", "documentKey": {"_id": identity}}
+
+
+@pytest.mark.asyncio
+async def test_settings(storage):
+    await storage.set_setting("delay", 2)
+    assert await storage.get_settings(["delay"]) == {}
+    await storage.set_setting("delay", 2, upsert=True)
+    await storage.set_setting("require_auth", False, upsert=True, manual=True)
+    settings = await storage.get_settings()
+    assert settings["delay"]["value"] == 2
+    assert settings["require_auth"]["manual"]
+    assert list(await storage.get_settings(["delay"])) == ["delay"]
+
+
+@pytest.mark.asyncio
+async def test_grouped_logs(storage):
+    start = dt.datetime(2021, 3, 4)
+    writer = storage.writer("logs")
+    result = await writer.insert_many(
+        [
+            {"timestamp": start, "success": True, "auth_mode": "UID"},
+            {
+                "timestamp": start + dt.timedelta(minutes=1),
+                "success": True,
+                "auth_mode": "Manufacturer code",
+            },
+            {
+                "timestamp": start + dt.timedelta(hours=1),
+                "success": False,
+                "auth_mode": "UID",
+            },
+        ]
+    )
+    assert len(result.inserted_ids) == 3
+    stats = await storage.grouped_logs(
+        start, start + dt.timedelta(hours=2), dt.timedelta(hours=1), 100
+    )
+    assert [
+        (point["count"], point["successful"], point["during_break"]) for point in stats
+    ] == [(2, 2, 1), (1, 0, 0)]
+
+
+@pytest.mark.asyncio
+async def test_sessions(storage):
+    await storage.save_session("a", "data")
+    await storage.save_session("b", "old", max_age=-1)
+    assert await storage.load_session("a") == "data"
+    assert await storage.load_session("b") is None
+    assert await storage.load_session("c") is None
+
+
+def test_engines_have_to_implement_the_whole_interface():
+    class Incomplete(Storage):
+        async def find_user(self, query, fields=None):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_sqlite_indexed_conditions():
+    _, parameters, covered = SqliteStorage.where(
+        {"_id": {"$gt": "a"}, "cards": "deadbeef"}
+    )
+    assert parameters == ["a", "deadbeef"]
+    assert covered
+    assert SqliteStorage.where({"tokens.token": "secret", "username": "a"})[2]
+    # checked on the documents
+    assert not SqliteStorage.where({"cards": "deadbeef", "permissions": "enter"})[2]
+    assert not SqliteStorage.where({"username": {"$regex": "^a"}})[2]
+
+
+@pytest.mark.asyncio
+async def test_counting_and_keyset_conditions(storage):
+    ids = await storage.insert_users(
+        [
+            {"username": name, "permissions": ["enter"], "cards": [f"{i:08x}"]}
+            for i, name in enumerate(["a", "b", "c", "d"])
+        ]
+    )
+    assert await storage.count_users({"username": {"$gt": "b"}}) == 2
+    assert await storage.count_users({"cards": "00000001"}) == 1
+    assert await storage.count_users({"cards": "00000001", "username": "a"}) == 0
+    assert await storage.count_users({"username": {"$regex": "^[ab]"}}) == 2
+    assert await storage.count_users({"_id": {"$gt": sorted(ids)[0]}}) == 3
+    user = await storage.find_user({"permissions": "enter"}, ["username"])
+    assert user["username"] in ["a", "b", "c", "d"]
@@ -0,0 +1,54 @@
+"""Routing of serial terminal log entries."""
+
+import pytest
+
+from cherrydoor.interface.terminal import TerminalLog
+
+
+class Writer:
+    """BufferedWriter stand-in that keeps added documents."""
+
+    def __init__(self):
+        self.documents = []
+
+    async def add(self, document):
+        self.documents.append(document)
+
+
+@pytest.mark.asyncio
+async def test_commands_are_routed():
+    writer = Writer()
+    log = TerminalLog(writer, routes={"DOOR": "none"}, door="front")
+    await log.add(["CARD", "abcd"])
+    await log.add(["PONG", "0"])
+    await log.add(["DOOR", "1"])
+    # heartbeats stay in the console only
+    assert [entry["command"] for entry in writer.documents] == ["CARD"]
+    assert writer.documents[0]["arguments"] == ["abcd"]
+    assert writer.documents[0]["door"] == "front"
+    assert [entry["command"] for entry in log.history] == ["CARD", "PONG"]
+    assert log.stats()["routed"] == {"db": 1, "memory": 1, "none": 1}
+
+
+@pytest.mark.asyncio
+async def test_history_is_a_ring_buffer():
+    log = TerminalLog(history=3)
+    for i in range(5):
+        await log.add(["STATUS", str(i)])
+    assert [entry["arguments"] for entry in log.history] == [["2"], ["3"], ["4"]]
+
+
+@pytest.mark.asyncio
+async def test_subscribers_receive_new_entries():
+    log = TerminalLog(default="memory")
+    queue = log.subscribe(maxsize=1)
+    await log.add(["CARD", "a"])
+    # the queue is full, so the entry is dropped for this subscriber only
+    await log.add(["CARD", "b"])
+    assert queue.get_nowait()["arguments"] == ["a"]
+    assert queue.empty()
+    assert len(log.history) == 2
+    log.unsubscribe(queue)
+    await log.add(["CARD", "c"])
+    assert queue.empty()
+    assert log.stats()["subscribers"] == 0
@@ -0,0 +1,207 @@
+"""Migration of entry logs to a time-series collection."""
+
+import datetime as dt
+
+from cherrydoor.cli.update_scripts.timeseries_logs import (
+    LEGACY_COLLECTION,
+    MIGRATION_SETTING,
+    database_pending,
+    migrate_logs,
+)
+from cherrydoor.database.schema import desired_schema, plan_collection
+
+CONFIG = {"logs": {"timeseries": {"enabled": True}}}
+
+
+def matches(document, query):
+    """Check a document against the query operators used by the migration."""
+    for field, condition in query.items():
+        value = document.get(field, None)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, argument in condition.items():
+            if operator == "$type" and not isinstance(value, dt.datetime):
+                return False
+            if operator == "$gt" and not value > argument:
+                return False
+            if operator == "$gte" and not value >= argument:
+                return False
+            if operator == "$lte" and not value <= argument:
+                return False
+            if operator == "$in" and value not in argument:
+                return False
+    return True
+
+
+class Cursor(list):
+    def sort(self, key, direction=1):
+        return Cursor(sorted(self, key=lambda document: document[key]))
+
+    def limit(self, count):
+        return Cursor(self[:count])
+
+
+class Collection:
+    """The part of a pymongo collection used by the migration and the schema manager."""
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.documents = []
+        self.collection_options = {}
+        self.indexes = {}
+
+    def find(self, query, projection=None):
+        return Cursor(
+            dict(document) for document in self.documents if matches(document, query)
+        )
+
+    def find_one(self, query):
+        return next(iter(self.find(query)), None)
+
+    def insert_many(self, documents, ordered=True):
+        self.db.created.add(self.name)
+        self.documents += [dict(document) for document in documents]
+
+    def update_one(self, query, update, upsert=False):
+        document = self.find_one(query)
+        if document is None:
+            self.insert_many([{**query, **update["$set"]}])
+            return
+        for stored in self.documents:
+            if matches(stored, query):
+                stored.update(update["$set"])
+
+    def rename(self, name):
+        self.db.collections[name] = self
+        self.db.created.add(name)
+        self.db.created.discard(self.name)
+        del self.db.collections[self.name]
+        self.name = name
+
+    def options(self):
+        return self.collection_options
+
+    def index_information(self):
+        return {"_id_": {"key": [("_id", 1)]}, **self.indexes}
+
+    def create_indexes(self, models):
+        for model in models:
+            document = dict(model.document)
+            name = document.pop("name")
+            self.indexes[name] = {"key": list(document.pop("key").items()), **document}
+
+
+class Database:
+    def __init__(self):
+        self.collections = {}
+        self.created = set()
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = Collection(self, name)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def list_collection_names(self):
+        return sorted(self.created)
+
+    def list_collections(self, filter=None):
+        return iter(
+            {"name": name, "options": self[name].collection_options}
+            for name in self.created
+            if filter is None or filter["name"] == name
+        )
+
+    def create_collection(self, name, **options):
+        self.created.add(name)
+        self[name].collection_options = options
+
+    def command(self, operation, collection, **arguments):
+        pass
+
+
+def old_logs(db, count):
+    start = dt.datetime(2021, 3, 4)
+    db.logs.insert_many(
+        [
+            {"_id": i, "timestamp": start + dt.timedelta(minutes=i), "card": "ab"}
+            for i in range(count)
+        ]
+        # not a valid entry, so it's not copied
+        + [{"_id": count, "timestamp": "yesterday"}]
+    )
+
+
+def test_timeseries_logs_schema():
+    spec = desired_schema(
+        {"logs": {"retention": 3600, "timeseries": {"enabled": True}}}
+    )["logs"]
+    operations = plan_collection("logs", spec, False, {}, {})
+    # documents expire with a collection option instead of a TTL index
+    assert operations[0] == (
+        "create_collection",
+        {
+            "timeseries": {
+                "timeField": "timestamp",
+                "metaField": "door",
+                "granularity": "minutes",
+            },
+            "expireAfterSeconds": 3600,
+        },
+    )
+    assert "expireAfterSeconds" not in operations[1][1]["indexes"][0].document
+    # granularity can only be changed with collMod
+    spec["timeseries"]["granularity"] = "hours"
+    options = {
+        "timeseries": {"timeField": "timestamp", "granularity": "minutes"},
+        "expireAfterSeconds": 3600,
+    }
+    indexes = Collection(None, "logs")
+    indexes.create_indexes(operations[1][1]["indexes"])
+    assert plan_collection("logs", spec, True, options, indexes.indexes) == [
+        ("collMod", {"timeseries": {"granularity": "hours"}})
+    ]
+
+
+def test_logs_are_copied_in_batches():
+    db = Database()
+    old_logs(db, 5)
+    migrate_logs(db, CONFIG, batch_size=2)
+    assert "timeseries" in db.logs.collection_options
+    assert [document["_id"] for document in db.logs.documents] == list(range(5))
+    assert len(db[LEGACY_COLLECTION].documents) == 6
+    progress = db.settings.find_one({"setting": MIGRATION_SETTING})["value"]
+    assert progress == {"state": "done", "last_id": 4, "copied": 5}
+    assert not database_pending(db)
+
+
+def test_interrupted_migration_is_resumed_without_duplicates():
+    db = Database()
+    old_logs(db, 5)
+    db.logs.rename(LEGACY_COLLECTION)
+    db.create_collection("logs", timeseries={"timeField": "timestamp"})
+    # interrupted after inserting the second batch, before its progress was saved
+    db.logs.insert_many(db[LEGACY_COLLECTION].documents[:4])
+    db.settings.update_one(
+        {"setting": MIGRATION_SETTING},
+        {"$set": {"value": {"state": "copying", "last_id": 1, "copied": 2}}},
+        upsert=True,
+    )
+    assert database_pending(db)
+    migrate_logs(db, CONFIG, batch_size=2)
+    assert [document["_id"] for document in db.logs.documents] == list(range(5))
+    assert not database_pending(db)
+
+
+def test_nothing_to_migrate():
+    db = Database()
+    migrate_logs(db, CONFIG)
+    assert LEGACY_COLLECTION not in db.list_collection_names()
+    assert not database_pending(db)
+    progress = db.settings.find_one({"setting": MIGRATION_SETTING})["value"]
+    assert progress["state"] == "done"
@@ -0,0 +1,78 @@
+"""Non-blocking serial transport."""
+
+import asyncio
+import os
+import pty
+import tty
+
+import pytest
+from serial.serialutil import SerialException
+
+from cherrydoor.interface.transport import SerialTransport
+
+
+@pytest.fixture
+def terminal():
+    """Pseudo-terminal - yields the master fd and the path of the port."""
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    yield master, os.ttyname(slave)
+    os.close(master)
+    os.close(slave)
+
+
+@pytest.mark.asyncio
+async def test_commands_are_parsed_from_the_buffer(terminal):
+    master, port = terminal
+    transport = SerialTransport(port, loop=asyncio.get_event_loop())
+    try:
+        os.write(master, b"CARD 0a1b2c3d\r\nPONG 1  \n\nENTRY 1:ab \xff\nST")
+        assert await transport.readcommand_async() == ["CARD", "0a1b2c3d"]
+        assert await transport.readcommand_async() == ["PONG", "1"]
+        assert await transport.readcommand_async() == [""]
+        assert await transport.readcommand_async() == ["ENTRY", "1:ab", ""]
+        reader = asyncio.ensure_future(transport.readcommand_async())
+        await asyncio.sleep(0.01)
+        # the line isn't complete yet
+        assert not reader.done()
+        os.write(master, b"ATUS 0\nPING\n")
+        assert await asyncio.wait_for(reader, 1) == ["STATUS", "0"]
+        assert await transport.readline_async() == b"PING\n"
+        assert not transport.buffer
+    finally:
+        transport.close()
+
+
+@pytest.mark.asyncio
+async def test_parsing_matches_decoding_the_line(terminal):
+    master, port = terminal
+    transport = SerialTransport(port, loop=asyncio.get_event_loop())
+    lines = [
+        b"A",
+        b" B",
+        b"C  D",
+        b"E \t",
+        b"@01 AUTH 1*7F",
+        b"\xc5\xbc\xc3\xb3 \xc5\x82",
+    ]
+    try:
+        os.write(master, b"\n".join(lines) + b"\n")
+        for line in lines:
+            expected = line.decode("utf-8", errors="ignore").rstrip().split(" ")
+            assert await transport.readcommand_async() == expected
+    finally:
+        transport.close()
+
+
+@pytest.mark.asyncio
+async def test_write_and_disconnect(terminal):
+    master, port = terminal
+    transport = SerialTransport(port, loop=asyncio.get_event_loop())
+    assert await transport.write_async(b"AUTH 1\n") == 7
+    assert os.read(master, 100) == b"AUTH 1\n"
+    reader = asyncio.ensure_future(transport.readcommand_async())
+    await asyncio.sleep(0.01)
+    transport.fail(SerialException("device disconnected"))
+    with pytest.raises(SerialException):
+        await reader
+    transport.close()